@@ -13,12 +13,18 @@ def cm_to_inch(*vals):
 
 
 
-def output_stats_to_file(expt_name, output_dir, filename, tracker, stats):
+def output_stats_to_file(expt_name, output_dir, filename, tracker, stats, num_clds=None, num_groups=None):
+    """Totals default to those of tracker - pass them when it does not hold every cloud and group (e.g. when
+    appending to an archive)."""
+    if num_clds is None:
+        num_clds = len(tracker.all_clds)
+    if num_groups is None:
+        num_groups = len(tracker.groups)
     with open(os.path.join(output_dir, filename), 'w') as f:
         f.write(expt_name + '\n')
 
-        f.write('Total Clouds: {}\n'.format(len(tracker.all_clds)))
-        f.write('Total Groups: {}\n'.format(len(tracker.groups)))
+        f.write('Total Clouds: {}\n'.format(num_clds))
+        f.write('Total Groups: {}\n'.format(num_groups))
 
         f.write('group_type,count,num_clouds,mean_lifetime\n')
         for key, stat in stats.items():
@@ -152,6 +158,15 @@ def update_stat(stat, group, curr_lifetimes):
 
 
 def generate_stats(expt_name, tracker):
+    return group_stats(tracker.groups)
+
+
+def group_stats(groups):
+    """Counts and lifetimes of each type of group, as returned by `generate_stats`.
+
+    :param list groups: CloudGroups.
+    :return OrderedDict: group type -> counts, and lifetime arrays.
+    """
     stats = OrderedDict()
     for group_type in ['linear', 'merges_only', 'splits_only',
                        'merges_and_splits', 'merges_or_splits', 'complex', 'all']:
@@ -161,7 +176,7 @@ def generate_stats(expt_name, tracker):
     linear_lifetimes = []
     nonlinear_lifetimes = []
 
-    for group in tracker.groups:
+    for group in groups:
         curr_lifetimes = [c.lifetime for c in group.end_clouds]
         all_lifetimes.extend(curr_lifetimes)
 
@@ -197,3 +212,48 @@ def generate_stats(expt_name, tracker):
     stats['nonlinear_lifetimes'] = np.array(nonlinear_lifetimes) * 5
 
     return stats
+
+
+def combine_stats(*all_stats):
+    """Stats of all the groups of each of all_stats, e.g. of groups written to an archive at different times.
+
+    :param all_stats: stats from `group_stats`.
+    :return OrderedDict: combined stats.
+    """
+    stats = OrderedDict()
+    for key, stat in all_stats[0].items():
+        if isinstance(stat, dict):
+            stats[key] = {name: sum(s[key][name] for s in all_stats) for name in stat}
+        else:
+            stats[key] = np.concatenate([s[key] for s in all_stats]).astype(int)
+    return stats
+
+
+def stats_to_meta(stats):
+    """JSON serializable version of stats - lifetimes are stored as counts of each lifetime.
+
+    :param OrderedDict stats: stats from `group_stats`.
+    :return dict: for `stats_from_meta`.
+    """
+    meta = {}
+    for key, stat in stats.items():
+        if isinstance(stat, dict):
+            meta[key] = {name: int(value) for name, value in stat.items()}
+        else:
+            meta[key] = [int(count) for count in np.bincount(np.asarray(stat, dtype=int))]
+    return meta
+
+
+def stats_from_meta(meta):
+    """Inverse of `stats_to_meta`, with lifetimes in increasing order.
+
+    :param dict meta: from `stats_to_meta`.
+    :return OrderedDict: stats.
+    """
+    stats = group_stats([])
+    for key in stats:
+        if isinstance(stats[key], dict):
+            stats[key] = dict(meta[key])
+        else:
+            stats[key] = np.repeat(np.arange(len(meta[key])), meta[key])
+    return stats
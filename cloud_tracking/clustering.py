@@ -0,0 +1,96 @@
+"""Clustering of clouds at the same timestep.
+
+Clouds are clustered if they are linked by a chain of neighbours, where clouds are neighbours if
+their centroids are within a given distance of each other on the periodic domain. Neighbours are
+found with a cell list: positions are binned into cells at least as large as the distance, so only
+points in the same or adjacent cells are compared, instead of all pairs of clouds.
+"""
+from logging import getLogger
+
+import numpy as np
+
+from cloud_tracking.utils import dist
+
+logger = getLogger('ct.clustering')
+
+
+def periodic_pairs(pos, max_dist, domain_size):
+    """Find all pairs of positions within max_dist of each other on a periodic 2D domain.
+
+    :param np.ndarray pos: (n, 2) array of positions.
+    :param float max_dist: max distance between pairs.
+    :param tuple domain_size: size of periodic domain along each axis.
+    :return tuple(np.ndarray, np.ndarray): i and j of each pair, with i < j.
+    """
+    pos = np.asarray(pos, dtype=float).reshape(-1, 2)
+    domain_size = np.asarray(domain_size, dtype=float)
+    if max_dist <= 0 or len(pos) < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    pos = pos % domain_size
+    num_cells = np.maximum(1, (domain_size // max_dist).astype(np.int64))
+    cell = np.minimum((pos / (domain_size / num_cells)).astype(np.int64), num_cells - 1)
+    cell_id = cell[:, 0] * num_cells[1] + cell[:, 1]
+
+    order = np.argsort(cell_id, kind='stable')
+    cell_start = np.searchsorted(cell_id[order], np.arange(num_cells[0] * num_cells[1] + 1))
+    # With fewer than 3 cells in an axis, some neighbouring cells are the same cell.
+    offsets = set(((d0 % num_cells[0]), (d1 % num_cells[1])) for d0 in (-1, 0, 1) for d1 in (-1, 0, 1))
+
+    all_i, all_j = [], []
+    for d0, d1 in offsets:
+        neighbour = ((cell[:, 0] + d0) % num_cells[0]) * num_cells[1] + (cell[:, 1] + d1) % num_cells[1]
+        start = cell_start[neighbour]
+        counts = cell_start[neighbour + 1] - start
+        i = np.repeat(np.arange(len(pos)), counts)
+        # Position of each candidate within its neighbouring cell.
+        within = np.arange(len(i)) - np.repeat(np.cumsum(counts) - counts, counts)
+        j = order[np.repeat(start, counts) + within]
+        keep = i < j
+        all_i.append(i[keep])
+        all_j.append(j[keep])
+    i = np.concatenate(all_i)
+    j = np.concatenate(all_j)
+    close = dist(pos[i].T, pos[j].T, domain_size) <= max_dist
+    return i[close], j[close]
+
+
+def connected_components(num_nodes, i, j):
+    """Label connected components of the graph with edges i - j.
+
+    :param int num_nodes: number of nodes.
+    :param np.ndarray i: first node of each edge.
+    :param np.ndarray j: second node of each edge.
+    :return np.ndarray: component of each node, numbered from 0 in order of first node.
+    """
+    component = np.arange(num_nodes)
+    i = np.asarray(i)
+    j = np.asarray(j)
+    while len(i):
+        # Hook the larger root of each edge joining two trees onto the smaller one. Every tree is either hooked
+        # or has another hooked onto it, so the number of trees at least halves in each round.
+        root_i = component[i]
+        root_j = component[j]
+        joins = root_i != root_j
+        if not np.any(joins):
+            break
+        i, j, root_i, root_j = i[joins], j[joins], root_i[joins], root_j[joins]
+        np.minimum.at(component, np.maximum(root_i, root_j), np.minimum(root_i, root_j))
+        # Shortcut chains of pointers, so each node points at its root (the smallest node of its tree).
+        while True:
+            next_component = component[component]
+            if np.all(next_component == component):
+                break
+            component = next_component
+    return np.unique(component, return_inverse=True)[1]
+
+
+def cluster_positions(pos, max_dist, domain_size):
+    """Cluster positions that are connected by chains of neighbours within max_dist.
+
+    :param np.ndarray pos: (n, 2) array of positions.
+    :param float max_dist: max distance between neighbours.
+    :param tuple domain_size: size of periodic domain along each axis.
+    :return np.ndarray: cluster index of each position.
+    """
+    i, j = periodic_pairs(pos, max_dist, domain_size)
+    return connected_components(len(pos), i, j)
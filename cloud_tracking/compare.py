@@ -0,0 +1,266 @@
+"""Comparison of the output of two tracking runs, e.g. before and after an optimization, or on two machines.
+
+Clouds are matched on (time_index, label) and edges on the pair of clouds they link, so the two runs do not
+need to have made their clouds in the same order. Edges, per-cloud and per-edge columns (fractions,
+lifetimes, sizes...) and group membership are all compared with set operations on sorted arrays of keys, so
+that runs with millions of clouds can be compared in seconds.
+
+Runs are passed as a Tracker, a (cloud table path, edge table path) pair written by `export`, or a
+(cloud table, edge table) pair of dicts of column name -> np.ndarray.
+"""
+from collections import OrderedDict
+from logging import getLogger
+
+import numpy as np
+
+from cloud_tracking.export import cloud_table_chunks, edge_table_chunks, _format_for
+from cloud_tracking.utils import cloud_ids, split_cloud_ids
+
+logger = getLogger('ct.compare')
+
+# Columns used to match rows, so not compared as values.
+CLOUD_KEY_COLUMNS = ['id', 'time_index', 'label', 'group']
+EDGE_KEY_COLUMNS = ['prev_id', 'next_id', 'time_index', 'prev_label', 'next_label', 'group']
+
+
+def _concat_chunks(chunks):
+    columns = OrderedDict()
+    for chunk in chunks:
+        for name, values in chunk.items():
+            columns.setdefault(name, []).append(values)
+    return OrderedDict((name, np.concatenate(values)) for name, values in columns.items())
+
+
+def read_table(path, fmt=None):
+    """Read a table written by `export`.
+
+    :param str path: file to read.
+    :param str fmt: one of export.EXPORT_FORMATS, taken from path's extension if None.
+    :return OrderedDict: column name -> np.ndarray.
+    """
+    fmt = _format_for(path, fmt)
+    if fmt == 'csv':
+        data = np.genfromtxt(path, delimiter=',', names=True, dtype=None, encoding='ascii')
+        return OrderedDict((name, np.atleast_1d(data[name])) for name in data.dtype.names)
+    elif fmt == 'npz':
+        with np.load(path) as data:
+            return OrderedDict((name, data[name]) for name in data.files)
+    elif fmt == 'nc':
+        import netCDF4
+
+        with netCDF4.Dataset(path) as ds:
+            return OrderedDict((name, np.asarray(var[:])) for name, var in ds.variables.items())
+
+
+def run_tables(run):
+    """Cloud and edge tables of a run.
+
+    :param run: Tracker, (cloud table path, edge table path) or (cloud table, edge table).
+    :return tuple(OrderedDict, OrderedDict): cloud table, edge table.
+    """
+    if hasattr(run, 'clds_at_time'):
+        return _concat_chunks(cloud_table_chunks(run)), _concat_chunks(edge_table_chunks(run))
+    cld_table, edge_table = run
+    if isinstance(cld_table, str):
+        cld_table = read_table(cld_table)
+    if isinstance(edge_table, str):
+        edge_table = read_table(edge_table)
+    return cld_table, edge_table
+
+
+def _column(table, name):
+    # Tables of runs without any clouds or edges have no columns.
+    return table.get(name, np.zeros(0, dtype=np.int64))
+
+
+def _edge_cloud_ids(edge_table):
+    # Edges always link a cloud to one at the next time index.
+    time_index = _column(edge_table, 'time_index')
+    return (cloud_ids(time_index, _column(edge_table, 'prev_label')),
+            cloud_ids(time_index + 1, _column(edge_table, 'next_label')))
+
+
+def _match(keys_a, keys_b):
+    """Keys only in a, only in b, and indices into a and b of the common keys."""
+    _, index_a, index_b = np.intersect1d(keys_a, keys_b, assume_unique=True, return_indices=True)
+    only_a = np.setdiff1d(keys_a, keys_b, assume_unique=True)
+    only_b = np.setdiff1d(keys_b, keys_a, assume_unique=True)
+    return only_a, only_b, index_a, index_b
+
+
+def _differs(values_a, values_b, rtol, atol):
+    """Mask of rows that differ, treating NaNs as equal."""
+    if values_a.dtype.kind == 'f' or values_b.dtype.kind == 'f':
+        differs = ~np.isclose(values_a, values_b, rtol=rtol, atol=atol, equal_nan=True)
+    else:
+        differs = values_a != values_b
+    return differs.reshape(len(differs), -1).any(axis=1)
+
+
+def _column_diffs(table_a, table_b, key_columns, index_a, index_b, rtol, atol):
+    """Column name -> indices (into index_a/b) of matched rows that differ, for columns in both tables."""
+    diffs = OrderedDict()
+    for name in table_a:
+        if name in key_columns or name not in table_b:
+            continue
+        values_a, values_b = table_a[name][index_a], table_b[name][index_b]
+        if values_a.shape[1:] != values_b.shape[1:]:
+            logger.warning('Column {} has different shapes, not compared'.format(name))
+            continue
+        diffs[name] = np.flatnonzero(_differs(values_a, values_b, rtol, atol))
+    return diffs
+
+
+def _group_mismatches(groups_a, groups_b):
+    """Indices of clouds whose group does not contain the same (matched) clouds in both runs.
+
+    Groups are the same iff each group in a maps onto exactly one group in b, and vice versa.
+    """
+    grouped_a, grouped_b = groups_a >= 0, groups_b >= 0
+    both = grouped_a & grouped_b
+    # Unique pairs of (group in a, group in b), then number of partners of each group.
+    num_groups_b = groups_b.max(initial=-1) + 1
+    pairs = np.unique(groups_a[both].astype(np.int64) * num_groups_b + groups_b[both])
+    partners_a = np.bincount(pairs // num_groups_b, minlength=groups_a.max(initial=-1) + 1)
+    partners_b = np.bincount(pairs % num_groups_b, minlength=num_groups_b)
+    mismatch = grouped_a != grouped_b
+    mismatch[both] = (partners_a[groups_a[both]] > 1) | (partners_b[groups_b[both]] > 1)
+    return np.flatnonzero(mismatch)
+
+
+class RunDiff(object):
+    """Differences between two tracking runs, a and b. Clouds are given by their ids (see `utils.cloud_ids`),
+    and edges by (prev cloud id, next cloud id) pairs."""
+    def __init__(self, num_clouds, num_edges, num_groups, clouds_only_a, clouds_only_b, edges_only_a,
+                 edges_only_b, cloud_columns, edge_columns, group_mismatches):
+        """
+        :param tuple num_clouds: number of clouds in a and b.
+        :param tuple num_edges: number of edges in a and b.
+        :param tuple num_groups: number of groups in a and b.
+        :param np.ndarray clouds_only_a: ids of clouds only in a.
+        :param np.ndarray clouds_only_b: ids of clouds only in b.
+        :param np.ndarray edges_only_a: (n, 2) edges only in a.
+        :param np.ndarray edges_only_b: (n, 2) edges only in b.
+        :param OrderedDict cloud_columns: column name -> ids of clouds in both with different values.
+        :param OrderedDict edge_columns: column name -> (n, 2) edges in both with different values.
+        :param np.ndarray group_mismatches: ids of clouds in both whose groups have different clouds.
+        """
+        self.num_clouds = num_clouds
+        self.num_edges = num_edges
+        self.num_groups = num_groups
+        self.clouds_only_a = clouds_only_a
+        self.clouds_only_b = clouds_only_b
+        self.edges_only_a = edges_only_a
+        self.edges_only_b = edges_only_b
+        self.cloud_columns = cloud_columns
+        self.edge_columns = edge_columns
+        self.group_mismatches = group_mismatches
+
+    def _cloud_diffs(self):
+        diffs = OrderedDict([('clouds only in a', self.clouds_only_a), ('clouds only in b', self.clouds_only_b)])
+        diffs['edges only in a'] = self.edges_only_a[:, 0]
+        diffs['edges only in b'] = self.edges_only_b[:, 0]
+        for name, ids in self.cloud_columns.items():
+            diffs['cloud ' + name] = ids
+        for name, edges in self.edge_columns.items():
+            diffs['edge ' + name] = edges[:, 0]
+        diffs['group membership'] = self.group_mismatches
+        return diffs
+
+    def divergent_time_indices(self):
+        """
+        :return OrderedDict: kind of difference -> time index of first difference of that kind, for kinds
+            with any differences. Edges are placed at the time index of their prev cloud.
+        """
+        return OrderedDict((kind, int(split_cloud_ids(ids)[0].min()))
+                           for kind, ids in self._cloud_diffs().items() if len(ids))
+
+    @property
+    def first_divergent_time_index(self):
+        """Earliest time index with any difference, or None if the runs are the same.
+
+        A group with different clouds is reported from the start of the group, before the different edges
+        that caused it, so group membership is only used if there are no other differences.
+        """
+        time_indices = self.divergent_time_indices()
+        if not time_indices:
+            return None
+        direct = [t for kind, t in time_indices.items() if kind != 'group membership']
+        return min(direct or time_indices.values())
+
+    @property
+    def identical(self):
+        return self.first_divergent_time_index is None
+
+    def report(self, max_examples=5):
+        """
+        :param int max_examples: max number of clouds to list for each kind of difference.
+        :return str: human readable summary of differences.
+        """
+        lines = ['Clouds: {} / {}'.format(*self.num_clouds),
+                 'Edges: {} / {}'.format(*self.num_edges),
+                 'Groups: {} / {}'.format(*self.num_groups)]
+        first_time_index = self.first_divergent_time_index
+        if first_time_index is None:
+            lines.append('Runs are identical')
+            return '\n'.join(lines)
+        lines.append('First divergent time index: {}'.format(first_time_index))
+        for kind, ids in self._cloud_diffs().items():
+            if not len(ids):
+                continue
+            time_indices, labels = split_cloud_ids(np.sort(ids))
+            examples = ', '.join('({}, {})'.format(t, l) for t, l in zip(time_indices[:max_examples],
+                                                                          labels[:max_examples]))
+            lines.append('  {}: {} (first at time index {}: {})'.format(kind, len(ids), time_indices[0],
+                                                                        examples))
+        return '\n'.join(lines)
+
+
+def compare_runs(run_a, run_b, rtol=1e-5, atol=1e-8):
+    """Compare two tracking runs.
+
+    :param run_a: Tracker, (cloud table path, edge table path) or (cloud table, edge table).
+    :param run_b: as run_a.
+    :param float rtol: relative tolerance of float columns.
+    :param float atol: absolute tolerance of float columns.
+    :return RunDiff: differences between runs.
+    """
+    cld_table_a, edge_table_a = run_tables(run_a)
+    cld_table_b, edge_table_b = run_tables(run_b)
+    ids_a = cloud_ids(_column(cld_table_a, 'time_index'), _column(cld_table_a, 'label'))
+    ids_b = cloud_ids(_column(cld_table_b, 'time_index'), _column(cld_table_b, 'label'))
+    groups_a, groups_b = _column(cld_table_a, 'group'), _column(cld_table_b, 'group')
+    clouds_only_a, clouds_only_b, cld_index_a, cld_index_b = _match(ids_a, ids_b)
+
+    # Number every cloud in either run, so that an edge is one int64: prev number * count + next number.
+    edge_ids_a = _edge_cloud_ids(edge_table_a)
+    edge_ids_b = _edge_cloud_ids(edge_table_b)
+    all_ids = np.unique(np.concatenate((ids_a, ids_b) + edge_ids_a + edge_ids_b))
+    assert len(all_ids) < 2**31, 'Too many clouds to number edges'
+
+    def edge_keys(prev_ids, next_ids):
+        return np.searchsorted(all_ids, prev_ids) * len(all_ids) + np.searchsorted(all_ids, next_ids)
+
+    def key_edges(keys):
+        return np.stack([all_ids[keys // len(all_ids)], all_ids[keys % len(all_ids)]], axis=1)
+
+    keys_a, keys_b = edge_keys(*edge_ids_a), edge_keys(*edge_ids_b)
+    edges_only_a, edges_only_b, edge_index_a, edge_index_b = _match(keys_a, keys_b)
+
+    cloud_columns = OrderedDict(
+        (name, ids_a[cld_index_a[rows]])
+        for name, rows in _column_diffs(cld_table_a, cld_table_b, CLOUD_KEY_COLUMNS,
+                                        cld_index_a, cld_index_b, rtol, atol).items())
+    edge_columns = OrderedDict(
+        (name, key_edges(keys_a[edge_index_a[rows]]))
+        for name, rows in _column_diffs(edge_table_a, edge_table_b, EDGE_KEY_COLUMNS,
+                                        edge_index_a, edge_index_b, rtol, atol).items())
+    group_rows = _group_mismatches(groups_a[cld_index_a], groups_b[cld_index_b])
+
+    diff = RunDiff((len(ids_a), len(ids_b)), (len(keys_a), len(keys_b)),
+                   tuple(len(np.unique(groups[groups >= 0])) for groups in [groups_a, groups_b]),
+                   clouds_only_a, clouds_only_b, key_edges(edges_only_a), key_edges(edges_only_b),
+                   cloud_columns, edge_columns, ids_a[cld_index_a[group_rows]])
+    logger.debug('First divergent time index: {}'.format(diff.first_divergent_time_index))
+    return diff
+
@@ -7,8 +7,38 @@ and thus the displacement vector for a storm
 """
 # Originally from Thorwald Stein and Juwon Kim's tracking code: cellTrack.
 
+from logging import getLogger
+from timeit import default_timer as timer
+
 import numpy as np
 
+logger = getLogger('ct.correlated_distance')
+
+# Max number of tiles to transform at once in `shift_correlations`.
+TILE_CHUNK_SIZE = 256
+
+
+def _window(s1, method):
+    """Tapering window applied to fields before correlating (see `correlate`)."""
+    leno = max(np.size(s1, 0), np.size(s1, 1))
+
+    if method == 1:
+        alpha = max(0.1, 10.0 / leno)
+        xhan = np.array(np.arange(0.5, leno + 0.5))
+        hann1 = np.ones([np.size(xhan)])
+        hann1[np.where(xhan < alpha * leno / 2.)] = 0.5 * (
+            1 + np.cos(np.pi * (2 * xhan[np.where(xhan < alpha * leno / 2.)] / (alpha * leno) - 1)))
+        hann1[np.where(xhan > leno * (1 - alpha / 2.))] = 0.5 * (
+            1 + np.cos(np.pi * (2 * xhan[np.where(xhan > leno * (1 - alpha / 2.))] / (alpha * leno) - 2. / alpha + 1)))
+        hann2 = hann1.conj().transpose() * hann1
+    elif method == 2:
+        xhan = np.array(np.arange(0.5, leno + 0.5))
+        hann1 = np.ones([np.size(xhan)])
+        hann2 = hann1.conj().transpose() * hann1
+    else:
+        raise ValueError('method must be 1 or 2')
+    return hann2
+
 
 def correlate(s1, s2, method=1):
     """
@@ -37,23 +67,7 @@ def correlate(s1, s2, method=1):
     # dy = distance in y-direction from previous cell
     # amp = amplitude
     ##############################################################
-    leno = max(np.size(s1, 0), np.size(s1, 1))
-
-    if method == 1:
-        alpha = max(0.1, 10.0 / leno)
-        xhan = np.array(np.arange(0.5, leno + 0.5))
-        hann1 = np.ones([np.size(xhan)])
-        hann1[np.where(xhan < alpha * leno / 2.)] = 0.5 * (
-            1 + np.cos(np.pi * (2 * xhan[np.where(xhan < alpha * leno / 2.)] / (alpha * leno) - 1)))
-        hann1[np.where(xhan > leno * (1 - alpha / 2.))] = 0.5 * (
-            1 + np.cos(np.pi * (2 * xhan[np.where(xhan > leno * (1 - alpha / 2.))] / (alpha * leno) - 2. / alpha + 1)))
-        hann2 = hann1.conj().transpose() * hann1
-    elif method == 2:
-        xhan = np.array(np.arange(0.5, leno + 0.5))
-        hann1 = np.ones([np.size(xhan)])
-        hann2 = hann1.conj().transpose() * hann1
-    else:
-        raise ValueError('method must be 1 or 2')
+    hann2 = _window(s1, method)
 
     # FIND CONVOLUTION S1, S2 USING FFT
 
@@ -76,3 +90,205 @@ def correlate(s1, s2, method=1):
     amp = val / normval
 
     return dx, dy, amp
+
+
+def _block_mean(s, factor):
+    ny, nx = s.shape
+    return s.reshape(ny // factor, factor, nx // factor, factor).mean(axis=(1, 3))
+
+
+def _cloudy_tiles(s, tile):
+    """Which tile x tile blocks of s (padded with zeros to a whole number of tiles) are non-zero."""
+    ny, nx = s.shape
+    padded = np.zeros((-(-ny // tile) * tile, -(-nx // tile) * tile), dtype=bool)
+    padded[:ny, :nx] = s != 0
+    return padded.reshape(padded.shape[0] // tile, tile, padded.shape[1] // tile, tile).any(axis=(1, 3))
+
+
+def shift_correlations(s1, s2, dy, dx, radius, method=1, tile=None):
+    """
+    Correlation amplitude (as returned by `correlate`) of s1 and s2 at displacements within radius of dy, dx.
+
+    s1 is split into tiles, and each tile that is not all zero is correlated with the part of s2 it can be
+    displaced onto with a small FFT. The FFTs of all tiles are summed before transforming back, so the cost
+    is in proportion to the number of cloudy tiles.
+
+    :param ndarray s1: old field.
+    :param ndarray s2: new field.
+    :param int dy: centre displacement in y-direction.
+    :param int dx: centre displacement in x-direction.
+    :param int radius: max distance (in grid-cells) from the centre.
+    :param method: (optional) method to use - 1 or 2
+    :param int tile: size of tiles, defaults to 8 * radius.
+    :return ndarray: (2 * radius + 1, 2 * radius + 1) array of amplitudes at displacements
+        (dy - radius ... dy + radius, dx - radius ... dx + radius).
+    """
+    ny, nx = s1.shape
+    if tile is None:
+        tile = 8 * max(radius, 1)
+    hann2 = _window(s1, method)
+    b1 = s1 * hann2
+    b2 = s2 * hann2
+    # Correlation of the mean removed fields at each displacement is sum(b2 * roll(b1)) - N * mean1 * mean2.
+    sum1 = np.sum(b1)
+    sum2 = np.sum(b2)
+    offset = sum1 * sum2 / b1.size
+    normval = np.sqrt((np.sum(b1 * b1) - sum1 ** 2 / b1.size) * (np.sum(b2 * b2) - sum2 ** 2 / b2.size))
+
+    # Each cloudy tile of b1, at [i, j], can be displaced onto b2[i + dy - radius:i + dy + radius + tile, ...]
+    # (wrapped around the domain). Both are zero padded to tile + 2 * radius.
+    size = tile + 2 * radius
+    tile_ys, tile_xs = np.nonzero(_cloudy_tiles(b1, tile))
+    if ny % tile or nx % tile:
+        b1 = np.pad(b1, ((0, -ny % tile), (0, -nx % tile)))
+    spectrum = np.zeros((size, size // 2 + 1), dtype=complex)
+    # Tiles are transformed a chunk at a time, to limit memory use.
+    for start in range(0, len(tile_ys), TILE_CHUNK_SIZE):
+        rows = tile_ys[start:start + TILE_CHUNK_SIZE, None] * tile + np.arange(size)
+        cols = tile_xs[start:start + TILE_CHUNK_SIZE, None] * tile + np.arange(size)
+        b1_tiles = np.zeros((len(rows), size, size))
+        b1_tiles[:, :tile, :tile] = b1[rows[:, :tile, None], cols[:, None, :tile]]
+        b2_tiles = b2[(rows[:, :, None] + dy - radius) % ny, (cols[:, None, :] + dx - radius) % nx]
+        # Displacements up to 2 * radius do not wrap around the tiles, as b1 only fills the first tile x tile.
+        spectrum += np.sum(np.fft.rfft2(b2_tiles) * np.fft.rfft2(b1_tiles).conj(), axis=0)
+    ffv = np.fft.irfft2(spectrum, (size, size))[:2 * radius + 1, :2 * radius + 1]
+    return (ffv - offset) / normval
+
+
+def correlate_pyramid(s1, s2, method=1, factor=4, search_radius=None):
+    """
+    Coarse-to-fine version of `correlate` for large domains.
+
+    Correlates block averaged (cloud fraction) fields with an FFT at 1/factor resolution, then refines
+    the displacement at full resolution, only looking at displacements within search_radius of the
+    coarse peak (see `shift_correlations`). The refinement costs in proportion to the number of cloudy
+    tiles of s1 - when its FFTs would cost more than the full correlation's (e.g. small domains that are
+    mostly cloudy, or large search radii), `correlate` is used instead.
+
+    Gives the same displacement as `correlate` when the full resolution peak is within search_radius of
+    the coarse peak. Fields whose shape is not divisible by factor are correlated with `correlate`.
+
+    e.g. on a 2048x2048 domain, where `correlate` takes 0.6-0.7 s, this takes about 0.2 s at 1-5% cloud cover,
+    0.3 s at 20% and 0.3-0.45 s at 50% (search_radius 4).
+
+    :param ndarray s1: old field.
+    :param ndarray s2: new field.
+    :param method: (optional) method to use - 1 or 2
+    :param int factor: coarsening factor.
+    :param int search_radius: max distance (in grid-cells) from the coarse peak to search, defaults to factor.
+    :return: dx, dy, amp - as for `correlate`.
+    """
+    ny, nx = s1.shape
+    if factor <= 1 or ny % factor or nx % factor:
+        logger.debug('Shape {} not divisible by {} - using full correlation'.format(s1.shape, factor))
+        return correlate(s1, s2, method)
+    if search_radius is None:
+        search_radius = factor
+    tile = 8 * max(search_radius, 1)
+    size = tile + 2 * search_radius
+    # The full correlation's complex FFTs cost about twice as much per grid-cell as the tiles' real ones.
+    tiles_cost = np.sum(_cloudy_tiles(s1, tile)) * size ** 2 * np.log2(size)
+    if 2 * search_radius + 1 > min(ny, nx) or tiles_cost > 0.5 * s1.size * np.log2(s1.size):
+        logger.debug('Refining with radius {} slower than full correlation'.format(search_radius))
+        return correlate(s1, s2, method)
+
+    coarse_dx, coarse_dy, _ = correlate(_block_mean(s1, factor), _block_mean(s2, factor), method)
+    amps = shift_correlations(s1, s2, coarse_dy * factor, coarse_dx * factor, search_radius, method, tile)
+
+    # Candidates are visited in the same order as np.where on the full correlation, so ties are broken the same way.
+    dys = (coarse_dy * factor + np.arange(-search_radius, search_radius + 1)) % ny
+    dxs = (coarse_dx * factor + np.arange(-search_radius, search_radius + 1)) % nx
+    y_order = np.argsort(dys, kind='stable')
+    x_order = np.argsort(dxs, kind='stable')
+    amps = amps[np.ix_(y_order, x_order)]
+    best_y, best_x = np.unravel_index(np.argmax(amps), amps.shape)
+    return dxs[x_order[best_x]], dys[y_order[best_y]], amps[best_y, best_x]
+
+
+CORRELATORS = {
+    'full': correlate,
+    'pyramid': correlate_pyramid,
+}
+
+
+class AdaptiveCorrelator(object):
+    """Reuses the last displacement while the wind is steady, instead of correlating every timestep.
+
+    The last displacement is checked by calculating the correlation at it and its 8 neighbouring
+    displacements only (see `shift_correlations`). It is reused if it is still a local peak with an
+    amplitude of at least min_amp_fraction times that of the last full correlation. Otherwise, or after
+    max_reuse reuses in a row, the full correlation is done.
+    """
+    def __init__(self, correlator=correlate, max_reuse=10, min_amp_fraction=0.9, method=1):
+        """
+        :param correlator: function used for full correlations - e.g. `correlate`.
+        :param int max_reuse: max number of timesteps in a row to reuse a displacement for.
+        :param float min_amp_fraction: min amplitude at the reused displacement, relative to the last full correlation.
+        :param method: (optional) method to use - 1 or 2
+        """
+        self.correlator = correlator
+        self.max_reuse = max_reuse
+        self.min_amp_fraction = min_amp_fraction
+        self.method = method
+        # Last displacement and its amplitude from a full correlation.
+        self.last = None
+        self.ref_amp = None
+        self.num_reused = 0
+        self.num_calls = 0
+        self.num_full = 0
+        self.full_time = 0.
+        self.check_time = 0.
+
+    def __call__(self, s1, s2):
+        self.num_calls += 1
+        if self.last is not None and self.num_reused < self.max_reuse:
+            start = timer()
+            dx, dy = self.last
+            amps = shift_correlations(s1, s2, dy, dx, 1, self.method)
+            self.check_time += timer() - start
+            amp = amps[1, 1]
+            if amp >= amps.max() and amp >= self.min_amp_fraction * self.ref_amp:
+                self.num_reused += 1
+                return dx, dy, amp
+            logger.debug('Displacement {}, {} failed check - correlating'.format(dx, dy))
+
+        start = timer()
+        dx, dy, amp = self.correlator(s1, s2)
+        self.full_time += timer() - start
+        self.num_full += 1
+        self.last = (int(dx), int(dy))
+        self.ref_amp = float(amp)
+        self.num_reused = 0
+        return dx, dy, amp
+
+    def stats(self):
+        """Number of skipped correlations and estimated speed-up over correlating every call.
+
+        :return dict: stats.
+        """
+        stats = {
+            'calls': self.num_calls,
+            'full': self.num_full,
+            'skipped': self.num_calls - self.num_full,
+            'full_time': self.full_time,
+            'check_time': self.check_time,
+        }
+        if self.num_full and self.full_time + self.check_time > 0:
+            stats['speedup'] = (self.num_calls * self.full_time / self.num_full) / (self.full_time + self.check_time)
+        return stats
+
+    def get_state(self):
+        """Settings and last displacement, to carry on after a checkpoint (see `set_state`)."""
+        return {
+            'max_reuse': self.max_reuse,
+            'min_amp_fraction': self.min_amp_fraction,
+            'method': self.method,
+            'last': self.last,
+            'ref_amp': self.ref_amp,
+            'num_reused': self.num_reused,
+        }
+
+    def set_state(self, state):
+        self.last = tuple(state['last']) if state['last'] is not None else None
+        self.ref_amp = state['ref_amp']
+        self.num_reused = state['num_reused']
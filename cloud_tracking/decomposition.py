@@ -0,0 +1,227 @@
+"""Labelling and linking of clouds over horizontal tiles of the domain.
+
+For domains too large to label comfortably in one go, the horizontal domain is split into tiles that
+can be processed in parallel (e.g. with a concurrent.futures executor):
+
+* each tile labels the connected components of its own cloudy grid-cells, ignoring other tiles;
+* pairs of neighbouring grid-cells across tile seams (including the periodic wrap) are found from a
+  one grid-cell halo either side of each seam, and used to merge tile components into clouds;
+* clouds are numbered in the same order as `utils.label_clds`/`label_clds_3d` would number them, so the
+  result is identical to labelling the whole domain at once.
+
+Overlaps between timesteps (`utils.label_pairs`) can be found tile by tile in the same way.
+"""
+from logging import getLogger
+
+import numpy as np
+
+from cloud_tracking.utils import adjacency_shifts
+from cloud_tracking.clustering import connected_components
+
+logger = getLogger('ct.decomposition')
+
+
+def tile_bounds(size, num_tiles):
+    """Start and end of each of num_tiles tiles along an axis of length size."""
+    edges = np.linspace(0, size, num_tiles + 1).astype(int)
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def _map(func, args_list, executor):
+    if executor is None:
+        return [func(*args) for args in args_list]
+    return list(executor.map(func, *zip(*args_list)))
+
+
+def _label_tile(tile, shape, rows, cols, shifts):
+    """Connected components of the cloudy grid-cells of one tile (not periodic).
+
+    :param np.ndarray tile: mask of the tile only, so that only it is sent to a process executor.
+    :param tuple shape: shape of the whole mask.
+    :return tuple(np.ndarray): global flat index of each cloudy grid-cell, and its component.
+    """
+    cells = np.flatnonzero(tile)
+    coords = np.unravel_index(cells, tile.shape)
+    cell_index = np.full(tile.size, -1, dtype=np.int64)
+    cell_index[cells] = np.arange(len(cells))
+    pairs_i, pairs_j = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    for shift in shifts:
+        neighbour = [c + s for c, s in zip(coords, shift)]
+        valid = np.ones(len(cells), dtype=bool)
+        for n, size in zip(neighbour, tile.shape):
+            valid &= (n >= 0) & (n < size)
+        neighbour_index = cell_index[np.ravel_multi_index([n[valid] for n in neighbour], tile.shape)]
+        is_cloudy = neighbour_index >= 0
+        pairs_i.append(np.flatnonzero(valid)[is_cloudy])
+        pairs_j.append(neighbour_index[is_cloudy])
+    component = connected_components(len(cells), np.concatenate(pairs_i), np.concatenate(pairs_j))
+
+    global_coords = list(coords)
+    global_coords[-2] = global_coords[-2] + rows[0]
+    global_coords[-1] = global_coords[-1] + cols[0]
+    return np.ravel_multi_index(global_coords, shape), component
+
+
+def _seam_pairs(mask, row_bounds, col_bounds, shifts, wrap):
+    """Flat indices of all pairs of neighbouring cloudy grid-cells that are on either side of a tile seam."""
+    ny, nx = mask.shape[-2:]
+    seam_rows = set()
+    for start, _ in row_bounds:
+        if start > 0 or wrap:
+            seam_rows.update([(start - 1) % ny, start])
+    seam_cols = set()
+    for start, _ in col_bounds:
+        if start > 0 or wrap:
+            seam_cols.update([(start - 1) % nx, start])
+    halo = np.zeros((ny, nx), dtype=bool)
+    halo[sorted(seam_rows), :] = True
+    halo[:, sorted(seam_cols)] = True
+
+    coords = np.nonzero(mask & halo)
+    pairs_i, pairs_j = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    for shift in shifts:
+        neighbour = [c + s for c, s in zip(coords, shift)]
+        valid = np.ones(len(coords[0]), dtype=bool)
+        for axis, (n, size) in enumerate(zip(neighbour, mask.shape)):
+            if wrap and axis >= mask.ndim - 2:
+                neighbour[axis] = n % size
+            else:
+                valid &= (n >= 0) & (n < size)
+        neighbour = tuple(n[valid] for n in neighbour)
+        is_cloudy = mask[neighbour]
+        pairs_i.append(np.ravel_multi_index([c[valid][is_cloudy] for c in coords], mask.shape))
+        pairs_j.append(np.ravel_multi_index([n[is_cloudy] for n in neighbour], mask.shape))
+    return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+
+def _label_tiled(mask, tiles, diagonal, wrap, min_cells, drop_top, executor):
+    row_bounds = tile_bounds(mask.shape[-2], tiles[0])
+    col_bounds = tile_bounds(mask.shape[-1], tiles[1])
+    shifts = adjacency_shifts(mask.ndim, diagonal)
+    tile_args = [(mask[..., rows[0]:rows[1], cols[0]:cols[1]], mask.shape, rows, cols, shifts)
+                 for rows in row_bounds for cols in col_bounds]
+    tile_results = _map(_label_tile, tile_args, executor)
+
+    # Each tile's components are nodes of a graph, joined by neighbouring grid-cells across seams.
+    num_components = [component.max() + 1 if len(component) else 0 for _, component in tile_results]
+    node_offsets = np.cumsum([0] + num_components)
+    all_cells = np.concatenate([cells for cells, _ in tile_results])
+    all_nodes = np.concatenate([component + offset for (_, component), offset in zip(tile_results, node_offsets)])
+    order = np.argsort(all_cells)
+    sorted_cells = all_cells[order]
+    seam_i, seam_j = _seam_pairs(mask, row_bounds, col_bounds, shifts, wrap)
+    node_i = all_nodes[order[np.searchsorted(sorted_cells, seam_i)]]
+    node_j = all_nodes[order[np.searchsorted(sorted_cells, seam_j)]]
+    cloud = connected_components(node_offsets[-1], node_i, node_j)
+    num_clouds = cloud.max() + 1 if len(cloud) else 0
+    cell_cloud = cloud[all_nodes]
+
+    # label_clds scans columns (j) outer, rows (i) inner, and label_clds_3d levels (k) outermost -
+    # clouds are numbered in order of their first grid-cell in this order.
+    coords = np.unravel_index(all_cells, mask.shape)
+    scan_key = coords[-1].astype(np.int64) * mask.shape[-2] + coords[-2]
+    if mask.ndim == 3:
+        scan_key += coords[0].astype(np.int64) * mask.shape[-2] * mask.shape[-1]
+    first_key = np.full(num_clouds, np.iinfo(np.int64).max)
+    np.minimum.at(first_key, cell_cloud, scan_key)
+    sizes = np.bincount(cell_cloud, minlength=num_clouds)
+
+    keep = np.ones(num_clouds, dtype=bool)
+    if drop_top:
+        # label_clds_3d never starts a cloud on the top level.
+        keep &= first_key < (mask.shape[0] - 1) * mask.shape[-2] * mask.shape[-1]
+    max_label = int(keep.sum())
+    if min_cells > 0:
+        keep &= sizes >= min_cells
+    new_label = np.zeros(num_clouds, dtype=np.int32)
+    kept = np.flatnonzero(keep)
+    new_label[kept[np.argsort(first_key[kept])]] = np.arange(1, len(kept) + 1)
+
+    # Written here rather than by the workers, which may not share memory with this process.
+    labels = np.zeros(mask.shape, dtype=np.int32)
+    labels.flat[all_cells] = new_label[cell_cloud]
+    # Same return value as label_clds/label_clds_3d.
+    if min_cells > 0:
+        return len(kept) + 1, labels
+    return max_label, labels
+
+
+def label_clds_tiled(mask, tiles=(2, 2), diagonal=False, wrap=True, min_cells=0, executor=None):
+    """
+    Same as `utils.label_clds`, but labels tiles of the domain separately (optionally in parallel).
+
+    :param np.ndarray mask: 2D mask of True/False representing (thresholded) clouds.
+    :param tuple tiles: number of tiles along each axis.
+    :param bool diagonal: Whether to treat diagonal cells as contiguous.
+    :param bool wrap: Whether to wrap on edge.
+    :param int min_cells: Minimum number of grid-cells to include in a cloud.
+    :param executor: concurrent.futures executor to process tiles with, or None to process them in turn.
+    :return tuple(int, np.ndarray): max_label and 2D array of ints.
+    """
+    return _label_tiled(np.asarray(mask, dtype=bool), tiles, diagonal, wrap, min_cells, False, executor)
+
+
+def label_clds_3d_tiled(mask, tiles=(2, 2), diagonal=False, wrap=True, min_cells=0, k_start=1, executor=None):
+    """
+    Same as `utils.label_clds_3d`, but labels horizontal tiles of the domain separately (optionally in parallel).
+
+    :param np.ndarray mask: 3D mask of True/False representing (thresholded) clouds.
+    :param tuple tiles: number of tiles along each horizontal axis.
+    :param bool diagonal: Whether to treat diagonal cells as contiguous.
+    :param bool wrap: Whether to wrap on edge.
+    :param int min_cells: Minimum number of grid-cells to include in a cloud.
+    :param int k_start: lowest level to label.
+    :param executor: concurrent.futures executor to process tiles with, or None to process them in turn.
+    :return tuple(int, np.ndarray): max_label and 3D array of ints.
+    """
+    mask = np.array(mask, dtype=bool)
+    mask[:k_start] = False
+    return _label_tiled(mask, tiles, diagonal, wrap, min_cells, True, executor)
+
+
+def _proj_window(proj_field, rows, cols, halo):
+    """proj_field over a tile plus a halo either side (wrapping), so that only this is sent to a worker."""
+    row_indices = np.arange(rows[0] - halo[0], rows[1] + halo[0]) % proj_field.shape[-2]
+    col_indices = np.arange(cols[0] - halo[1], cols[1] + halo[1]) % proj_field.shape[-1]
+    return proj_field[..., row_indices, :][..., col_indices]
+
+
+def _tile_label_pairs(proj_window, curr_tile, shifts, halo, num_curr):
+    curr_mask = curr_tile > 0
+    keys = []
+    for shift in shifts:
+        # np.roll(proj_field, shift)[index] is proj_field[index - shift].
+        indices = [(np.arange(size) - s) % size for size, s in zip(proj_window.shape[:-2], shift[:-2])]
+        indices.append(np.arange(curr_tile.shape[-2]) + halo[0] - shift[-2])
+        indices.append(np.arange(curr_tile.shape[-1]) + halo[1] - shift[-1])
+        shifted_tile = proj_window[np.ix_(*indices)]
+        mask = curr_mask & (shifted_tile > 0)
+        keys.append(shifted_tile[mask].astype(np.int64) * num_curr + curr_tile[mask].astype(np.int64))
+    return keys
+
+
+def tiled_label_pairs(proj_field, curr_field, shifts=None, tiles=(2, 2), executor=None):
+    """
+    Same as `utils.label_pairs`, but finds overlaps one horizontal tile at a time (optionally in parallel).
+
+    :param np.ndarray proj_field: labels - e.g. the previous field projected forward.
+    :param np.ndarray curr_field: labels, same shape as proj_field.
+    :param list shifts: if set, shifts to apply to proj_field (see `utils.grow_shifts`).
+    :param tuple tiles: number of tiles along each horizontal axis.
+    :param executor: concurrent.futures executor to process tiles with, or None to process them in turn.
+    :return tuple(np.ndarray): as `utils.label_pairs`.
+    """
+    if shifts is None:
+        shifts = [(0,) * proj_field.ndim]
+    num_curr = int(curr_field.max()) + 1
+    halo = tuple(max(abs(shift[axis]) for shift in shifts) for axis in [-2, -1])
+    tile_args = [(_proj_window(proj_field, rows, cols, halo), curr_field[..., rows[0]:rows[1], cols[0]:cols[1]],
+                  shifts, halo, num_curr)
+                 for rows in tile_bounds(curr_field.shape[-2], tiles[0])
+                 for cols in tile_bounds(curr_field.shape[-1], tiles[1])]
+    tile_keys = _map(_tile_label_pairs, tile_args, executor)
+    first_keys, first_counts = np.unique(np.concatenate([keys[0] for keys in tile_keys]), return_counts=True)
+    keys = np.unique(np.concatenate([k for keys in tile_keys for k in keys]))
+    counts = np.zeros(len(keys), dtype=np.int64)
+    counts[np.searchsorted(keys, first_keys)] = first_counts
+    return keys // num_curr, keys % num_curr, counts
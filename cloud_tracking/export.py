@@ -0,0 +1,275 @@
+"""Export of tracker output as flat, columnar tables.
+
+Two tables are written: a cloud table with one row per cloud (id, time_index, label, group, lifetime,
+size, pos and any per-cloud columns calculated during tracking), and an edge table with one row per
+link between clouds (prev/next ids, overlap and fractions). Tables are built and written in chunks
+of rows, so that memory use is bounded by the chunk size rather than the number of clouds.
+
+Supported formats, chosen by file extension: .csv, .npz and .nc (needs netCDF4).
+Columns with more than one value per row (e.g. pos, area_profile) are written as <name>_<i> columns
+in CSV files, and as 2D variables otherwise.
+"""
+import os
+import zipfile
+from collections import OrderedDict
+from logging import getLogger
+
+import numpy as np
+
+from cloud_tracking.track_archive import read_archive
+
+logger = getLogger('ct.export')
+
+EXPORT_FORMATS = ['csv', 'npz', 'nc']
+DEFAULT_CHUNK_SIZE = 100000
+
+
+def _format_for(path, fmt):
+    if fmt is None:
+        fmt = os.path.splitext(path)[1].lstrip('.')
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError('Unrecognized export format: {}'.format(fmt))
+    return fmt
+
+
+def _group_index(tracker):
+    """Group index for each cloud id."""
+    group_index = {}
+    for i, group in enumerate(tracker.groups):
+        for cld in group.clds:
+            group_index[cld.id] = i
+    return group_index
+
+
+def cloud_table_chunks(tracker, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Generate cloud table in chunks of (approximately) chunk_size rows, made of whole timesteps.
+
+    :param Tracker tracker: tracker to export clouds of.
+    :param int chunk_size: number of rows in each chunk.
+    :return: generator of OrderedDict of column name -> np.ndarray
+    """
+    group_index = _group_index(tracker)
+    num_timesteps = len(tracker.clds_at_time)
+    start = 0
+    while start < num_timesteps:
+        end = start
+        num_rows = 0
+        while end < num_timesteps and (num_rows == 0 or num_rows + len(tracker.clds_at_time[end]) <= chunk_size):
+            num_rows += len(tracker.clds_at_time[end])
+            end += 1
+
+        clds = [cld for clds in tracker.clds_at_time[start:end] for _, cld in sorted(clds.items())]
+        chunk = OrderedDict()
+        chunk['id'] = np.array([cld.id for cld in clds], dtype=np.int64)
+        chunk['time_index'] = np.array([cld.time_index for cld in clds], dtype=np.int64)
+        chunk['label'] = np.array([cld.label for cld in clds], dtype=np.int64)
+        chunk['group'] = np.array([group_index.get(cld.id, -1) for cld in clds], dtype=np.int64)
+        chunk['lifetime'] = np.array([-1 if cld.lifetime is None else cld.lifetime for cld in clds],
+                                     dtype=np.int64)
+        # Per-cloud columns are already stored as arrays for each timestep, indexed by label - 1.
+        cld_tables = tracker.cld_tables[start:end]
+        for column in (cld_tables[0].keys() if cld_tables else []):
+            chunk[column] = np.concatenate([cld_table[column] for cld_table in cld_tables])
+        yield chunk
+        start = end
+
+
+def _edge_chunk(rows, group_index):
+    """Edge table rows for (prev cloud, next cloud) links."""
+    prev_clds, next_clds = zip(*rows) if rows else ((), ())
+    overlap = [next_cld.overlap(prev_cld) for prev_cld, next_cld in rows]
+    chunk = OrderedDict()
+    chunk['prev_id'] = np.array([cld.id for cld in prev_clds], dtype=np.int64)
+    chunk['next_id'] = np.array([cld.id for cld in next_clds], dtype=np.int64)
+    chunk['time_index'] = np.array([cld.time_index for cld in prev_clds], dtype=np.int64)
+    chunk['prev_label'] = np.array([cld.label for cld in prev_clds], dtype=np.int64)
+    chunk['next_label'] = np.array([cld.label for cld in next_clds], dtype=np.int64)
+    chunk['group'] = np.array([group_index.get(cld.id, -1) for cld in prev_clds], dtype=np.int64)
+    chunk['overlap'] = np.array([-1 if o is None else o for o in overlap], dtype=np.int64)
+    # Fractions are only known once clouds have been grouped.
+    chunk['frac'] = np.array([next_cld._frac.get(prev_cld, np.nan) for prev_cld, next_cld in rows], dtype=float)
+    chunk['reduced_frac'] = np.array([next_cld._reduced_frac.get(prev_cld, np.nan) for prev_cld, next_cld in rows],
+                                     dtype=float)
+    return chunk
+
+
+def edge_table_chunks(tracker, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Generate edge table in chunks of chunk_size rows.
+
+    :param Tracker tracker: tracker to export edges of.
+    :param int chunk_size: number of rows in each chunk.
+    :return: generator of OrderedDict of column name -> np.ndarray
+    """
+    group_index = _group_index(tracker)
+    rows = []
+    for cld in tracker.all_clds:
+        for next_cld in cld.next_clds:
+            rows.append((cld, next_cld))
+            if len(rows) == chunk_size:
+                yield _edge_chunk(rows, group_index)
+                rows = []
+    if rows:
+        yield _edge_chunk(rows, group_index)
+
+
+def group_tables(groups, columns, first_group=0):
+    """Cloud and edge tables of whole groups, e.g. groups completed while tracking online.
+
+    Clouds are in group order. The columns are the same as for `cloud_table_chunks` and `edge_table_chunks`.
+
+    :param list groups: CloudGroups.
+    :param list columns: per-cloud columns (e.g. the keys of Tracker.cld_tables), read from cloud attributes.
+    :param int first_group: group index of groups[0].
+    :return tuple(OrderedDict, OrderedDict): cloud table and edge table - column name -> np.ndarray.
+    """
+    clds = [cld for group in groups for cld in group.clds]
+    group_index = {cld.id: first_group + i for i, group in enumerate(groups) for cld in group.clds}
+    cld_table = OrderedDict()
+    cld_table['id'] = np.array([cld.id for cld in clds], dtype=np.int64)
+    cld_table['time_index'] = np.array([cld.time_index for cld in clds], dtype=np.int64)
+    cld_table['label'] = np.array([cld.label for cld in clds], dtype=np.int64)
+    cld_table['group'] = np.array([group_index[cld.id] for cld in clds], dtype=np.int64)
+    cld_table['lifetime'] = np.array([-1 if cld.lifetime is None else cld.lifetime for cld in clds], dtype=np.int64)
+    for column in columns:
+        cld_table[column] = np.array([getattr(cld, column) for cld in clds])
+    rows = [(cld, next_cld) for cld in clds for next_cld in cld.next_clds]
+    return cld_table, _edge_chunk(rows, group_index)
+
+
+def _write_csv(path, chunks):
+    with open(path, 'w') as f:
+        for i, chunk in enumerate(chunks):
+            columns = []
+            names = []
+            for name, values in chunk.items():
+                if values.ndim == 1:
+                    columns.append(values[:, None])
+                    names.append(name)
+                else:
+                    values = values.reshape(len(values), -1)
+                    columns.append(values)
+                    names.extend('{}_{}'.format(name, j) for j in range(values.shape[1]))
+            if i == 0:
+                f.write(','.join(names) + '\n')
+            table = np.concatenate([c.astype(object) for c in columns], axis=1)
+            np.savetxt(f, table, delimiter=',', fmt='%s')
+
+
+def _write_npz(path, chunks, num_rows):
+    """Write each column to a .npy file with known number of rows, then store them in an .npz."""
+    tmp_dir = path + '.tmp.d'
+    os.makedirs(tmp_dir)
+    columns = OrderedDict()
+    try:
+        row = 0
+        for chunk in chunks:
+            for name, values in chunk.items():
+                if name not in columns:
+                    columns[name] = np.lib.format.open_memmap(os.path.join(tmp_dir, name + '.npy'), mode='w+',
+                                                              dtype=values.dtype,
+                                                              shape=(num_rows,) + values.shape[1:])
+                columns[name][row:row + len(values)] = values
+            row += len(values)
+        for column in columns.values():
+            column.flush()
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+            for filename in sorted(os.listdir(tmp_dir)):
+                zf.write(os.path.join(tmp_dir, filename), filename)
+    finally:
+        columns.clear()
+        for filename in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, filename))
+        os.rmdir(tmp_dir)
+
+
+def _write_nc(path, chunks, dim_name):
+    import netCDF4
+
+    with netCDF4.Dataset(path, 'w') as ds:
+        ds.createDimension(dim_name, None)
+        row = 0
+        for chunk in chunks:
+            for name, values in chunk.items():
+                if name not in ds.variables:
+                    dims = [dim_name]
+                    for j, extra_len in enumerate(values.shape[1:]):
+                        extra_dim = '{}_dim{}'.format(name, j)
+                        ds.createDimension(extra_dim, extra_len)
+                        dims.append(extra_dim)
+                    ds.createVariable(name, values.dtype, dims)
+                ds.variables[name][row:row + len(values)] = values
+            row += len(values)
+
+
+def _write_table(path, fmt, chunks, num_rows, dim_name):
+    fmt = _format_for(path, fmt)
+    if fmt == 'csv':
+        _write_csv(path, chunks)
+    elif fmt == 'npz':
+        _write_npz(path, chunks, num_rows)
+    elif fmt == 'nc':
+        _write_nc(path, chunks, dim_name)
+    logger.debug('Exported {} {}s to {}'.format(num_rows, dim_name, path))
+
+
+def export_cloud_table(tracker, path, fmt=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Write one row per cloud to path.
+
+    :param Tracker tracker: tracker to export.
+    :param str path: file to write.
+    :param str fmt: one of EXPORT_FORMATS, taken from path's extension if None.
+    :param int chunk_size: maximum number of rows (roughly) held in memory at a time.
+    :return: None
+    """
+    num_rows = sum(len(clds) for clds in tracker.clds_at_time)
+    _write_table(path, fmt, cloud_table_chunks(tracker, chunk_size), num_rows, 'cloud')
+
+
+def export_edge_table(tracker, path, fmt=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Write one row per link between clouds to path.
+
+    :param Tracker tracker: tracker to export.
+    :param str path: file to write.
+    :param str fmt: one of EXPORT_FORMATS, taken from path's extension if None.
+    :param int chunk_size: maximum number of rows held in memory at a time.
+    :return: None
+    """
+    num_rows = sum(len(cld.next_clds) for cld in tracker.all_clds)
+    _write_table(path, fmt, edge_table_chunks(tracker, chunk_size), num_rows, 'edge')
+
+
+def _write_tables(cld_table, edge_table, cld_path, edge_path, fmt):
+    _write_table(cld_path, fmt, [cld_table], len(cld_table['id']), 'cloud')
+    if edge_path:
+        _write_table(edge_path, fmt, [edge_table], len(edge_table['prev_id']), 'edge')
+
+
+def export_group_tables(groups, columns, cld_path, edge_path=None, fmt=None, first_group=0):
+    """Write the cloud and edge tables of groups (see `group_tables`).
+
+    :param list groups: CloudGroups.
+    :param list columns: per-cloud columns.
+    :param str cld_path: file to write cloud table to.
+    :param str edge_path: file to write edge table to.
+    :param str fmt: one of EXPORT_FORMATS, taken from file extensions if None.
+    :param int first_group: group index of groups[0].
+    :return: None
+    """
+    cld_table, edge_table = group_tables(groups, columns, first_group)
+    _write_tables(cld_table, edge_table, cld_path, edge_path, fmt)
+
+
+def export_segment(segment_path, cld_path, edge_path=None, fmt=None):
+    """Write the cloud and edge tables stored in a segment of an archive (see `Tracker.write_segment`).
+
+    :param str segment_path: segment file.
+    :param str cld_path: file to write cloud table to.
+    :param str edge_path: file to write edge table to.
+    :param str fmt: one of EXPORT_FORMATS, taken from file extensions if None.
+    :return: None
+    """
+    arrays = read_archive(segment_path)[0]
+    cld_table, edge_table = [OrderedDict((name[len(prefix):], values) for name, values in arrays.items()
+                                         if name.startswith(prefix))
+                             for prefix in ['cld_', 'edge_']]
+    _write_tables(cld_table, edge_table, cld_path, edge_path, fmt)
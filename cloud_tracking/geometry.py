@@ -0,0 +1,91 @@
+"""Compact storage of the grid-cells that make up each cloud.
+
+All grid-cells of all labels at one timestep are kept in one buffer of flat indices, sorted by label,
+with an offset for the start of each label. Clouds refer to a slice of this buffer and only convert
+it to point lists when asked.
+"""
+import numpy as np
+
+from cloud_tracking.utils import cloudy_cells
+
+
+class LabelIndex(object):
+    """Flat indices of the grid-cells of every label in a field."""
+    def __init__(self, shape, indices, offsets):
+        """
+        :param tuple shape: shape of field.
+        :param np.ndarray indices: flat indices of all labelled grid-cells, sorted by label.
+        :param np.ndarray offsets: label L's grid-cells are indices[offsets[L - 1]:offsets[L]].
+        """
+        self.shape = tuple(shape)
+        self.indices = indices
+        self.offsets = offsets
+
+    @classmethod
+    def from_labels(cls, labels, max_label, cells=None):
+        """Build index from a field of labels.
+
+        :param np.ndarray labels: field of labels.
+        :param int max_label: number of labels.
+        :param tuple cells: if already known, output of `cloudy_cells(labels)`.
+        :return LabelIndex: index.
+        """
+        cloudy, cld_labels = cells if cells is not None else cloudy_cells(labels)
+        # Stable sort keeps each label's indices in the same order as np.where.
+        order = np.argsort(cld_labels, kind='stable')
+        dtype = np.int32 if labels.size < 2**31 else np.int64
+        counts = np.bincount(cld_labels, minlength=max_label + 1)[1:max_label + 1]
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        return cls(labels.shape, cloudy[order].astype(dtype), offsets)
+
+    @property
+    def max_label(self):
+        return len(self.offsets) - 1
+
+    def flat_indices(self, label):
+        return self.indices[self.offsets[label - 1]:self.offsets[label]]
+
+    def points(self, label):
+        """Grid-cell positions of label, same as np.array(np.where(labels == label)).
+
+        :param int label: label.
+        :return np.ndarray: (ndim, size) array.
+        """
+        return np.array(np.unravel_index(self.flat_indices(label), self.shape))
+
+    def cell_labels(self):
+        """Label of each entry in indices."""
+        return np.repeat(np.arange(1, self.max_label + 1), np.diff(self.offsets))
+
+    def extents(self):
+        """Vertical extents of every label, for a 3D (z, y, x) field.
+
+        :return dict: 'top', 'base', 'depth' (levels), 'area_profile' (grid-cells at each level,
+            shape (max_label, nz)).
+        """
+        assert len(self.shape) == 3
+        nz = self.shape[0]
+        level = self.indices // (self.shape[1] * self.shape[2])
+        cell_labels = self.cell_labels()
+        area_profile = np.bincount((cell_labels - 1) * nz + level,
+                                   minlength=self.max_label * nz).reshape(self.max_label, nz)
+        return profile_extents(area_profile)
+
+
+def profile_extents(area_profile):
+    """Vertical extents of every label from its area profile - see `LabelIndex.extents`.
+
+    :param np.ndarray area_profile: grid-cells of each label at each level, shape (max_label, nz).
+    :return dict: 'top', 'base', 'depth' (levels, -1 if label has no grid-cells), 'area_profile'.
+    """
+    nz = area_profile.shape[1]
+    has_level = area_profile > 0
+    has_cells = has_level.any(axis=1)
+    base = np.where(has_cells, has_level.argmax(axis=1), -1)
+    top = np.where(has_cells, nz - 1 - has_level[:, ::-1].argmax(axis=1), -1)
+    return {
+        'top': top,
+        'base': base,
+        'depth': top - base,
+        'area_profile': area_profile,
+    }
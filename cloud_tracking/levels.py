@@ -0,0 +1,63 @@
+"""Views of a 3D cloud graph at single levels.
+
+A Tracker given a list of track levels finds the area and position of every 3D cloud at each level, and
+the displacement between timesteps at each level, in one pass over each field. A LevelView presents the
+clouds that are present at one level as a cloud graph in its own right, without copying any clouds: the
+clouds and links are those of the shared 3D graph.
+"""
+import numpy as np
+
+
+class LevelView(object):
+    """The clouds of a multi-level Tracker that are present at one level, and the links between them."""
+    def __init__(self, tracker, index):
+        """
+        :param Tracker tracker: tracker with track_levels.
+        :param int index: index of level in tracker.track_levels.
+        """
+        self.tracker = tracker
+        self.index = index
+        self.level = tracker.track_levels[index]
+
+    def __repr__(self):
+        return 'LevelView({})'.format(self.level)
+
+    def is_present(self, cld):
+        return cld.level_size[self.index] > 0
+
+    @property
+    def clds_at_time(self):
+        """List of dicts, label -> cloud for the clouds present at this level at each time index."""
+        return [{label: cld for label, cld in clds.items() if self.is_present(cld)}
+                for clds in self.tracker.clds_at_time]
+
+    @property
+    def all_clds(self):
+        return [cld for cld in self.tracker.all_clds if self.is_present(cld)]
+
+    @property
+    def displacements(self):
+        """(dx, dy, amp) at this level between each pair of timesteps."""
+        displacements = [level_displacements[self.index] for level_displacements in self.tracker.level_displacements]
+        return np.array(displacements).reshape(-1, 3)
+
+    def size(self, cld):
+        """Number of grid-cells of cld at this level."""
+        return cld.level_size[self.index]
+
+    def pos(self, cld):
+        """Position (x, y in m) of cld at this level."""
+        return cld.level_pos[self.index]
+
+    def next_clds(self, cld):
+        return [next_cld for next_cld in cld.next_clds if self.is_present(next_cld)]
+
+    def prev_clds(self, cld):
+        return [prev_cld for prev_cld in cld.prev_clds if self.is_present(prev_cld)]
+
+    def edges(self):
+        """Links between clouds present at this level.
+
+        :return list: (prev cloud, next cloud) pairs.
+        """
+        return [(cld, next_cld) for cld in self.all_clds for next_cld in self.next_clds(cld)]
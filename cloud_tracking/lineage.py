@@ -0,0 +1,220 @@
+"""Precomputed ancestor/descendant relationships between clouds.
+
+For each group, every cloud has a bitset of its ancestors, built in one sweep forward in time over the
+group's links. Ancestor and common ancestor queries are then a few bit operations, and descendants
+are one vectorized test over the group's bitsets, instead of repeated searches over prev/next_clds.
+
+Bitsets need num_clds**2 / 8 bytes, so groups too large for them (see MAX_LINEAGE_SIZE) answer the same
+queries by searching the group's links instead, one timestep at a time over arrays of links.
+"""
+from logging import getLogger
+
+import numpy as np
+
+logger = getLogger('ct.lineage')
+
+# Groups whose bitsets would need more memory than this (bytes) use LinkLineage instead.
+MAX_LINEAGE_SIZE = 2**28
+
+
+def _group_links(group):
+    """Time index of each cloud in group, and (prev, next) links as indices into group.clds."""
+    index = {cld.id: i for i, cld in enumerate(group.clds)}
+    links = np.array([(i, index[next_cld.id]) for i, cld in enumerate(group.clds)
+                      for next_cld in cld.next_clds], dtype=np.int64).reshape(-1, 2)
+    return np.array([cld.time_index for cld in group.clds], dtype=np.int64), links
+
+
+def group_lineage(group, max_size=None):
+    """Lineage of a group - bitsets, unless they would need more than max_size bytes.
+
+    :param CloudGroup group: group to build lineage for.
+    :param int max_size: max size of bitsets (bytes), MAX_LINEAGE_SIZE if None.
+    :return: GroupLineage or LinkLineage
+    """
+    max_size = MAX_LINEAGE_SIZE if max_size is None else max_size
+    num_clds = len(group.clds)
+    if num_clds * ((num_clds + 7) // 8) > max_size:
+        logger.info('Group of {} clouds too large for lineage bitsets, searching links'.format(num_clds))
+        return LinkLineage.from_group(group)
+    return GroupLineage.from_group(group)
+
+
+class GroupLineage(object):
+    """Ancestors of each cloud in a group, as a packed bitset for each cloud."""
+    def __init__(self, time_index, ancestor_bits):
+        """
+        :param np.ndarray time_index: time index of each cloud in the group.
+        :param np.ndarray ancestor_bits: (num_clds, ceil(num_clds / 8)) packed bits,
+            bit j of row i is set if cloud j is an ancestor of cloud i.
+        """
+        self.time_index = time_index
+        self.ancestor_bits = ancestor_bits
+
+    @classmethod
+    def from_group(cls, group):
+        """Build lineage for all clouds in a group - indices refer to group.clds."""
+        num_clds = len(group.clds)
+        num_bytes = (num_clds + 7) // 8
+        time_index, edges = _group_links(group)
+        ancestor_bits = np.zeros((num_clds, num_bytes), dtype=np.uint8)
+
+        # All links go from one time to the next, so processing links in order of time means that
+        # each prev cloud's ancestors are complete before they are passed on.
+        edges = edges[np.argsort(time_index[edges[:, 0]], kind='stable')]
+        level_bounds = np.searchsorted(time_index[edges[:, 0]],
+                                       np.arange(time_index.min(), time_index.max() + 2))
+        for start, end in zip(level_bounds[:-1], level_bounds[1:]):
+            prev, next_ = edges[start:end, 0], edges[start:end, 1]
+            np.bitwise_or.at(ancestor_bits, next_, ancestor_bits[prev])
+            np.bitwise_or.at(ancestor_bits, (next_, prev // 8), (128 >> (prev % 8)).astype(np.uint8))
+        return cls(time_index, ancestor_bits)
+
+    def is_ancestor(self, i, j):
+        """Whether cloud i is an ancestor of cloud j."""
+        return bool(self.ancestor_bits[j, i // 8] & (128 >> (i % 8)))
+
+    def ancestors(self, i, within=None):
+        """Indices of ancestors of cloud i, optionally only those up to within timesteps before."""
+        ancestors = np.where(np.unpackbits(self.ancestor_bits[i], count=len(self.time_index)))[0]
+        if within is not None:
+            ancestors = ancestors[self.time_index[ancestors] >= self.time_index[i] - within]
+        return ancestors
+
+    def descendants(self, i, within=None):
+        """Indices of descendants of cloud i, optionally only those up to within timesteps after."""
+        descendants = np.where(self.ancestor_bits[:, i // 8] & (128 >> (i % 8)))[0]
+        if within is not None:
+            descendants = descendants[self.time_index[descendants] <= self.time_index[i] + within]
+        return descendants
+
+    def common_ancestors(self, i, j):
+        """Indices of clouds that are ancestors of both i and j."""
+        common = self.ancestor_bits[i] & self.ancestor_bits[j]
+        return np.where(np.unpackbits(common, count=len(self.time_index)))[0]
+
+
+def _csr(src, dst, num_clds):
+    """Offsets into, and dst of links sorted by, src - the links from cloud i are dst[ptr[i]:ptr[i + 1]]."""
+    ptr = np.concatenate([[0], np.cumsum(np.bincount(src, minlength=num_clds))])
+    return ptr, dst[np.argsort(src, kind='stable')]
+
+
+class LinkLineage(object):
+    """Same queries as GroupLineage, answered by searching the group's links - memory is proportional to
+    the number of clouds and links, but each query visits all of the clouds it returns."""
+    def __init__(self, time_index, links):
+        """
+        :param np.ndarray time_index: time index of each cloud in the group.
+        :param np.ndarray links: (num_links, 2) indices of prev and next cloud of each link.
+        """
+        self.time_index = time_index
+        num_clds = len(time_index)
+        self._next = _csr(links[:, 0], links[:, 1], num_clds)
+        self._prev = _csr(links[:, 1], links[:, 0], num_clds)
+
+    @classmethod
+    def from_group(cls, group):
+        return cls(*_group_links(group))
+
+    def _search(self, i, csr, within):
+        """Indices of clouds reached from cloud i through csr links, in at most within steps."""
+        ptr, linked = csr
+        found = np.zeros(len(self.time_index), dtype=bool)
+        frontier = np.array([i])
+        steps = 0
+        # Every link is one timestep, so each step of the search is one timestep further from i.
+        while len(frontier) and (within is None or steps < within):
+            starts, counts = ptr[frontier], ptr[frontier + 1] - ptr[frontier]
+            link_indices = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            frontier = np.unique(linked[link_indices])
+            frontier = frontier[~found[frontier]]
+            found[frontier] = True
+            steps += 1
+        return np.flatnonzero(found)
+
+    def is_ancestor(self, i, j):
+        """Whether cloud i is an ancestor of cloud j."""
+        within = self.time_index[j] - self.time_index[i]
+        return bool(within > 0 and i in self._search(j, self._prev, within))
+
+    def ancestors(self, i, within=None):
+        """Indices of ancestors of cloud i, optionally only those up to within timesteps before."""
+        return self._search(i, self._prev, within)
+
+    def descendants(self, i, within=None):
+        """Indices of descendants of cloud i, optionally only those up to within timesteps after."""
+        return self._search(i, self._next, within)
+
+    def common_ancestors(self, i, j):
+        """Indices of clouds that are ancestors of both i and j."""
+        return np.intersect1d(self.ancestors(i), self.ancestors(j), assume_unique=True)
+
+
+class Lineage(object):
+    """Lineage queries for clouds in any of a list of groups.
+
+    Clouds in different groups are never related.
+    """
+    def __init__(self, groups):
+        """
+        :param list groups: CloudGroups - uses (and builds if needed) each group's lineage.
+        """
+        self.groups = groups
+        self._where = {}
+        for group_index, group in enumerate(groups):
+            for i, cld in enumerate(group.clds):
+                self._where[cld.id] = (group_index, i)
+
+    def _find(self, cld_a, cld_b):
+        group_a, i = self._where[cld_a.id]
+        group_b, j = self._where[cld_b.id]
+        return (group_a if group_a == group_b else None), i, j
+
+    def is_ancestor(self, cld_a, cld_b):
+        """Whether cld_a is an ancestor of cld_b."""
+        group_index, i, j = self._find(cld_a, cld_b)
+        return group_index is not None and self.groups[group_index].lineage.is_ancestor(i, j)
+
+    def ancestors(self, cld, within=None):
+        """All clouds that contributed to cld, optionally only up to within timesteps before."""
+        group_index, i = self._where[cld.id]
+        group = self.groups[group_index]
+        return [group.clds[j] for j in group.lineage.ancestors(i, within)]
+
+    def descendants(self, cld, within=None):
+        """All clouds that cld contributed to, optionally only up to within timesteps after."""
+        group_index, i = self._where[cld.id]
+        group = self.groups[group_index]
+        return [group.clds[j] for j in group.lineage.descendants(i, within)]
+
+    def common_ancestors(self, cld_a, cld_b):
+        """All clouds that contributed to both cld_a and cld_b."""
+        group_index, i, j = self._find(cld_a, cld_b)
+        if group_index is None:
+            return []
+        group = self.groups[group_index]
+        return [group.clds[k] for k in group.lineage.common_ancestors(i, j)]
+
+    def to_arrays(self):
+        """Lineage of each group as flat arrays, in the same order as the groups' clouds. Groups using
+        LinkLineage have no bits stored."""
+        bits = [group.lineage.ancestor_bits.ravel() if isinstance(group.lineage, GroupLineage)
+                else np.zeros(0, dtype=np.uint8) for group in self.groups]
+        return {
+            'lineage_bits': np.concatenate([np.zeros(0, dtype=np.uint8)] + bits),
+            'lineage_bits_offsets': np.cumsum([0] + [len(group_bits) for group_bits in bits]),
+        }
+
+    @classmethod
+    def from_arrays(cls, groups, arrays):
+        """Restore the lineage of each group from `to_arrays`, without rebuilding it."""
+        offsets = arrays['lineage_bits_offsets']
+        for group, start, end in zip(groups, offsets[:-1], offsets[1:]):
+            num_clds = len(group.clds)
+            if end == start:
+                group._lineage = LinkLineage.from_group(group)
+                continue
+            group._lineage = GroupLineage(np.array([cld.time_index for cld in group.clds], dtype=np.int64),
+                                          arrays['lineage_bits'][start:end].reshape(num_clds, (num_clds + 7) // 8))
+        return cls(groups)
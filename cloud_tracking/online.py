@@ -0,0 +1,69 @@
+"""asyncio interface to tracking one timestep at a time with `Tracker.push`.
+
+Tracking a timestep is CPU bound, so it is run in an executor (a thread by default) while the event loop
+carries on receiving the next timesteps, e.g. from a running model or a nowcasting feed. Timesteps are
+always tracked in the order they arrive.
+"""
+import asyncio
+from logging import getLogger
+
+logger = getLogger('ct.online')
+
+_END = object()
+
+
+def _get_lock(tracker):
+    # Pushes to one tracker must not run at the same time.
+    if getattr(tracker, '_push_lock', None) is None:
+        tracker._push_lock = asyncio.Lock()
+    return tracker._push_lock
+
+
+async def push_async(tracker, cld_field, time=None, fields=None, executor=None):
+    """Same as `tracker.push`, without blocking the event loop.
+
+    :param Tracker tracker: tracker to push to.
+    :param cld_field: field of labels - np.ndarray, SparseLabels or cube.
+    :param time: time of field, passed back in the result.
+    :param dict fields: field name -> data for each added field.
+    :param executor: concurrent.futures executor to track in, or None for the loop's default executor.
+    :return TrackStep: new clouds, links and completed groups.
+    """
+    loop = asyncio.get_running_loop()
+    async with _get_lock(tracker):
+        return await loop.run_in_executor(executor, tracker.push, cld_field, time, fields)
+
+
+async def track_async(tracker, frames, max_pending=2, executor=None):
+    """Track timesteps from an async iterable, receiving the next timesteps while each is tracked.
+
+    :param Tracker tracker: tracker to push to.
+    :param frames: async iterable of (cld_field, time) or (cld_field, time, fields).
+    :param int max_pending: max number of received timesteps waiting to be tracked.
+    :param executor: concurrent.futures executor to track in, or None for the loop's default executor.
+    :return: async generator of TrackStep, one per timestep.
+    """
+    pending = asyncio.Queue(max_pending)
+
+    async def receive():
+        try:
+            async for frame in frames:
+                await pending.put(frame)
+        except Exception as e:
+            # Raised by the consumer once the frames before it have been tracked.
+            await pending.put(e)
+        else:
+            await pending.put(_END)
+
+    receiver = asyncio.ensure_future(receive())
+    try:
+        while True:
+            frame = await pending.get()
+            if frame is _END:
+                break
+            if isinstance(frame, Exception):
+                raise frame
+            yield await push_async(tracker, *frame, executor=executor)
+    finally:
+        if not receiver.done():
+            receiver.cancel()
@@ -0,0 +1,249 @@
+"""Tracking of label fields that are too large to hold in memory, one slab at a time.
+
+Fields are read in slabs along their first axis - levels of a 3D (z, y, x) field, or rows of a 2D
+field - from anything that can be sliced along that axis without reading the rest of it, e.g. a
+np.memmap or a `ChunkedField` of a netCDF variable. Per-label tables (sizes, positions, area
+profiles) and overlaps between timesteps are accumulated over slabs, so that peak memory is set by
+the slab size and the number of labels, not the size of the field.
+"""
+import numpy as np
+
+from cloud_tracking.sparse import SparseLabels
+
+
+class ChunkedField(object):
+    """One time of a (time, ...) variable, e.g. a netCDF variable, that is only read where it is indexed."""
+    def __init__(self, variable, time_index):
+        """
+        :param variable: variable with a leading time dimension - anything indexable like a numpy array.
+        :param int time_index: time index.
+        """
+        self.variable = variable
+        self.time_index = time_index
+        self.shape = tuple(variable.shape[1:])
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        return np.asarray(self.variable[(self.time_index,) + key])
+
+    def __array__(self, dtype=None):
+        return np.asarray(self.variable[self.time_index], dtype=dtype)
+
+
+def slab_bounds(n, slab_size):
+    """Start and end of each slab along an axis of length n.
+
+    :param int n: length of axis.
+    :param int slab_size: max length of each slab.
+    :return list: (start, end) pairs.
+    """
+    assert slab_size >= 1
+    return [(start, min(start + slab_size, n)) for start in range(0, n, slab_size)]
+
+
+def read_rows(field, rows):
+    """Read the given indices along the first axis of field, as few contiguous reads.
+
+    :param field: array-like field, or SparseLabels.
+    :param np.ndarray rows: indices along first axis.
+    :return np.ndarray: field[rows].
+    """
+    rows = np.asarray(rows)
+    if isinstance(field, SparseLabels):
+        return np.stack([field[int(row)].to_dense() for row in rows])
+    breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+    return np.concatenate([np.asarray(field[run[0]:run[-1] + 1]) for run in np.split(rows, breaks)])
+
+
+def _add_counts(total, counts):
+    """Add counts to total, growing total if counts is longer."""
+    if len(counts) > len(total):
+        total = np.concatenate([total, np.zeros(len(counts) - len(total), dtype=total.dtype)])
+    total[:len(counts)] += counts
+    return total
+
+
+def _profile(level_counts, max_label):
+    """(max_label, nz) profile from one bincount over labels for each level."""
+    profile = np.zeros((max_label, len(level_counts)), dtype=level_counts[0].dtype if level_counts else int)
+    for level, counts in enumerate(level_counts):
+        counts = counts[1:max_label + 1]
+        profile[:len(counts), level] = counts
+    return profile
+
+
+def slab_label_tables(field, slab_size, track_level=None, value_fields=None, profile_fields=None, levels=None):
+    """Per-label tables of a field of labels, read one slab at a time.
+
+    :param field: 2D or 3D field of labels, sliceable along its first axis.
+    :param int slab_size: number of levels (3D) or rows (2D) to read at once.
+    :param int track_level: for 3D fields, level to return as 'track_level'.
+    :param dict value_fields: name -> field (same shape as field) - values of each field at the labelled
+        grid-cells are returned in 'values' as (labels, values), as used by reducers.
+    :param dict profile_fields: for 3D fields, name -> tuple of fields (same shape as field) - the product
+        of these is summed over each label at each level, e.g. w and rho for a mass flux profile.
+    :param list levels: for 3D fields, further levels to return in 'levels'.
+    :return dict: 'max_label', 'size', 'mask' (2D mask of columns with any labelled grid-cells), 'values',
+        then for 3D fields 'area_profile', 'track_level', 'levels' (level -> 2D labels) and profile_fields,
+        or for 2D fields 'pos' (mean position in grid-cells, as `utils.label_centroids`).
+    """
+    value_fields = value_fields or {}
+    profile_fields = profile_fields or {}
+    shape = tuple(field.shape)
+    ndim = len(shape)
+    assert ndim in (2, 3)
+    row_size = int(np.prod(shape[1:]))
+
+    max_label = 0
+    sizes = np.zeros(1, dtype=np.int64)
+    mask = np.zeros(shape[-2:], dtype=bool)
+    pos_sums = [np.zeros(1), np.zeros(1)]
+    level_sizes = []
+    level_profiles = {name: [] for name in profile_fields}
+    values = {name: ([], []) for name in value_fields}
+    track_level_field = None
+    level_fields = {}
+    for start, end in slab_bounds(shape[0], slab_size):
+        slab = np.asarray(field[start:end])
+        flat_slab = slab.ravel()
+        cloudy = np.flatnonzero(flat_slab)
+        cld_labels = flat_slab[cloudy].astype(np.int64)
+        if len(cld_labels):
+            max_label = max(max_label, int(cld_labels.max()))
+        sizes = _add_counts(sizes, np.bincount(cld_labels))
+        if ndim == 3:
+            mask |= (slab > 0).any(axis=0)
+            if track_level is not None and start <= track_level < end:
+                track_level_field = slab[track_level - start].copy()
+            for level in levels or []:
+                if start <= level < end:
+                    level_fields[level] = slab[level - start].copy()
+            # Cloudy cells are in flat index order, so each level is a contiguous run.
+            level_starts = np.searchsorted(cloudy, np.arange(end - start + 1) * row_size)
+            weights = {name: np.prod([np.asarray(f[start:end]).ravel()[cloudy] for f in fields], axis=0)
+                       for name, fields in profile_fields.items()}
+            for level_start, level_end in zip(level_starts[:-1], level_starts[1:]):
+                level_labels = cld_labels[level_start:level_end]
+                # Levels with no clouds (e.g. the bottom and top levels of label_clds_3d) still give a
+                # count for every label so far.
+                level_sizes.append(np.bincount(level_labels, minlength=max_label + 1))
+                for name, level_weights in weights.items():
+                    level_profiles[name].append(np.bincount(level_labels, minlength=max_label + 1,
+                                                            weights=level_weights[level_start:level_end]))
+        else:
+            mask[start:end] = slab > 0
+            for axis, indices in enumerate([cloudy // row_size + start, cloudy % row_size]):
+                pos_sums[axis] = _add_counts(pos_sums[axis], np.bincount(cld_labels, weights=indices))
+        for name, value_field in value_fields.items():
+            values[name][0].append(cld_labels)
+            values[name][1].append(np.asarray(value_field[start:end]).ravel()[cloudy])
+
+    sizes = np.pad(sizes, (0, max_label + 1 - len(sizes)))[1:]
+    tables = {
+        'max_label': max_label,
+        'size': sizes,
+        'mask': mask,
+        'values': {name: (np.concatenate(cld_labels), np.concatenate(field_values))
+                   for name, (cld_labels, field_values) in values.items()},
+    }
+    if ndim == 3:
+        tables['area_profile'] = _profile(level_sizes, max_label)
+        tables['track_level'] = track_level_field
+        tables['levels'] = level_fields
+        for name in profile_fields:
+            tables[name] = _profile(level_profiles[name], max_label).astype(float)
+    else:
+        pos = np.array([np.pad(s, (0, max_label + 1 - len(s)))[1:] for s in pos_sums]).T
+        with np.errstate(invalid='ignore'):
+            tables['pos'] = pos / sizes[:, None]
+    return tables
+
+
+def slab_label_pairs(prev_field, curr_field, shift, slab_size, max_label=None, shifts=None):
+    """
+    Same as `utils.label_pairs(np.roll(prev_field, shift, axis=range(ndim)), curr_field, shifts)`, but
+    reads one slab of curr_field (and the rows of prev_field that project onto it) at a time.
+
+    :param prev_field: field of labels, sliceable along its first axis, or SparseLabels.
+    :param curr_field: field of labels, same shape as prev_field.
+    :param tuple shift: projection of prev_field, one shift per axis.
+    :param int slab_size: number of levels (3D) or rows (2D) to read at once.
+    :param int max_label: max label of curr_field, if known.
+    :param list shifts: if set, shifts to apply to the projected field (see `utils.grow_shifts`).
+    :return tuple(np.ndarray): prev labels, curr labels, number of overlapping grid-cells with the
+        first shift; sorted by prev label then curr label.
+    """
+    shape = tuple(curr_field.shape)
+    ndim = len(shape)
+    other_axes = tuple(range(1, ndim))
+    if shifts is None:
+        shifts = [(0,) * ndim]
+    halo = max(abs(s[0]) for s in shifts)
+    slabs = slab_bounds(shape[0], slab_size)
+    if max_label is None:
+        max_label = max(int(np.asarray(curr_field[start:end]).max()) for start, end in slabs)
+    num_curr = max_label + 1
+
+    first_keys, first_counts, all_keys = [], [], []
+    for start, end in slabs:
+        curr_slab = np.asarray(curr_field[start:end]).astype(np.int64)
+        curr_mask = curr_slab > 0
+        if not curr_mask.any():
+            continue
+        # Rows of the projected field over this slab, plus a halo for the shifts.
+        rows = (np.arange(start - halo, end + halo) - shift[0]) % shape[0]
+        window = np.roll(read_rows(prev_field, rows), shift[1:], axis=other_axes).astype(np.int64)
+        for i, s in enumerate(shifts):
+            shifted = window[halo - s[0]:halo - s[0] + end - start]
+            if any(s[1:]):
+                shifted = np.roll(shifted, s[1:], axis=other_axes)
+            mask = curr_mask & (shifted > 0)
+            keys = shifted[mask] * num_curr + curr_slab[mask]
+            if i == 0:
+                keys, counts = np.unique(keys, return_counts=True)
+                first_keys.append(keys)
+                first_counts.append(counts)
+            all_keys.append(np.unique(keys))
+
+    first_keys = np.concatenate([np.zeros(0, dtype=np.int64)] + first_keys)
+    first_counts = np.concatenate([np.zeros(0, dtype=np.int64)] + first_counts)
+    keys = np.unique(np.concatenate([np.zeros(0, dtype=np.int64)] + all_keys))
+    counts = np.zeros(len(keys), dtype=np.int64)
+    np.add.at(counts, np.searchsorted(keys, first_keys), first_counts)
+    return keys // num_curr, keys % num_curr, counts
+
+
+def column_mask(field, slab_size):
+    """2D mask of columns (last two axes) with any labelled grid-cells, read one slab at a time."""
+    if isinstance(field, SparseLabels):
+        return field.horizontal_mask()
+    if len(field.shape) == 2:
+        return np.concatenate([np.asarray(field[start:end]) > 0
+                               for start, end in slab_bounds(field.shape[0], slab_size)])
+    mask = np.zeros(field.shape[-2:], dtype=bool)
+    for start, end in slab_bounds(field.shape[0], slab_size):
+        mask |= (np.asarray(field[start:end]) > 0).any(axis=0)
+    return mask
+
+
+def sparse_from_slabs(field, slab_size):
+    """SparseLabels of a field, read one slab at a time - e.g. to checkpoint it."""
+    if isinstance(field, SparseLabels):
+        return field
+    row_size = int(np.prod(field.shape[1:]))
+    indices, labels = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    for start, end in slab_bounds(field.shape[0], slab_size):
+        flat_slab = np.asarray(field[start:end]).ravel()
+        cloudy = np.flatnonzero(flat_slab)
+        indices.append(cloudy + start * row_size)
+        labels.append(flat_slab[cloudy])
+    return SparseLabels(field.shape, np.concatenate(indices), np.concatenate(labels))
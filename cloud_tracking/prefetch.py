@@ -0,0 +1,98 @@
+"""Background reading of tracker inputs.
+
+Each input iterator is wrapped in a `PrefetchIterator`, which reads (and loads the data of) the next
+few items on a background thread while the current timestep is tracked, so that I/O and tracking overlap.
+Reading netCDF/iris data and numpy operations release the GIL, so threads are enough for this.
+"""
+import sys
+import queue
+import threading
+from logging import getLogger
+from timeit import default_timer as timer
+
+import numpy as np
+
+logger = getLogger('ct.prefetch')
+
+_END = object()
+
+
+class LoadedCube(object):
+    """Data that has already been read, with the parts of the interface of an iris cube used by `Tracker`."""
+    def __init__(self, data):
+        self.data = data
+        self.ndim = data.ndim
+
+
+def load_data(item):
+    """Read the data of item if it is lazy (e.g. iris cube or netCDF variable), else return item."""
+    if isinstance(item, np.ndarray):
+        # Already in memory - ndarray.data is its buffer, not the array.
+        return LoadedCube(item)
+    if hasattr(item, 'data'):
+        return LoadedCube(item.data)
+    return item
+
+
+class PrefetchIterator(object):
+    """Iterator that reads up to num_ahead items ahead of the consumer on a background thread."""
+    def __init__(self, iterable, num_ahead=2, load=load_data, name=None):
+        """
+        :param iterable: iterable to read.
+        :param int num_ahead: max number of items read ahead.
+        :param load: function applied to each item on the background thread - e.g. to read its data.
+        :param str name: name of thread (for debugging).
+        """
+        assert num_ahead >= 1
+        self._iter = iter(iterable)
+        self._load = load
+        self._queue = queue.Queue(maxsize=num_ahead)
+        self._stop = threading.Event()
+        self._done = False
+        # Time spent waiting for each item.
+        self.wait_times = []
+        self._thread = threading.Thread(target=self._read, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _read(self):
+        try:
+            for item in self._iter:
+                if not self._put((self._load(item), None)):
+                    return
+        except Exception:
+            self._put((None, sys.exc_info()[1]))
+            return
+        self._put((_END, None))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._done:
+            raise StopIteration
+        start = timer()
+        item, error = self._queue.get()
+        self.wait_times.append(timer() - start)
+        if error is not None:
+            self._done = True
+            raise error
+        if item is _END:
+            self.wait_times.pop()
+            self._done = True
+            raise StopIteration
+        return item
+
+    def close(self):
+        """Stop reading ahead."""
+        self._stop.set()
+        self._done = True
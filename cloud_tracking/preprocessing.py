@@ -0,0 +1,179 @@
+"""Preparation of 3D cloud label fields for tracking from model output.
+
+Model output is read one time slice at a time. Each slice is interpolated from theta to w levels,
+thresholded and labelled in buffers that are reused for every slice, and the labels are written to a
+compressed, chunked integer netCDF variable. The output can be read back one slice at a time with
+`label_field_iter` and passed straight to `Tracker`, so memory use never depends on the number of times.
+
+netCDF4 is only needed for reading and writing files.
+"""
+from logging import getLogger
+
+import numpy as np
+
+from cloud_tracking.out_of_core import ChunkedField
+from cloud_tracking.utils import label_clds_3d
+
+logger = getLogger('ct.preprocessing')
+
+LABEL_VARIABLE = 'ud_cc_cld_field'
+
+
+class LabelCube(object):
+    """Label field for one time, with the parts of the interface of an iris cube used by `Tracker`."""
+    def __init__(self, data):
+        self.data = data
+        self.ndim = data.ndim
+
+
+class CloudLabeller(object):
+    """Interpolates, thresholds and labels time slices of cloud liquid water, reusing its buffers."""
+    def __init__(self, shape, threshold=1e-5, diagonal=True, min_cells=5):
+        """
+        :param tuple shape: (nz, ny, nx) shape of each slice, on theta levels.
+        :param float threshold: min cloud liquid water (on w levels) for a grid-cell to be cloudy.
+        :param bool diagonal: treat diagonal cells as contiguous.
+        :param int min_cells: min number of grid-cells in a cloud.
+        """
+        self.shape = tuple(shape)
+        self.threshold = threshold
+        self.diagonal = diagonal
+        self.min_cells = min_cells
+        self._sum = np.empty(self.shape)
+        self._mask = np.zeros(self.shape, dtype=bool)
+        self._labels = np.empty(self.shape, dtype=np.int32)
+
+    def mask(self, ql):
+        """Cloudy grid-cells on w levels.
+
+        Field on w level k is 0.5 * (field on theta levels k and k + 1), and is 0 on the top level.
+
+        :param np.ndarray ql: (nz, ny, nx) cloud liquid water on theta levels - can be a transposed view.
+        :return np.ndarray: mask, overwritten by the next call.
+        """
+        # Interpolation and threshold in one: 0.5 * (a + b) > t is a + b > 2 t.
+        np.add(ql[:-1], ql[1:], out=self._sum[:-1])
+        np.greater(self._sum[:-1], 2 * self.threshold, out=self._mask[:-1])
+        self._mask[-1] = False
+        return self._mask
+
+    def labels(self, ql):
+        """Labelled clouds on w levels (see `utils.label_clds_3d`).
+
+        :param np.ndarray ql: (nz, ny, nx) cloud liquid water on theta levels - can be a transposed view.
+        :return np.ndarray: labels, overwritten by the next call.
+        """
+        _, labels = label_clds_3d(self.mask(ql), diagonal=self.diagonal)
+        if self.min_cells:
+            # Remove small clouds and renumber the rest in order, for all clouds at once.
+            sizes = np.bincount(labels.ravel())
+            keep = sizes >= self.min_cells
+            keep[0] = False
+            new_labels = np.where(keep, np.cumsum(keep), 0).astype(np.int32)
+            np.take(new_labels, labels, out=self._labels)
+        else:
+            self._labels[...] = labels
+        return self._labels
+
+
+def read_time_slices(datasets, variable, axes=(2, 1, 0)):
+    """Read one time slice at a time from a sequence of (open) netCDF datasets.
+
+    :param list datasets: netCDF4.Datasets, in time order.
+    :param str variable: variable to read.
+    :param tuple axes: axes to transpose each slice to (z, y, x) - done as a view, without copying.
+    :return: generator of np.ndarray
+    """
+    for dataset in datasets:
+        var = dataset.variables[variable]
+        for time_index in range(var.shape[0]):
+            yield np.transpose(var[time_index], axes)
+
+
+def write_labels(path, label_iter, shape, variable=LABEL_VARIABLE, complevel=4):
+    """Write label fields to a compressed netCDF file, one time slice at a time.
+
+    :param str path: file to write.
+    :param label_iter: iterable of (nz, ny, nx) integer arrays.
+    :param tuple shape: (nz, ny, nx).
+    :param str variable: name of label variable.
+    :param int complevel: zlib compression level.
+    :return int: number of time slices written.
+    """
+    import netCDF4
+
+    nz, ny, nx = shape
+    with netCDF4.Dataset(path, 'w', format='NETCDF4') as root_grp:
+        root_grp.description = 'Cloud field for tracking'
+        root_grp.createDimension('time', None)
+        root_grp.createDimension('z', nz)
+        root_grp.createDimension('y', ny)
+        root_grp.createDimension('x', nx)
+        time = root_grp.createVariable('time', 'f8', ('time',))
+        for name, size in [('z', nz), ('y', ny), ('x', nx)]:
+            root_grp.createVariable(name, 'f4', (name,))[:] = np.arange(size)
+        field = root_grp.createVariable(variable, 'i4', ('time', 'z', 'y', 'x'),
+                                        zlib=True, complevel=complevel, chunksizes=(1, nz, ny, nx))
+        num_times = 0
+        for labels in label_iter:
+            time[num_times] = num_times
+            field[num_times] = labels
+            num_times += 1
+    logger.debug('Written {} label fields to {}'.format(num_times, path))
+    return num_times
+
+
+def prepare_cloud_labels(input_paths, output_path, variable='q_cloud_liquid_mass', axes=(2, 1, 0), **kwargs):
+    """Label 3D clouds in all times of input_paths and write them to output_path.
+
+    :param list input_paths: netCDF files, in time order.
+    :param str output_path: netCDF file to write.
+    :param str variable: cloud liquid water variable, on theta levels.
+    :param tuple axes: axes to transpose each slice to (z, y, x).
+    :param kwargs: settings for `CloudLabeller`.
+    :return int: number of time slices written.
+    """
+    import netCDF4
+
+    datasets = [netCDF4.Dataset(path) for path in input_paths]
+    try:
+        shape = tuple(datasets[0].variables[variable].shape[1:][i] for i in axes)
+        labeller = CloudLabeller(shape, **kwargs)
+        label_iter = (labeller.labels(ql) for ql in read_time_slices(datasets, variable, axes))
+        return write_labels(output_path, label_iter, shape)
+    finally:
+        for dataset in datasets:
+            dataset.close()
+
+
+def label_field_iter(path, variable=LABEL_VARIABLE, lazy=False):
+    """Read label fields written by `write_labels` one time slice at a time, for `Tracker`.
+
+    :param str path: netCDF file.
+    :param str variable: name of label variable.
+    :param bool lazy: if True, each LabelCube's data is an out_of_core.ChunkedField that is only read
+        where it is indexed, for `Tracker.add_out_of_core`. After the last field, the file is kept open
+        until the fields are no longer used. It is closed straight away if iteration stops early.
+    :return: generator of LabelCube
+    """
+    import netCDF4
+
+    if lazy:
+        # Fields are read after they have been yielded, e.g. the last one by the next Tracker step or a
+        # checkpoint, so the dataset is left open (and closed when its variable is freed) after a full pass.
+        dataset = netCDF4.Dataset(path)
+        completed = False
+        try:
+            var = dataset.variables[variable]
+            for time_index in range(var.shape[0]):
+                yield LabelCube(ChunkedField(var, time_index))
+            completed = True
+        finally:
+            if not completed:
+                dataset.close()
+        return
+
+    with netCDF4.Dataset(path) as dataset:
+        var = dataset.variables[variable]
+        for time_index in range(var.shape[0]):
+            yield LabelCube(np.asarray(var[time_index]))
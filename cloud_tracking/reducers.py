@@ -0,0 +1,79 @@
+"""Per-cloud reductions of fields, evaluated for all clouds at once.
+
+Each reducer takes the labels of the cloudy grid-cells (see `utils.cloudy_cells`) and the values of a
+field at these grid-cells, and returns one value for each of labels 1 to max_label (nan for labels
+with no grid-cells). New reducers can be added with `register_reducer`.
+"""
+import numpy as np
+
+from cloud_tracking.utils import label_sums
+
+# Reducer name -> function(cld_labels, values, max_label, weights=None, **kwargs).
+REDUCERS = {}
+
+
+def register_reducer(name):
+    """Decorator to add a reducer to REDUCERS."""
+    def register(func):
+        REDUCERS[name] = func
+        return func
+    return register
+
+
+def _counts(cld_labels, max_label):
+    return np.bincount(cld_labels, minlength=max_label + 1)[1:max_label + 1]
+
+
+def _sorted_by_label(cld_labels, values, max_label):
+    """Sort values by label then value, and find the start of each label's values."""
+    order = np.lexsort((values, cld_labels))
+    counts = _counts(cld_labels, max_label)
+    starts = np.cumsum(counts) - counts
+    return values[order], starts, counts
+
+
+@register_reducer('sum')
+def reduce_sum(cld_labels, values, max_label):
+    return label_sums(cld_labels, values, max_label)
+
+
+@register_reducer('mean')
+def reduce_mean(cld_labels, values, max_label):
+    with np.errstate(invalid='ignore'):
+        return label_sums(cld_labels, values, max_label) / _counts(cld_labels, max_label)
+
+
+@register_reducer('max')
+def reduce_max(cld_labels, values, max_label):
+    return reduce_percentile(cld_labels, values, max_label, q=100)
+
+
+@register_reducer('min')
+def reduce_min(cld_labels, values, max_label):
+    return reduce_percentile(cld_labels, values, max_label, q=0)
+
+
+@register_reducer('percentile')
+def reduce_percentile(cld_labels, values, max_label, q=50):
+    """Percentile q (0-100) of each label's values, linearly interpolated as np.percentile."""
+    sorted_values, starts, counts = _sorted_by_label(cld_labels, values, max_label)
+    result = np.full(max_label, np.nan)
+    has_values = counts > 0
+    pos = starts[has_values] + (counts[has_values] - 1) * q / 100.
+    lower = np.floor(pos).astype(np.int64)
+    upper = np.minimum(lower + 1, starts[has_values] + counts[has_values] - 1)
+    frac = pos - lower
+    result[has_values] = sorted_values[lower] * (1 - frac) + sorted_values[upper] * frac
+    return result
+
+
+@register_reducer('weighted_sum')
+def reduce_weighted_sum(cld_labels, values, max_label, weights=None):
+    return label_sums(cld_labels, values * weights, max_label)
+
+
+@register_reducer('weighted_mean')
+def reduce_weighted_mean(cld_labels, values, max_label, weights=None):
+    with np.errstate(invalid='ignore'):
+        return (label_sums(cld_labels, values * weights, max_label) /
+                label_sums(cld_labels, weights, max_label))
@@ -13,8 +13,14 @@ import iris
 
 from cloud_tracking.utils import label_clds
 from cloud_tracking.tracking import Tracker
+from cloud_tracking.thresholds import ThresholdSweep
+from cloud_tracking.track_archive import read_archive_meta, segment_path
+from cloud_tracking.export import export_segment, export_group_tables
 from cloud_tracking.cloud_tracking_analysis import (output_stats_to_file,
-                                                    generate_stats,
+                                                    group_stats,
+                                                    combine_stats,
+                                                    stats_to_meta,
+                                                    stats_from_meta,
                                                     plot_stats)
 
 # Setup logger.
@@ -25,6 +31,24 @@ sh.setFormatter(logging.Formatter('%(levelname)8s: %(message)s'))
 logger.addHandler(sh)
 
 
+def _cld_field_iter(w, level, start_time_index):
+    """Label clouds one timestep at a time, starting at start_time_index."""
+    for time_index in range(start_time_index, w.shape[0]):
+        logger.debug('time_index = {}'.format(time_index))
+        w_2d = w[time_index, level]
+        # Take threshold of w > 1. and find contiguous clouds (incl. diagonal).
+        cld_field_cube = w_2d.copy(data=label_clds(w_2d.data > 1., diagonal=True)[1])
+        cld_field_cube.rename('cloud_field')
+        yield cld_field_cube
+
+
+def _w_iter(w, level):
+    """Read w one timestep at a time, for labelling at several thresholds."""
+    for time_index in range(w.shape[0]):
+        logger.debug('time_index = {}'.format(time_index))
+        yield w[time_index, level].data
+
+
 def track_clouds():
     # Read config.
     config = ConfigParser()
@@ -35,11 +59,17 @@ def track_clouds():
     expts = config['main']['expts'].split(',')
     filename_glob = config['main']['filename_glob']
     level = config['main'].getint('level')
+    cluster_dist = config['main'].getfloat('cluster_dist')
+    dx = config['main'].getfloat('dx')
+    # If set, track clouds at each of these thresholds of w instead of only w > 1.
+    thresholds = config['main'].get('thresholds')
 
     if not os.path.exists(results_dir):
         os.makedirs(results_dir)
 
     trackers = {}
+    # expt -> (stats, number of clouds, number of groups).
+    all_stats = {}
     logger.debug(basedir)
 
     for expt in expts:
@@ -62,32 +92,68 @@ def track_clouds():
         w_2d_slice = w[:, level]
         logger.info("Using height: {} m".format(w_2d_slice.coord('level_height').points[0]))
 
-        # Create cloud field array.
-        cld_field = np.zeros(w_2d_slice.shape, dtype=int)
-        cld_field_cube = w_2d_slice.copy()
-        cld_field_cube.rename('cloud_field')
-
-        # Take threshold of w > 1. and find contiguous clouds (incl. diagonal).
-        for time_index in range(w.shape[0]):
-            logger.debug('time_index = {}'.format(time_index))
-            cld_field[time_index] = label_clds(w[time_index, level].data > 1., diagonal=True)[1]
+        if thresholds:
+            # w is read once per timestep and labelled at every threshold.
+            sweep = ThresholdSweep(_w_iter(w, level), [float(t) for t in thresholds.split(',')], dx, dx)
+            sweep.track()
+            sweep.group()
+            sweep.output_stats(expt, results_dir, 'cloud_tracking_{}.'.format(expt))
+            continue
 
-        cld_field_cube.data = cld_field
+        # Tracking results are kept in an archive so that timesteps added to a running simulation
+        # can be appended, instead of retracking the whole run. The archive only holds the groups still open
+        # at the last timestep: the groups completed by each run are written once to a new segment, along with
+        # their tables and the stats of all completed groups so far, so appending costs in proportion to the
+        # new timesteps.
+        archive_path = os.path.join(results_dir, 'cloud_tracking_{}.npz'.format(expt))
+        if os.path.exists(archive_path):
+            tracker = Tracker.resume(archive_path, [], skip_done=False)
+            start_time_index = len(tracker.clds_at_time)
+            logger.info('Appending to {} from time_index {}'.format(archive_path, start_time_index))
+        else:
+            tracker = Tracker([], dx, dx)
+            tracker.add_online(keep_history=False)
+            start_time_index = 0
+        if tracker.num_segments:
+            segment_meta = read_archive_meta(segment_path(archive_path, tracker.num_segments - 1))
+            completed_stats = stats_from_meta(segment_meta['stats'])
+            num_clds = segment_meta['num_clds']
+        else:
+            completed_stats = group_stats([])
+            num_clds = 0
 
         # Perform tracking.
-        tracker = Tracker(cld_field_cube.slices_over('time'))
-        tracker.track()
-        tracker.group()
-        tracker.cluster()
+        completed_groups = []
+        for cld_field_cube in _cld_field_iter(w, level, start_time_index):
+            step = tracker.push(cld_field_cube)
+            completed_groups.extend(step.completed_groups)
+            num_clds += len(step.clds)
+        completed_stats = combine_stats(completed_stats, group_stats(completed_groups))
+        segment = tracker.write_segment(archive_path, completed_groups,
+                                        {'stats': stats_to_meta(completed_stats), 'num_clds': num_clds})
+        tracker.save_checkpoint(archive_path)
+        table_name = '{}.{:05d}.csv'.format(expt, tracker.num_segments - 1)
+        export_segment(segment, os.path.join(results_dir, 'cloud_table_' + table_name),
+                       os.path.join(results_dir, 'edge_table_' + table_name))
+        # Groups still open can grow when more timesteps are appended - their tables are rewritten each time.
+        open_groups = tracker.open_groups()
+        export_group_tables(open_groups, list(tracker.cld_tables[-1].keys()) if tracker.cld_tables else [],
+                            os.path.join(results_dir, 'cloud_table_{}.open.csv'.format(expt)),
+                            os.path.join(results_dir, 'edge_table_{}.open.csv'.format(expt)),
+                            first_group=tracker.num_segment_groups)
+        if cluster_dist is not None:
+            # Only the timesteps of the open groups are still held.
+            tracker.cluster(cluster_dist)
 
         trackers[expt] = tracker
+        all_stats[expt] = (combine_stats(completed_stats, group_stats(open_groups)), num_clds,
+                           tracker.num_segment_groups + len(open_groups))
 
     # Output results.
-    for expt in expts:
-        tracker = trackers[expt]
-        stats = generate_stats(expt, tracker)
+    for expt, tracker in trackers.items():
+        stats, num_clds, num_groups = all_stats[expt]
         filename = 'cloud_tracking_{}.'.format(expt)
-        output_stats_to_file(expt, results_dir, filename + 'txt', tracker, stats)
+        output_stats_to_file(expt, results_dir, filename + 'txt', tracker, stats, num_clds, num_groups)
         plot_stats(expt, results_dir, filename, [stats])
 
     return trackers
@@ -0,0 +1,240 @@
+"""Passing label fields and per-label tables between processes without pickling them.
+
+Arrays are written into the slots of a ring of shared memory (`SharedRing`), and only a small
+descriptor (slot, names, dtypes, shapes, offsets) is sent to the consumer, which gets numpy views of the
+shared memory without copying. Each slot is reference counted, and is reused once all of its readers
+have released it.
+"""
+import os
+import sys
+import weakref
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+from logging import getLogger
+
+import numpy as np
+
+logger = getLogger('ct.shared')
+
+# Arrays in a slot start on multiples of this (bytes).
+ALIGNMENT = 64
+
+
+class SharedRing(object):
+    """Fixed number of equal size slots of shared memory, each holding a set of arrays.
+
+    Create in the parent process and pass to child processes as an argument of multiprocessing.Process.
+    """
+    def __init__(self, num_slots, slot_bytes, ctx=multiprocessing):
+        """
+        :param int num_slots: number of slots.
+        :param int slot_bytes: size of each slot.
+        :param ctx: multiprocessing context.
+        """
+        self.num_slots = num_slots
+        self.slot_bytes = -(-slot_bytes // ALIGNMENT) * ALIGNMENT
+        self._shm = shared_memory.SharedMemory(create=True, size=self.num_slots * self.slot_bytes)
+        self._owner_pid = os.getpid()
+        self._num_views = 0
+        self._closing = False
+        self._refcounts = ctx.Array('l', num_slots)
+        self._cond = ctx.Condition(self._refcounts.get_lock())
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shm'] = self._shm.name
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._num_views = 0
+        self._closing = False
+        self._shm = shared_memory.SharedMemory(name=state['_shm'])
+        # Only the owner should unlink the memory - stop this process's resource tracker from doing so.
+        resource_tracker.unregister(self._shm._name, 'shared_memory')
+
+    def acquire(self, num_readers=1, timeout=None):
+        """Wait for a free slot and reserve it for num_readers readers.
+
+        :return int: slot.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: 0 in self._refcounts[:], timeout):
+                raise RuntimeError('No free slot after {} s'.format(timeout))
+            slot = self._refcounts[:].index(0)
+            self._refcounts[slot] = num_readers
+        return slot
+
+    def release(self, slot):
+        """Release one reader's reference to slot."""
+        with self._cond:
+            assert self._refcounts[slot] > 0
+            self._refcounts[slot] -= 1
+            if self._refcounts[slot] == 0:
+                self._cond.notify_all()
+
+    def write(self, slot, arrays):
+        """Copy arrays into slot.
+
+        :param int slot: slot from `acquire`.
+        :param dict arrays: name -> np.ndarray.
+        :return list: descriptor for `read` - (name, dtype, shape, offset) for each array.
+        """
+        descriptor = []
+        offset = 0
+        for name, array in arrays.items():
+            array = np.asarray(array)
+            if offset + array.nbytes > self.slot_bytes:
+                raise ValueError('Arrays do not fit in slot of {} bytes'.format(self.slot_bytes))
+            descriptor.append((name, array.dtype.str, array.shape, offset))
+            self._view(slot, array.dtype, array.shape, offset)[...] = array
+            offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        return descriptor
+
+    def read(self, slot, descriptor):
+        """Views of the arrays in slot (no copying) - only valid until the slot is released.
+
+        :return dict: name -> np.ndarray.
+        """
+        return {name: self._view(slot, np.dtype(dtype), shape, offset) for name, dtype, shape, offset in descriptor}
+
+    def _view(self, slot, dtype, shape, offset):
+        # frombuffer (unlike np.ndarray(buffer=...)) holds an export of the buffer, owned by view.base, which all
+        # views derived from this one share - count it until it is freed, so that `close` can wait for it.
+        view = np.frombuffer(self._shm.buf, dtype=dtype, count=int(np.prod(shape)),
+                             offset=slot * self.slot_bytes + offset)
+        self._num_views += 1
+        weakref.finalize(view.base, self._view_freed)
+        return view.reshape(shape)
+
+    def _view_freed(self):
+        self._num_views -= 1
+        if self._closing and not self._num_views:
+            self._shm.close()
+
+    def close(self):
+        """Detach from the shared memory, and free it if this is the process that created it.
+
+        Views from `read` that are still referenced stay valid - the memory is unmapped once they are freed.
+        """
+        if self._closing:
+            return
+        self._closing = True
+        if os.getpid() == self._owner_pid:
+            # Removes the name only - existing mappings stay valid.
+            self._shm.unlink()
+        if not self._num_views:
+            self._shm.close()
+
+
+class SharedArrays(dict):
+    """Arrays read from a slot of a SharedRing - call `release` (or use as a context manager) when done."""
+    def __init__(self, ring, slot, arrays):
+        super(SharedArrays, self).__init__(arrays)
+        self.ring = ring
+        self.slot = slot
+
+    def release(self):
+        self.clear()
+        self.ring.release(self.slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class SharedArrayQueue(object):
+    """Queue of dicts of arrays between processes, with the arrays passed through a SharedRing."""
+    def __init__(self, num_slots, slot_bytes, ctx=multiprocessing):
+        """
+        :param int num_slots: max number of dicts of arrays in the queue or being read.
+        :param int slot_bytes: max size of each dict of arrays.
+        :param ctx: multiprocessing context.
+        """
+        self.ring = SharedRing(num_slots, slot_bytes, ctx)
+        self._queue = ctx.Queue()
+
+    def put(self, arrays, num_readers=1, timeout=None):
+        """Copy arrays into shared memory (waiting for a free slot) and queue them."""
+        slot = self.ring.acquire(num_readers, timeout)
+        self._queue.put((slot, self.ring.write(slot, arrays)))
+
+    def put_end(self):
+        """Tell the consumer there is nothing more to come."""
+        self._queue.put(None)
+
+    def put_error(self, error):
+        """Pass an exception raised by the producer on to the consumer."""
+        self._queue.put(error)
+
+    def get(self, timeout=None):
+        """Next arrays as SharedArrays of views, or None after `put_end`.
+
+        Raises the exception passed to `put_error`.
+        """
+        item = self._queue.get(timeout=timeout)
+        if item is None:
+            return None
+        if isinstance(item, BaseException):
+            raise item
+        slot, descriptor = item
+        return SharedArrays(self.ring, slot, self.ring.read(slot, descriptor))
+
+    def close(self):
+        self.ring.close()
+
+
+def _produce(producer, args, queue):
+    try:
+        for arrays in producer(*args):
+            queue.put(arrays)
+    except Exception:
+        queue.put_error(sys.exc_info()[1])
+    finally:
+        queue.put_end()
+        queue.ring.close()
+
+
+def shared_iter(producer, args=(), num_slots=4, slot_bytes=2**26, keep=2, ctx=multiprocessing):
+    """Run producer in a child process, and iterate over the arrays it generates through shared memory.
+
+    e.g. labelling in one process, tracking in another. Each yielded SharedArrays is released `keep`
+    items later, so that e.g. `Tracker` can still use the previous timestep's labels. Views kept after
+    iteration ends (e.g. the Tracker's last field) remain valid. An exception raised by producer is
+    re-raised here.
+
+    :param producer: picklable generator function yielding dicts of arrays.
+    :param tuple args: args for producer.
+    :param int num_slots: number of slots in ring - must be more than keep.
+    :param int slot_bytes: max size of each dict of arrays.
+    :param int keep: number of items to keep before releasing them.
+    :param ctx: multiprocessing context.
+    :return: generator of SharedArrays
+    """
+    assert num_slots > keep
+    queue = SharedArrayQueue(num_slots, slot_bytes, ctx)
+    process = ctx.Process(target=_produce, args=(producer, args, queue))
+    process.daemon = True
+    process.start()
+    kept = []
+    finished = False
+    try:
+        while True:
+            arrays = queue.get()
+            if arrays is None:
+                finished = True
+                break
+            kept.append(arrays)
+            if len(kept) > keep:
+                kept.pop(0).release()
+            yield arrays
+    finally:
+        for arrays in kept:
+            arrays.release()
+        if not finished:
+            # Stopped early - producer could be waiting for a free slot.
+            process.terminate()
+        process.join()
+        queue.close()
@@ -0,0 +1,110 @@
+"""Sparse storage of label fields, for fields where only a small fraction of grid-cells are cloudy.
+
+A field is kept as the sorted flat indices of its labelled grid-cells, and the labels at those indices.
+Projection (rolling) and overlaps between fields work directly on these, so that their cost scales
+with the number of cloudy grid-cells, not the size of the domain.
+"""
+import numpy as np
+
+
+class SparseLabels(object):
+    """Labelled grid-cells of a field, as (flat index, label) pairs sorted by flat index.
+
+    Has enough of the interface of a dense field of labels (shape, ndim, size, max(), indexing by level
+    or by arrays of coords) to be used in place of one by the tracker.
+    """
+    def __init__(self, shape, indices, labels):
+        """
+        :param tuple shape: shape of the field.
+        :param np.ndarray indices: sorted flat indices of labelled grid-cells.
+        :param np.ndarray labels: label at each index (all > 0).
+        """
+        self.shape = tuple(shape)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.labels = np.asarray(labels, dtype=np.int64)
+
+    @classmethod
+    def from_dense(cls, labels):
+        flat_labels = labels.ravel()
+        indices = np.flatnonzero(flat_labels)
+        return cls(labels.shape, indices, flat_labels[indices])
+
+    def to_dense(self):
+        labels = np.zeros(self.size, dtype=np.int64)
+        labels[self.indices] = self.labels
+        return labels.reshape(self.shape)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def cloud_fraction(self):
+        return len(self.indices) / self.size
+
+    def max(self):
+        return self.labels.max() if len(self.labels) else 0
+
+    def cells(self):
+        """Same as `utils.cloudy_cells` on the dense field."""
+        return self.indices, self.labels
+
+    def __getitem__(self, key):
+        """Either a level (int) of a 3D field, or the labels at the coords given by a tuple of arrays."""
+        if isinstance(key, tuple):
+            flat = np.ravel_multi_index(key, self.shape)
+            if not len(self.indices):
+                return np.zeros(len(flat), dtype=np.int64)
+            pos = np.minimum(np.searchsorted(self.indices, flat), len(self.indices) - 1)
+            return np.where(self.indices[pos] == flat, self.labels[pos], 0)
+        level_size = int(np.prod(self.shape[1:]))
+        start, end = np.searchsorted(self.indices, [key * level_size, (key + 1) * level_size])
+        return SparseLabels(self.shape[1:], self.indices[start:end] - key * level_size, self.labels[start:end])
+
+    def horizontal_mask(self):
+        """Dense boolean mask of columns containing any labelled grid-cells (last two axes)."""
+        mask = np.zeros(int(np.prod(self.shape[-2:])), dtype=bool)
+        mask[self.indices % mask.size] = True
+        return mask.reshape(self.shape[-2:])
+
+    def roll(self, shift):
+        """Same as np.roll(field, shift, axis=range(ndim)) on the dense field.
+
+        :param tuple shift: shift along each axis.
+        :return SparseLabels: rolled field.
+        """
+        coords = np.unravel_index(self.indices, self.shape)
+        coords = [(c + s) % n for c, s, n in zip(coords, shift, self.shape)]
+        indices = np.ravel_multi_index(coords, self.shape)
+        order = np.argsort(indices)
+        return SparseLabels(self.shape, indices[order], self.labels[order])
+
+
+def sparse_label_pairs(proj_field, curr_field, shifts=None):
+    """
+    Same as `utils.label_pairs`, but for `SparseLabels`: overlaps are found by joining sorted indices.
+
+    :param SparseLabels proj_field: labels - e.g. the previous field projected forward.
+    :param SparseLabels curr_field: labels, same shape as proj_field.
+    :param list shifts: if set, shifts to apply to proj_field (see `utils.grow_shifts`).
+    :return tuple(np.ndarray): proj labels, curr labels, number of overlapping grid-cells with the
+        first shift; sorted by proj label then curr label.
+    """
+    if shifts is None:
+        shifts = [(0,) * proj_field.ndim]
+    num_curr = int(curr_field.max()) + 1
+    keys = []
+    for shift in shifts:
+        shifted_field = proj_field.roll(shift) if any(shift) else proj_field
+        _, shifted_pos, curr_pos = np.intersect1d(shifted_field.indices, curr_field.indices,
+                                                  assume_unique=True, return_indices=True)
+        keys.append(shifted_field.labels[shifted_pos] * num_curr + curr_field.labels[curr_pos])
+    first_keys, first_counts = np.unique(keys[0], return_counts=True)
+    keys = np.unique(np.concatenate(keys))
+    counts = np.zeros(len(keys), dtype=np.int64)
+    counts[np.searchsorted(keys, first_keys)] = first_counts
+    return keys // num_curr, keys % num_curr, counts
@@ -0,0 +1,186 @@
+"""Sweep over the Tracker parameters that only affect how clouds are linked together.
+
+Labelling, correlation and finding overlapping/touching clouds are the expensive parts of tracking,
+and none of them depend on include_touching, touching_diagonal, ignore_smaller_equal_than or
+frac_method. Here they are done once, and every edge that any combination of these parameters could
+make is kept along with how it was found and the sizes of the clouds at each end. The cloud graph,
+groups and stats for each combination are then derived by filtering these edges.
+"""
+import itertools
+from logging import getLogger
+from collections import OrderedDict
+
+import numpy as np
+
+from cloud_tracking.correlated_distance import correlate
+from cloud_tracking.tracking import Cloud, Tracker, cloud_table, correlate_and_project, find_label_pairs
+from cloud_tracking.utils import grow_shifts
+from cloud_tracking.cloud_tracking_analysis import generate_stats
+
+logger = getLogger('ct.sweep')
+
+# How an edge was found, in order of inclusiveness.
+EDGE_OVERLAP = 0
+EDGE_TOUCHING = 1
+EDGE_TOUCHING_DIAGONAL = 2
+
+SWEEP_PARAMS = ['include_touching', 'touching_diagonal', 'ignore_smaller_equal_than', 'frac_method']
+
+
+class ParameterSweep(object):
+    """Tracks a cloud field once, for many combinations of linking parameters.
+
+    3D clouds made by the sweep do not have pos_3d, and mass flux is not calculated.
+    """
+    def __init__(self, cld_field_iter, dx, dy, track_3d=False, track_level=None):
+        """
+        :param cld_field_iter: iterable cloud field - like iris.cube.Cube.
+        :param float dx: resolution in x-dir.
+        :param float dy: resolution in y-dir.
+        :param bool track_3d: enable 3d tracking.
+        :param bool track_level: index at which to perform 3d tracking.
+        """
+        self.cld_field_iter = iter(cld_field_iter)
+        self.dx = dx
+        self.dy = dy
+        assert self.dx == self.dy, 'Can only handle dx == dy currently'
+        self.track_3d = track_3d
+        if self.track_3d:
+            assert track_level is not None
+        self.track_lev = track_level
+        # List of dicts of arrays, indexed by label - 1.
+        self.cld_tables = []
+        # List of dicts of arrays, one row per edge from time_index to time_index + 1.
+        self.edge_tables = []
+        # List of (dx, dy, amp).
+        self.displacements = []
+        self.cld_field_shape = None
+
+    def compute(self):
+        """Label, correlate and find all edges for every timestep - only needs to be called once."""
+        prev_cld_field = None
+        for time_index, curr_cld_field_cube in enumerate(self.cld_field_iter):
+            curr_cld_field = curr_cld_field_cube.data
+            assert curr_cld_field.ndim == (3 if self.track_3d else 2)
+            self.cld_field_shape = tuple(curr_cld_field.shape)
+            logger.debug('Time index: {}'.format(time_index))
+
+            max_label = int(curr_cld_field.max())
+            table = cloud_table(curr_cld_field, max_label, self.dx, self.track_lev if self.track_3d else None)[0]
+            self.cld_tables.append(table)
+
+            if prev_cld_field is not None:
+                self.edge_tables.append(self._find_edges(prev_cld_field, curr_cld_field))
+            prev_cld_field = curr_cld_field
+
+    def _find_edges(self, prev_cld_field, curr_cld_field):
+        displacement, proj_cld_field_ss = correlate_and_project(prev_cld_field, curr_cld_field, correlate)
+        self.displacements.append(displacement)
+
+        ndim = curr_cld_field.ndim
+        touching_shifts = grow_shifts(ndim, False)
+        diagonal_shifts = grow_shifts(ndim, True)[len(touching_shifts):]
+        prev_labels, next_labels, overlap = find_label_pairs(proj_cld_field_ss, curr_cld_field)
+        kinds = [np.full(len(prev_labels), EDGE_OVERLAP)]
+        all_prev_labels = [prev_labels]
+        all_next_labels = [next_labels]
+        for kind, shifts in [(EDGE_TOUCHING, touching_shifts), (EDGE_TOUCHING_DIAGONAL, diagonal_shifts)]:
+            prev_labels, next_labels, _ = find_label_pairs(proj_cld_field_ss, curr_cld_field, shifts)
+            all_prev_labels.append(prev_labels)
+            all_next_labels.append(next_labels)
+            kinds.append(np.full(len(prev_labels), kind))
+
+        # Keep each edge once, with the most restrictive way it was found.
+        num_next = int(curr_cld_field.max()) + 1
+        keys = np.concatenate(all_prev_labels) * num_next + np.concatenate(all_next_labels)
+        kinds = np.concatenate(kinds)
+        order = np.lexsort((kinds, keys))
+        keys, first = np.unique(keys[order], return_index=True)
+        prev_labels = keys // num_next
+        next_labels = keys % num_next
+
+        edges = {
+            'prev_label': prev_labels,
+            'next_label': next_labels,
+            'kind': kinds[order][first],
+            'overlap': np.zeros(len(keys), dtype=np.int64),
+            'prev_size': self.cld_tables[-2]['size'][prev_labels - 1],
+            'next_size': self.cld_tables[-1]['size'][next_labels - 1],
+        }
+        # Both sets of keys are sorted so overlap pairs can be found with searchsorted.
+        overlap_keys = all_prev_labels[0] * num_next + all_next_labels[0]
+        edges['overlap'][np.searchsorted(keys, overlap_keys)] = overlap
+        return edges
+
+    def tracker(self, include_touching=False, touching_diagonal=False,
+                ignore_smaller_equal_than=None, frac_method='pc2009'):
+        """Build the cloud graph and groups for one combination of parameters.
+
+        :param bool include_touching: whether to track touching, not just overlapping, clouds.
+        :param bool touching_diagonal: touching definition to include corners.
+        :param int ignore_smaller_equal_than: if set, ignore clouds smaller than (grid-cells).
+        :param str frac_method: 'pc2009', 'simple' - fraction method to use.
+        :return Tracker: tracker with clouds and groups, as if it had tracked the cloud field.
+        """
+        tracker = Tracker([], self.dx, self.dy, include_touching=include_touching,
+                          touching_diagonal=touching_diagonal,
+                          ignore_smaller_equal_than=ignore_smaller_equal_than,
+                          track_3d=self.track_3d, track_level=self.track_lev,
+                          frac_method=frac_method)
+        tracker.cld_field_shape = self.cld_field_shape
+        if not include_touching:
+            max_kind = EDGE_OVERLAP
+        elif not touching_diagonal:
+            max_kind = EDGE_TOUCHING
+        else:
+            max_kind = EDGE_TOUCHING_DIAGONAL
+
+        for time_index, cld_table in enumerate(self.cld_tables):
+            curr_clds = OrderedDict()
+            for label in range(1, len(cld_table['size']) + 1):
+                curr_clds[label] = Cloud(label, time_index, cld_table['pos'][label - 1],
+                                         cld_table['size'][label - 1])
+            tracker.cld_tables.append(OrderedDict(cld_table))
+            tracker.clds_at_time.append(curr_clds)
+            tracker.all_clds.extend(curr_clds.values())
+            if not time_index:
+                continue
+
+            edges = self.edge_tables[time_index - 1]
+            keep = edges['kind'] <= max_kind
+            if ignore_smaller_equal_than:
+                # Count ignored clouds in the same way as Tracker.
+                tracker.ignored += np.sum(self.cld_tables[time_index - 1]['size'] <= ignore_smaller_equal_than)
+                keep &= edges['prev_size'] > ignore_smaller_equal_than
+                tracker.ignored += np.sum(keep & (edges['next_size'] <= ignore_smaller_equal_than))
+                keep &= edges['next_size'] > ignore_smaller_equal_than
+
+            prev_clds = tracker.clds_at_time[time_index - 1]
+            for prev_label, next_label, overlap in zip(edges['prev_label'][keep], edges['next_label'][keep],
+                                                       edges['overlap'][keep]):
+                prev_clds[prev_label].add_next(curr_clds[next_label], int(overlap))
+
+        tracker.ignored = int(tracker.ignored)
+        tracker.group()
+        return tracker
+
+    def run(self, expt_name, param_grid):
+        """Derive graph, groups and stats for every combination of parameters.
+
+        :param str expt_name: name passed on to generate_stats.
+        :param dict param_grid: parameter name (from SWEEP_PARAMS) -> list of values.
+        :return list: (params, tracker, stats) for each combination.
+        """
+        if not self.cld_tables:
+            self.compute()
+        for name in param_grid:
+            assert name in SWEEP_PARAMS, 'Unrecognized parameter: {}'.format(name)
+
+        names = list(param_grid.keys())
+        results = []
+        for values in itertools.product(*[param_grid[name] for name in names]):
+            params = dict(zip(names, values))
+            logger.debug('Sweep params: {}'.format(params))
+            tracker = self.tracker(**params)
+            results.append((params, tracker, generate_stats(expt_name, tracker)))
+        return results
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from cloud_tracking.tracking import Tracker, Cloud
+from cloud_tracking.utils import cloud_id, cloud_ids, split_cloud_ids
+
+
+class MockCube(object):
+    def __init__(self, data):
+        self.ndim = data.ndim
+        self.data = data
+
+
+def data_iterator(data):
+    for i in range(data.shape[0]):
+        yield MockCube(data[i])
+
+
+def cld_fields(ntimes=4):
+    cld_field = np.zeros((ntimes, 20, 24), dtype=np.int32)
+    for t in range(ntimes):
+        cld_field[t, 2:5, 3 + t:6 + t] = 1
+        cld_field[t, 10:14, 12 + t:14 + t] = 2
+    return cld_field
+
+
+class TestCloudIds(TestCase):
+    def test_encoding(self):
+        assert cloud_id(0, 1) == 1
+        assert cloud_id(3, 7) == 3 * 2**32 + 7
+        time_indices = np.array([0, 1, 2**30, 5])
+        labels = np.array([1, 2**32 - 1, 9, 3])
+        ids = cloud_ids(time_indices, labels)
+        assert ids.dtype == np.int64
+        assert list(ids) == [cloud_id(t, l) for t, l in zip(time_indices, labels)]
+        for a, b in zip(split_cloud_ids(ids), (time_indices, labels)):
+            assert np.all(a == b)
+
+    def test_deterministic(self):
+        assert Cloud(2, 3, [0, 0], 1).id == Cloud(2, 3, [0, 0], 1).id == cloud_id(3, 2)
+        trackers = []
+        for _ in range(2):
+            tracker = Tracker(data_iterator(cld_fields()), dx=1, dy=1)
+            tracker.track()
+            trackers.append(tracker)
+        ids = [[cld.id for cld in tracker.all_clds] for tracker in trackers]
+        assert ids[0] == ids[1]
+        assert len(set(ids[0])) == len(ids[0])
+
+    def test_chunks_and_resume(self):
+        cld_field = cld_fields(6)
+        tracker = Tracker(data_iterator(cld_field), dx=1, dy=1)
+        tracker.track()
+        # Second half of the run, tracked separately, has the same ids as the whole run.
+        chunk = Tracker(data_iterator(cld_field[3:]), dx=1, dy=1, id_time_offset=3)
+        chunk.track()
+        assert [cld.id for cld in chunk.all_clds] == [cld.id for cld in tracker.all_clds[-len(chunk.all_clds):]]
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'checkpoint.npz')
+            chunk.save_checkpoint(path)
+            resumed = Tracker.resume(path, [], skip_done=False)
+        finally:
+            shutil.rmtree(tmpdir)
+        assert resumed.id_time_offset == 3
+        assert [cld.id for cld in resumed.all_clds] == [cld.id for cld in chunk.all_clds]
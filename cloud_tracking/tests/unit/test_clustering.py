@@ -0,0 +1,80 @@
+from unittest import TestCase
+
+import numpy as np
+
+from cloud_tracking.tracking import Tracker
+from cloud_tracking.utils import dist
+from cloud_tracking.clustering import periodic_pairs, connected_components
+
+
+class MockCube(object):
+    def __init__(self, data):
+        self.ndim = data.ndim
+        self.data = data
+
+
+def data_iterator(data):
+    for i in range(data.shape[0]):
+        yield MockCube(data[i])
+
+
+class TestPeriodicPairs(TestCase):
+    def test_matches_all_pairs(self):
+        rng = np.random.RandomState(0)
+        domain_size = (100., 60.)
+        pos = rng.rand(200, 2) * domain_size
+        for max_dist in [3., 10., 35., 200.]:
+            i, j = periodic_pairs(pos, max_dist, domain_size)
+            expected = set((a, b) for a in range(len(pos)) for b in range(a + 1, len(pos))
+                           if dist(pos[a], pos[b], domain_size) <= max_dist)
+            assert sorted(zip(i, j)) == sorted(expected)
+
+    def test_connected_components(self):
+        # 0 - 3 - 5, 1 - 4, 2.
+        component = connected_components(6, np.array([5, 1, 0]), np.array([3, 4, 3]))
+        assert list(component) == [0, 1, 2, 0, 1, 0]
+
+    def test_connected_components_long_chains(self):
+        rng = np.random.RandomState(0)
+        # A path through the nodes in random order, and random sparse graphs.
+        order = rng.permutation(5000)
+        assert np.all(connected_components(5000, order[:-1], order[1:]) == 0)
+        for num_edges in [50, 100, 200]:
+            i, j = rng.randint(0, 200, (2, num_edges))
+            component = connected_components(200, i, j)
+            expected = np.arange(200)
+            for _ in range(200):
+                smaller = np.minimum(expected[i], expected[j])
+                np.minimum.at(expected, i, smaller)
+                np.minimum.at(expected, j, smaller)
+            assert np.all(component == np.unique(expected, return_inverse=True)[1])
+
+
+class TestCluster(TestCase):
+    def test_cluster_wraps(self):
+        cld_field = np.zeros((2, 20, 20), dtype=np.int32)
+        # Clouds 1 and 2 are neighbours across the x boundary, 3 is on its own.
+        cld_field[:, 5:7, 0:2] = 1
+        cld_field[:, 5:7, 18:20] = 2
+        cld_field[:, 12:14, 8:10] = 3
+        tracker = Tracker(data_iterator(cld_field), dx=100, dy=100)
+        tracker.track()
+        clusters_at_time = tracker.cluster(300)
+        assert len(clusters_at_time) == 2
+        for clusters in clusters_at_time:
+            assert [[cld.label for cld in cluster] for cluster in clusters] == [[1, 2], [3]]
+
+    def test_cluster_touching(self):
+        cld_field = np.zeros((2, 20, 20), dtype=np.int32)
+        # Clouds 1 and 2 touch diagonally, 3 touches 1 across the y boundary, 4 is on its own.
+        cld_field[:, 0:3, 5:8] = 1
+        cld_field[:, 3:5, 8:10] = 2
+        cld_field[:, 18:20, 5:7] = 3
+        cld_field[:, 10:12, 15:17] = 4
+        tracker = Tracker(data_iterator(cld_field), dx=100, dy=100)
+        tracker.add_adjacency(diagonal=True)
+        tracker.track()
+        a, b, counts = tracker.adjacency_at_time[0]
+        assert list(zip(a, b, counts)) == [(1, 2, 1), (1, 3, 5)]
+        for clusters in tracker.cluster(touching=True):
+            assert [[cld.label for cld in cluster] for cluster in clusters] == [[1, 2, 3], [4]]
@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from cloud_tracking.tracking import Tracker
+from cloud_tracking.compare import compare_runs, _group_mismatches
+from cloud_tracking.utils import cloud_id
+
+
+class MockCube(object):
+    def __init__(self, data):
+        self.ndim = data.ndim
+        self.data = data
+
+
+def data_iterator(data):
+    for i in range(data.shape[0]):
+        yield MockCube(data[i])
+
+
+def split_clouds(ntimes=6):
+    """One cloud that splits into two, with a separate cloud alongside."""
+    cld_field = np.zeros((ntimes, 20, 20), dtype=np.int32)
+    for i in range(ntimes):
+        if i < 3:
+            cld_field[i, 2:8, 2:5] = 1
+        else:
+            cld_field[i, 2:4, 2:5] = 1
+            cld_field[i, 6:8, 2:5] = 2
+        cld_field[i, 12:15, 12:15] = 3 if i >= 3 else 2
+    return cld_field
+
+
+def track(cld_field):
+    tracker = Tracker(data_iterator(cld_field), dx=1, dy=1)
+    tracker.track()
+    tracker.group()
+    return tracker
+
+
+class TestCompare(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_identical(self):
+        diff = compare_runs(track(split_clouds()), track(split_clouds()))
+        assert diff.identical
+        assert diff.first_divergent_time_index is None
+        assert diff.num_clouds == (15, 15)
+        assert 'identical' in diff.report()
+
+    def test_exported(self):
+        tracker = track(split_clouds())
+        paths = {}
+        for fmt in ['csv', 'npz']:
+            paths[fmt] = tuple(os.path.join(self.tmpdir, '{}.{}'.format(name, fmt)) for name in ['clouds', 'edges'])
+            tracker.export_tables(*paths[fmt])
+            assert compare_runs(tracker, paths[fmt]).identical
+        assert compare_runs(paths['csv'], paths['npz']).identical
+
+    def test_divergent(self):
+        cld_field = split_clouds()
+        # Second part of the split cloud no longer overlaps at time index 4, so starts a new group.
+        other = cld_field.copy()
+        other[4][other[4] == 2] = 0
+        other[4, 9:11, 2:5] = 2
+        diff = compare_runs(track(cld_field), track(other))
+        assert not diff.identical
+        assert diff.first_divergent_time_index == 3
+        assert len(diff.clouds_only_a) == len(diff.clouds_only_b) == 0
+        # Edges (3, 2) -> (4, 2) and (4, 2) -> (5, 2) are only in a.
+        assert sorted(map(tuple, diff.edges_only_a)) == [(cloud_id(3, 2), cloud_id(4, 2)),
+                                                         (cloud_id(4, 2), cloud_id(5, 2))]
+        assert len(diff.edges_only_b) == 0
+        assert cloud_id(4, 2) in diff.cloud_columns['pos']
+        assert cloud_id(0, 1) in diff.group_mismatches
+        assert cloud_id(0, 2) not in diff.group_mismatches
+        assert diff.divergent_time_indices()['edges only in a'] == 3
+        assert 'First divergent time index: 3' in diff.report()
+
+    def test_group_mismatches(self):
+        groups_a = np.array([0, 0, 1, 2, -1])
+        assert len(_group_mismatches(groups_a, np.array([5, 5, 3, 4, -1]))) == 0
+        # Groups 1 and 2 are merged in b, and the last cloud is grouped in b only.
+        assert list(_group_mismatches(groups_a, np.array([0, 0, 1, 1, 2]))) == [2, 3, 4]
@@ -1,8 +1,72 @@
 from unittest import TestCase
 
-from cloud_tracking.correlated_distance import correlate
+import numpy as np
+
+from cloud_tracking.correlated_distance import (correlate, correlate_pyramid, shift_correlations, AdaptiveCorrelator,
+                                                _window)
 
 
 class TestCorrelate(TestCase):
     def test_correlate1(self):
         raise NotImplemented('yet')
+
+
+class TestCorrelatePyramid(TestCase):
+    def _field(self, shape, rng, num_clds=40):
+        field = np.zeros(shape, dtype=bool)
+        for _ in range(num_clds):
+            i, j = rng.randint(0, shape[0]), rng.randint(0, shape[1])
+            size = rng.randint(2, 8)
+            field[np.ix_(np.arange(i, i + size) % shape[0], np.arange(j, j + size) % shape[1])] = True
+        return field
+
+    def test_same_as_full(self):
+        rng = np.random.RandomState(0)
+        for shape, shift in [((64, 64), (3, 5)), ((128, 128), (-7, 2)), ((64, 64), (0, 0)), ((96, 96), (11, -13)),
+                             ((256, 256), (-2, 9))]:
+            s1 = self._field(shape, rng)
+            s2 = np.roll(s1, shift, axis=(0, 1)) & ~(rng.rand(*shape) > 0.9)
+            dx, dy, amp = correlate(s1, s2)
+            pyramid_dx, pyramid_dy, pyramid_amp = correlate_pyramid(s1, s2, factor=4)
+            assert (pyramid_dx, pyramid_dy) == (dx, dy)
+            assert (dy, dx) == (shift[0] % shape[0], shift[1] % shape[1])
+            assert np.isclose(amp, pyramid_amp)
+
+    def test_shift_correlations(self):
+        rng = np.random.RandomState(3)
+        # Not a whole number of tiles.
+        s1 = self._field((36, 36), rng, num_clds=6)
+        s2 = np.roll(s1, (5, -3), axis=(0, 1)) & ~(rng.rand(36, 36) > 0.9)
+        hann2 = _window(s1, 1)
+        m1 = s1 * hann2 - np.mean(s1 * hann2)
+        m2 = s2 * hann2 - np.mean(s2 * hann2)
+        full = np.real(np.fft.ifft2(np.fft.fft2(m2) * np.fft.fft2(m1).conj()))
+        full /= np.sqrt(np.sum(m1 ** 2) * np.sum(m2 ** 2))
+        # More tiles than are transformed at once with tile 2.
+        for dy, dx, radius, tile in [(5, -3, 3, 16), (0, 0, 2, 8), (35, 34, 4, None), (4, -2, 1, 2)]:
+            amps = shift_correlations(s1, s2, dy, dx, radius, tile=tile)
+            offsets = np.arange(-radius, radius + 1)
+            assert np.allclose(amps, full[np.ix_((dy + offsets) % 36, (dx + offsets) % 36)])
+
+    def test_not_divisible(self):
+        rng = np.random.RandomState(1)
+        s1 = self._field((30, 30), rng)
+        s2 = np.roll(s1, (2, 3), axis=(0, 1))
+        assert correlate_pyramid(s1, s2, factor=4) == correlate(s1, s2)
+
+
+class TestAdaptiveCorrelator(TestCase):
+    def test_reuse(self):
+        rng = np.random.RandomState(2)
+        s = TestCorrelatePyramid()._field((64, 64), rng)
+        fields = [np.roll(s, (i, 2 * i), axis=(0, 1)) for i in range(8)]
+        # Wind changes direction.
+        fields += [np.roll(fields[-1], (-3 * i, 0), axis=(0, 1)) for i in range(1, 4)]
+        correlator = AdaptiveCorrelator(max_reuse=4)
+        for s1, s2 in zip(fields[:-1], fields[1:]):
+            assert correlator(s1, s2)[:2] == correlate(s1, s2)[:2]
+        stats = correlator.stats()
+        assert stats['calls'] == 10
+        # Full correlation at: first call, after 4 reuses, and when the wind changes.
+        assert stats['full'] == 3
+        assert stats['skipped'] == 7
@@ -0,0 +1,92 @@
+from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+
+from cloud_tracking.tracking import Tracker
+from cloud_tracking.utils import label_clds, label_clds_3d, label_pairs, grow_shifts
+from cloud_tracking.decomposition import label_clds_tiled, label_clds_3d_tiled, tiled_label_pairs
+
+
+class MockCube(object):
+    def __init__(self, data):
+        self.ndim = data.ndim
+        self.data = data
+
+
+class TestDecomposition(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.executor = ThreadPoolExecutor(4)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.executor.shutdown()
+
+    def test_label_clds_tiled(self):
+        rng = np.random.RandomState(0)
+        for trial in range(5):
+            mask = rng.rand(13, 17) > rng.uniform(0.4, 0.7)
+            for diagonal in [False, True]:
+                for wrap in [True, False]:
+                    for min_cells in [0, 3]:
+                        expected = label_clds(mask, diagonal, wrap, min_cells)
+                        for tiles in [(1, 1), (2, 3), (4, 4)]:
+                            max_label, labels = label_clds_tiled(mask, tiles, diagonal, wrap, min_cells,
+                                                                 executor=self.executor)
+                            assert max_label == expected[0]
+                            assert np.all(labels == expected[1])
+
+    def test_label_clds_3d_tiled(self):
+        rng = np.random.RandomState(1)
+        for trial in range(3):
+            mask = rng.rand(6, 9, 11) > rng.uniform(0.5, 0.8)
+            for diagonal in [False, True]:
+                for wrap in [True, False]:
+                    for min_cells in [0, 4]:
+                        expected = label_clds_3d(mask, diagonal, wrap, min_cells)
+                        for tiles in [(1, 1), (2, 3)]:
+                            max_label, labels = label_clds_3d_tiled(mask, tiles, diagonal, wrap, min_cells)
+                            assert max_label == expected[0]
+                            assert np.all(labels == expected[1])
+
+    def test_tiled_label_pairs(self):
+        rng = np.random.RandomState(2)
+        for shape in [(13, 17), (4, 9, 11)]:
+            proj = rng.randint(0, 5, shape) * (rng.rand(*shape) > 0.6)
+            curr = rng.randint(0, 5, shape) * (rng.rand(*shape) > 0.6)
+            for shifts in [None, [(0,) * len(shape)] + grow_shifts(len(shape), True)]:
+                for a, b in zip(label_pairs(proj, curr, shifts),
+                                tiled_label_pairs(proj, curr, shifts, (3, 2), self.executor)):
+                    assert np.all(a == b)
+
+    def test_process_pool(self):
+        # Workers get copies of their arguments, so must not write results into arrays they are passed.
+        rng = np.random.RandomState(4)
+        mask_2d = rng.rand(30, 30) > 0.6
+        mask_3d = rng.rand(5, 12, 14) > 0.6
+        proj = rng.randint(0, 5, (13, 17)) * (rng.rand(13, 17) > 0.6)
+        curr = rng.randint(0, 5, (13, 17)) * (rng.rand(13, 17) > 0.6)
+        with ProcessPoolExecutor(2) as executor:
+            max_label, labels = label_clds_tiled(mask_2d, (2, 3), executor=executor)
+            expected = label_clds(mask_2d)
+            assert max_label == expected[0] and max_label > 0
+            assert np.all(labels == expected[1])
+            max_label, labels = label_clds_3d_tiled(mask_3d, (2, 2), executor=executor)
+            assert np.all(labels == label_clds_3d(mask_3d)[1])
+            for shifts in [None, [(0, 0), (3, -2), (-1, 5)]]:
+                for a, b in zip(label_pairs(proj, curr, shifts),
+                                tiled_label_pairs(proj, curr, shifts, (3, 2), executor)):
+                    assert np.all(a == b)
+
+    def test_tracker(self):
+        rng = np.random.RandomState(3)
+        cld_field = np.array([label_clds(rng.rand(16, 16) > 0.6, diagonal=True)[1] for _ in range(4)])
+        graphs = []
+        for tiles in [None, (2, 2)]:
+            tracker = Tracker([MockCube(f) for f in cld_field], 1, 1, include_touching=True)
+            if tiles:
+                tracker.add_decomposition(tiles, self.executor)
+            tracker.track()
+            graphs.append([(c.label, [(n.label, n.overlap(c)) for n in c.next_clds]) for c in tracker.all_clds])
+        assert graphs[0] == graphs[1]
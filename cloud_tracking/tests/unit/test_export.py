@@ -0,0 +1,110 @@
+import os
+import csv
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from cloud_tracking.tracking import Tracker
+from cloud_tracking.export import cloud_table_chunks, edge_table_chunks, group_tables, export_segment
+
+
+class MockCube(object):
+    def __init__(self, data):
+        self.ndim = data.ndim
+        self.data = data
+
+
+def data_iterator(data):
+    for i in range(data.shape[0]):
+        yield MockCube(data[i])
+
+
+def split_clouds(ntimes=6):
+    """One cloud that splits into two, with a separate cloud alongside."""
+    cld_field = np.zeros((ntimes, 20, 20), dtype=np.int32)
+    for i in range(ntimes):
+        if i < 3:
+            cld_field[i, 2:8, 2:5] = 1
+        else:
+            cld_field[i, 2:4, 2:5] = 1
+            cld_field[i, 6:8, 2:5] = 2
+        cld_field[i, 12:15, 12:15] = 3 if i >= 3 else 2
+    return cld_field
+
+
+class TestExport(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.tracker = Tracker(data_iterator(split_clouds()), dx=1, dy=1)
+        self.tracker.track()
+        self.tracker.group()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _concat(self, chunks):
+        chunks = list(chunks)
+        return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}, len(chunks)
+
+    def test_chunks(self):
+        table, num_chunks = self._concat(cloud_table_chunks(self.tracker, chunk_size=4))
+        assert num_chunks > 1
+        assert list(table['id']) == [cld.id for cld in self.tracker.all_clds]
+        assert list(table['size']) == [cld.size for cld in self.tracker.all_clds]
+        assert table['pos'].shape == (len(self.tracker.all_clds), 2)
+        assert len(set(table['group'])) == len(self.tracker.groups)
+
+        edges, num_chunks = self._concat(edge_table_chunks(self.tracker, chunk_size=3))
+        assert num_chunks > 1
+        assert len(edges['prev_id']) == sum(len(cld.next_clds) for cld in self.tracker.all_clds)
+        split = edges['time_index'] == 2
+        assert sorted(edges['next_label'][split]) == [1, 2, 3]
+        # All clouds are grouped, so all fractions are known.
+        assert not np.any(np.isnan(edges['frac']))
+        assert np.all(edges['overlap'] > 0)
+
+    def test_csv(self):
+        cld_path = os.path.join(self.tmpdir, 'clouds.csv')
+        edge_path = os.path.join(self.tmpdir, 'edges.csv')
+        self.tracker.export_tables(cld_path, edge_path, chunk_size=4)
+        with open(cld_path) as f:
+            rows = list(csv.DictReader(f))
+        assert len(rows) == len(self.tracker.all_clds)
+        assert [int(r['id']) for r in rows] == [cld.id for cld in self.tracker.all_clds]
+        assert 'pos_0' in rows[0] and 'pos_1' in rows[0]
+        with open(edge_path) as f:
+            assert len(list(csv.DictReader(f))) == sum(len(cld.next_clds) for cld in self.tracker.all_clds)
+
+    def test_npz(self):
+        cld_path = os.path.join(self.tmpdir, 'clouds.npz')
+        self.tracker.export_tables(cld_path, chunk_size=4)
+        table, _ = self._concat(cloud_table_chunks(self.tracker))
+        with np.load(cld_path) as data:
+            assert sorted(data.files) == sorted(table.keys())
+            for name in table:
+                assert np.all(data[name] == table[name])
+        assert os.listdir(self.tmpdir) == ['clouds.npz']
+
+    def test_segment(self):
+        columns = list(self.tracker.cld_tables[-1].keys())
+        path = self.tracker.write_segment(os.path.join(self.tmpdir, 'tracks.npz'), self.tracker.groups)
+        cld_path = os.path.join(self.tmpdir, 'clouds.npz')
+        edge_path = os.path.join(self.tmpdir, 'edges.csv')
+        export_segment(path, cld_path, edge_path)
+
+        # Same rows as the whole tracker's tables, in group order.
+        cld_table, edge_table = group_tables(self.tracker.groups, columns)
+        expected, _ = self._concat(cloud_table_chunks(self.tracker))
+        order = np.argsort(expected['id'])
+        assert sorted(cld_table['id']) == list(expected['id'][order])
+        with np.load(cld_path) as data:
+            assert list(data['id']) == list(cld_table['id'])
+            id_order = np.argsort(data['id'])
+            for name in expected:
+                assert np.all(data[name][id_order] == expected[name][order]), name
+        with open(edge_path) as f:
+            rows = list(csv.DictReader(f))
+        assert [int(r['prev_id']) for r in rows] == list(edge_table['prev_id'])
+        assert len(rows) == sum(len(cld.next_clds) for cld in self.tracker.all_clds)
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from cloud_tracking.geometry import LabelIndex
+from cloud_tracking.tracking import Tracker
+
+
+class MockCube(object):
+    def __init__(self, data):
+        self.ndim = data.ndim
+        self.data = data
+
+
+def cld_field_3d():
+    cld_field = np.zeros((3, 6, 8, 8), dtype=int)
+    for i in range(3):
+        cld_field[i, 1:4, 1:3, i:i + 3] = 1
+        cld_field[i, 2:6, 5, 5] = 2
+        cld_field[i, 3, 6, 6] = 2
+    return cld_field
+
+
+class TestLabelIndex(TestCase):
+    def test_points(self):
+        labels = cld_field_3d()[0]
+        label_index = LabelIndex.from_labels(labels, 3)
+        assert label_index.indices.dtype == np.int32
+        for label in [1, 2, 3]:
+            assert (label_index.points(label) == np.array(np.where(labels == label))).all()
+
+    def test_extents(self):
+        label_index = LabelIndex.from_labels(cld_field_3d()[0], 2)
+        extents = label_index.extents()
+        assert list(extents['base']) == [1, 2]
+        assert list(extents['top']) == [3, 5]
+        assert list(extents['depth']) == [2, 3]
+        assert list(extents['area_profile'][1]) == [0, 0, 1, 2, 1, 1]
+
+
+class TestTrackerGeometry(TestCase):
+    def test_pos_3d(self):
+        cld_field = cld_field_3d()
+        tracker = Tracker([MockCube(f) for f in cld_field], 1, 1, track_3d=True, track_level=2)
+        tracker.track()
+        for cld in tracker.all_clds:
+            assert (cld.pos_3d == np.array(np.where(cld_field[cld.time_index] == cld.label))).all()
+            assert cld.depth == cld.pos_3d[0].max() - cld.pos_3d[0].min()
+            assert cld.area_profile.sum() == cld.size
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'checkpoint.npz')
+            tracker.save_checkpoint(path)
+            resumed_tracker = Tracker.resume(path, [])
+        finally:
+            shutil.rmtree(tmpdir)
+        for cld, resumed_cld in zip(tracker.all_clds, resumed_tracker.all_clds):
+            assert (cld.pos_3d == resumed_cld.pos_3d).all()
+            assert cld.top == resumed_cld.top
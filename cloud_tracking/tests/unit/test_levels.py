@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from cloud_tracking.tracking import Tracker
+from cloud_tracking.correlated_distance import correlate
+from cloud_tracking.utils import label_centroids
+
+
+class MockCube(object):
+    def __init__(self, data):
+        self.ndim = data.ndim
+        self.data = data
+
+
+def data_iterator(data):
+    for i in range(data.shape[0]):
+        yield MockCube(data[i])
+
+
+def drifting_clouds(shape, ntimes=5, seed=0):
+    """Blocks of labels drifting across a periodic domain, some growing into each other."""
+    rng = np.random.RandomState(seed)
+    cld_field = np.zeros((ntimes,) + shape, dtype=np.int32)
+    num_clds = 8
+    starts = [rng.randint(0, n, num_clds) for n in shape]
+    for t in range(ntimes):
+        for label in range(1, num_clds + 1):
+            slices = []
+            for axis, n in enumerate(shape):
+                start = starts[axis][label - 1] + (t if axis == len(shape) - 1 else 0)
+                slices.append(np.arange(start, start + 2 + (label + t) % 3) % n)
+            cld_field[(t,) + np.ix_(*slices)] = label
+    return cld_field
+
+
+def graph(tracker):
+    return [(c.time_index, c.label, c.size, list(np.nan_to_num(c.pos, nan=-1)),
+             [(n.time_index, n.label, n.overlap(c)) for n in c.next_clds])
+            for c in tracker.all_clds]
+
+
+class TestMultiLevelTracking(TestCase):
+    def setUp(self):
+        self.cld_field = drifting_clouds((6, 20, 24))
+        self.levels = [2, 1, 4]
+
+    def _track(self, track_level, **kwargs):
+        tracker = Tracker(data_iterator(self.cld_field), dx=10, dy=10, include_touching=True,
+                          track_3d=True, track_level=track_level, **kwargs)
+        tracker.track()
+        return tracker
+
+    def test_levels_match_single_level(self):
+        tracker = self._track(self.levels)
+        # First level is used for everything else.
+        assert graph(tracker) == graph(self._track(2))
+        assert list(tracker.level_views()) == self.levels
+        for level in self.levels:
+            view = tracker.level_view(level)
+            assert len(view.displacements) == len(self.cld_field) - 1
+            for time_index, clds in enumerate(view.clds_at_time):
+                level_field = self.cld_field[time_index, level]
+                max_label = int(self.cld_field[time_index].max())
+                sizes = np.bincount(level_field.ravel(), minlength=max_label + 1)[1:]
+                pos = label_centroids(level_field, max_label) * 10
+                assert sorted(clds) == list(np.flatnonzero(sizes) + 1)
+                for label, cld in clds.items():
+                    assert view.size(cld) == sizes[label - 1]
+                    assert np.allclose(view.pos(cld), pos[label - 1])
+                if time_index:
+                    expected = correlate(self.cld_field[time_index - 1, level] > 0, level_field > 0)
+                    assert np.allclose(view.displacements[time_index - 1], expected)
+            for prev_cld, next_cld in view.edges():
+                assert next_cld in prev_cld.next_clds
+                assert view.is_present(prev_cld) and view.is_present(next_cld)
+
+    def test_sparse_and_out_of_core(self):
+        tracker = self._track(self.levels)
+        for kwargs in [{'sparse': True}, {}]:
+            other = Tracker(data_iterator(self.cld_field), dx=10, dy=10, include_touching=True,
+                            track_3d=True, track_level=self.levels, **kwargs)
+            if not kwargs:
+                other.add_out_of_core(2)
+            other.track()
+            assert graph(other) == graph(tracker)
+            assert np.allclose(other.level_displacements, tracker.level_displacements)
+            for cld_table, other_cld_table in zip(tracker.cld_tables, other.cld_tables):
+                for column in ['level_size', 'level_pos']:
+                    assert np.allclose(cld_table[column], other_cld_table[column], equal_nan=True)
+
+    def test_resume(self):
+        tracker = self._track(self.levels)
+        partial = Tracker(data_iterator(self.cld_field[:3]), dx=10, dy=10, include_touching=True,
+                          track_3d=True, track_level=self.levels)
+        partial.track()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'checkpoint.npz')
+            partial.save_checkpoint(path)
+            resumed = Tracker.resume(path, data_iterator(self.cld_field[3:]), skip_done=False)
+        finally:
+            shutil.rmtree(tmpdir)
+        assert resumed.track_levels == self.levels
+        resumed.track()
+        assert graph(resumed) == graph(tracker)
+        assert np.allclose(resumed.level_displacements, tracker.level_displacements)
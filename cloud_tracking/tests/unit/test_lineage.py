@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from cloud_tracking.tracking import Cloud, CloudGroup, Tracker
+from cloud_tracking import lineage as lineage_module
+from cloud_tracking.lineage import Lineage, GroupLineage, LinkLineage, group_lineage
+
+
+class MockCube(object):
+    def __init__(self, data):
+        self.ndim = data.ndim
+        self.data = data
+
+
+def data_iterator(data):
+    for i in range(data.shape[0]):
+        yield MockCube(data[i])
+
+
+def _bfs_ancestors(cld):
+    ancestors = set()
+    to_visit = list(cld.prev_clds)
+    while to_visit:
+        prev_cld = to_visit.pop()
+        if prev_cld.id not in ancestors:
+            ancestors.add(prev_cld.id)
+            to_visit.extend(prev_cld.prev_clds)
+    return ancestors
+
+
+class TestLineage(TestCase):
+    def _random_group(self, seed):
+        rng = np.random.RandomState(seed)
+        clds = [[Cloud(label, t, [0, 0], 5) for label in range(1, 12)] for t in range(6)]
+        for t in range(5):
+            for c in clds[t]:
+                for n in clds[t + 1]:
+                    if rng.rand() > 0.85:
+                        c.add_next(n, overlap=1)
+        return CloudGroup([c for cs in clds for c in cs], frac_method='simple')
+
+    def test_matches_search(self):
+        group = self._random_group(0)
+        lineage = Lineage([group])
+        for cld in group.clds:
+            ancestors = _bfs_ancestors(cld)
+            assert set(c.id for c in lineage.ancestors(cld)) == ancestors
+            for other in group.clds:
+                assert lineage.is_ancestor(other, cld) == (other.id in ancestors)
+                assert (cld in lineage.descendants(other)) == (other.id in ancestors)
+            assert all(c.time_index >= cld.time_index - 2 for c in lineage.ancestors(cld, within=2))
+            assert set(lineage.ancestors(cld, within=2)) == set(c for c in lineage.ancestors(cld)
+                                                                 if c.time_index >= cld.time_index - 2)
+
+    def test_common_ancestors(self):
+        c0 = Cloud(1, 0, [0, 0], 5)
+        c1_1 = Cloud(1, 1, [0, 0], 5)
+        c1_2 = Cloud(2, 1, [0, 0], 5)
+        c2 = Cloud(1, 2, [0, 0], 5)
+        other = Cloud(1, 5, [0, 0], 5)
+        c0.add_next(c1_1)
+        c0.add_next(c1_2)
+        c1_2.add_next(c2)
+        lineage = Lineage([CloudGroup([c0, c1_1, c1_2, c2], frac_method='simple'), CloudGroup([other])])
+        assert lineage.common_ancestors(c1_1, c2) == [c0]
+        assert lineage.common_ancestors(c1_1, other) == []
+        assert not lineage.is_ancestor(other, c2)
+        assert lineage.descendants(c0, within=1) == [c1_1, c1_2]
+
+    def test_checkpoint(self):
+        labels = np.zeros((4, 8, 8), dtype=int)
+        labels[:, 2:5, 2:5] = 1
+        labels[2:, 5:7, 2:5] = 2
+        tracker = Tracker(data_iterator(labels), dx=1, dy=1, include_touching=True)
+        tracker.track()
+        tracker.group()
+        tracker.build_lineage()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'tracker.npz')
+            tracker.save_checkpoint(path)
+            resumed = Tracker.resume(path, data_iterator(labels))
+        finally:
+            shutil.rmtree(tmpdir)
+        assert resumed.lineage is not None
+        for group, resumed_group in zip(tracker.groups, resumed.groups):
+            assert resumed_group._lineage is not None
+            assert np.all(group.lineage.ancestor_bits == resumed_group.lineage.ancestor_bits)
+
+    def test_link_lineage(self):
+        # Groups too large for bitsets search their links instead, with the same results.
+        for seed in range(3):
+            group = self._random_group(seed)
+            bits = GroupLineage.from_group(group)
+            links = group_lineage(group, max_size=0)
+            assert isinstance(links, LinkLineage)
+            num_clds = len(group.clds)
+            for i in range(num_clds):
+                for within in [None, 0, 1, 3]:
+                    assert np.all(links.ancestors(i, within) == bits.ancestors(i, within))
+                    assert np.all(links.descendants(i, within) == bits.descendants(i, within))
+                for j in range(num_clds):
+                    assert links.is_ancestor(i, j) == bits.is_ancestor(i, j)
+                    assert np.all(links.common_ancestors(i, j) == bits.common_ancestors(i, j))
+
+    def test_checkpoint_link_lineage(self):
+        labels = np.zeros((4, 8, 8), dtype=int)
+        labels[:, 2:5, 2:5] = 1
+        labels[2:, 5:7, 2:5] = 2
+        tracker = Tracker(data_iterator(labels), dx=1, dy=1, include_touching=True)
+        tracker.track()
+        tracker.group()
+        max_size = lineage_module.MAX_LINEAGE_SIZE
+        lineage_module.MAX_LINEAGE_SIZE = 0
+        tmpdir = tempfile.mkdtemp()
+        try:
+            tracker.build_lineage()
+            path = os.path.join(tmpdir, 'tracker.npz')
+            tracker.save_checkpoint(path)
+            resumed = Tracker.resume(path, data_iterator(labels))
+        finally:
+            lineage_module.MAX_LINEAGE_SIZE = max_size
+            shutil.rmtree(tmpdir)
+        for group, resumed_group in zip(tracker.groups, resumed.groups):
+            assert isinstance(resumed_group._lineage, LinkLineage)
+            for i in range(len(group.clds)):
+                assert np.all(group.lineage.ancestors(i) == resumed_group.lineage.ancestors(i))
@@ -0,0 +1,54 @@
+from unittest import TestCase
+
+import numpy as np
+
+from cloud_tracking.tracking import Tracker
+
+
+class MockCube(object):
+    def __init__(self, data):
+        self.ndim = data.ndim
+        self.data = data
+
+
+class LevelCube(object):
+    """Records which levels have been read."""
+    def __init__(self, data, levels_read):
+        self._data = data
+        self.levels_read = levels_read
+
+    def __getitem__(self, index):
+        self.levels_read.append(index)
+        return MockCube(self._data[index])
+
+    @property
+    def data(self):
+        self.levels_read.append('all')
+        return self._data
+
+
+class TestMassFlux(TestCase):
+    def test_mass_flux_2d(self):
+        cld_field = np.zeros((2, 8, 8), dtype=int)
+        cld_field[:, 1:3, 1:3] = 1
+        cld_field[:, 5, 5:7] = 2
+        w = np.arange(128, dtype=float).reshape(2, 8, 8)
+        rho = np.full((2, 8, 8), 2.)
+        tracker = Tracker([MockCube(f) for f in cld_field], 10, 10)
+        tracker.add_mass_flux_info(iter([MockCube(f) for f in w]), iter([MockCube(f) for f in rho]))
+        tracker.track()
+        for cld in tracker.all_clds:
+            mask = cld_field[cld.time_index] == cld.label
+            assert np.isclose(cld.mass_flux, (w[cld.time_index] * 2 * 100)[mask].sum())
+
+    def test_mass_flux_3d_reads_track_level(self):
+        cld_field = np.zeros((2, 4, 8, 8), dtype=int)
+        cld_field[:, 1:3, 1:3, 1:3] = 1
+        w = np.random.rand(2, 4, 8, 8)
+        levels_read = []
+        tracker = Tracker([MockCube(f) for f in cld_field], 1, 1, track_3d=True, track_level=2)
+        tracker.add_mass_flux_info(iter([LevelCube(f, levels_read) for f in w]),
+                                   iter([MockCube(np.ones((8, 8))) for f in w]))
+        tracker.track()
+        assert levels_read == [2, 2]
+        assert np.isclose(tracker.all_clds[0].mass_flux, w[0, 2, 1:3, 1:3].sum())
@@ -0,0 +1,168 @@
+import os
+import shutil
+import asyncio
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from cloud_tracking.tracking import Tracker
+from cloud_tracking.online import push_async, track_async
+
+
+class MockCube(object):
+    def __init__(self, data):
+        self.ndim = data.ndim
+        self.data = data
+
+
+def data_iterator(data):
+    for i in range(data.shape[0]):
+        yield MockCube(data[i])
+
+
+def drifting_clouds(shape, ntimes=8, seed=0):
+    """Blocks of labels drifting across a periodic domain, some appearing later than others."""
+    rng = np.random.RandomState(seed)
+    cld_field = np.zeros((ntimes,) + shape, dtype=np.int32)
+    num_clds = 8
+    starts = [rng.randint(0, n, num_clds) for n in shape]
+    lifetimes = rng.randint(1, ntimes, num_clds)
+    for t in range(ntimes):
+        label = 0
+        for i in range(num_clds):
+            if t >= lifetimes[i]:
+                continue
+            label += 1
+            slices = []
+            for axis, n in enumerate(shape):
+                start = starts[axis][i] + (t if axis == len(shape) - 1 else 0)
+                slices.append(np.arange(start, start + 2 + (i + t) % 3) % n)
+            cld_field[(t,) + np.ix_(*slices)] = label
+    return cld_field
+
+
+def groups(group_list):
+    # Groups, or lists of clouds.
+    return sorted(sorted((c.time_index, c.label) for c in getattr(group, 'clds', group)) for group in group_list)
+
+
+class TestPush(TestCase):
+    def setUp(self):
+        self.cld_field = drifting_clouds((30, 40))
+        self.tracker = Tracker(data_iterator(self.cld_field), dx=1, dy=1, include_touching=True,
+                               ignore_smaller_equal_than=4)
+        self.tracker.track()
+        self.tracker.group()
+
+    def _new_tracker(self):
+        return Tracker([], dx=1, dy=1, include_touching=True, ignore_smaller_equal_than=4)
+
+    def test_push_same_as_track(self):
+        tracker = self._new_tracker()
+        completed = []
+        for time_index, field in enumerate(self.cld_field):
+            step = tracker.push(field, time=time_index * 300)
+            assert step.time_index == time_index
+            assert step.time == time_index * 300
+            assert len(step.clds) == self.cld_field[time_index].max()
+            for prev_cld, next_cld in step.links:
+                assert prev_cld.time_index == time_index - 1 and next_cld.time_index == time_index
+            for group in step.completed_groups:
+                assert group.last_time_index < time_index
+            completed.extend(step.completed_groups)
+        assert completed
+        tracker.group()
+        assert groups(tracker.groups) == groups(self.tracker.groups)
+
+        # Can carry on pushing after grouping.
+        tracker = self._new_tracker()
+        for field in self.cld_field[:4]:
+            tracker.push(MockCube(field))
+        tracker.group()
+        for field in self.cld_field[4:]:
+            tracker.push(field)
+        tracker.group()
+        assert groups(tracker.groups) == groups(self.tracker.groups)
+
+    def test_without_history(self):
+        tracker = self._new_tracker()
+        tracker.add_online(keep_history=False)
+        completed = []
+        num_clds = 0
+        for field in self.cld_field:
+            step = tracker.push(field)
+            completed.extend(step.completed_groups)
+            num_clds += len(step.clds)
+            # Only timesteps from the first cloud of an open group are kept, and kept whole.
+            first_open = min([cld.time_index for clds in tracker._open_groups.values() for cld in clds] or
+                             [len(tracker.clds_at_time)])
+            assert all(not clds for clds in tracker.clds_at_time[:first_open])
+            assert tracker.all_clds == [cld for clds in tracker.clds_at_time for cld in clds.values()]
+            assert all(len(cld_table['size']) == len(clds)
+                       for clds, cld_table in zip(tracker.clds_at_time, tracker.cld_tables))
+        assert len(tracker.all_clds) < num_clds
+        tracker.group()
+        assert groups(completed + tracker.groups) == groups(self.tracker.groups)
+
+    def test_checkpoint_without_history(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'checkpoint.npz')
+            tracker = self._new_tracker()
+            tracker.add_online(keep_history=False)
+            completed = []
+            for field in self.cld_field[:5]:
+                completed.extend(tracker.push(field).completed_groups)
+            assert tracker._open_groups
+            tracker.save_checkpoint(path)
+            tracker.export_tables(os.path.join(tmpdir, 'clouds.npz'), os.path.join(tmpdir, 'edges.npz'))
+
+            resumed = Tracker.resume(path, [], skip_done=False)
+            assert not resumed.keep_history
+            assert groups(resumed._open_groups.values()) == groups(tracker._open_groups.values())
+            for field in self.cld_field[5:]:
+                completed.extend(resumed.push(field).completed_groups)
+            resumed.group()
+            assert groups(completed + resumed.groups) == groups(self.tracker.groups)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestAsync(TestCase):
+    def test_track_async(self):
+        cld_field = drifting_clouds((30, 40))
+        tracker = Tracker(data_iterator(cld_field), dx=1, dy=1, include_touching=True)
+        tracker.track()
+        tracker.group()
+
+        async def frames():
+            for time_index, field in enumerate(cld_field):
+                await asyncio.sleep(0)
+                yield field, time_index
+
+        async def run(online_tracker):
+            steps = []
+            async for step in track_async(online_tracker, frames()):
+                steps.append(step)
+            step = await push_async(online_tracker, np.zeros_like(cld_field[0]), len(cld_field))
+            return steps + [step]
+
+        online_tracker = Tracker([], dx=1, dy=1, include_touching=True)
+        steps = asyncio.run(run(online_tracker))
+        assert [step.time for step in steps] == list(range(len(cld_field) + 1))
+        completed = [group for step in steps[:-1] for group in step.completed_groups]
+        # Open groups at the last timestep are completed by pushing a cloudless timestep.
+        completed_last = steps[-1].completed_groups
+        assert groups(completed + completed_last) == groups(tracker.groups)
+
+    def test_frame_error(self):
+        async def frames():
+            yield np.zeros((10, 10), dtype=int), 0
+            raise IOError('Feed lost')
+
+        async def run():
+            return [step async for step in track_async(Tracker([], dx=1, dy=1), frames())]
+
+        with self.assertRaises(IOError):
+            asyncio.run(run())
@@ -0,0 +1,225 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from cloud_tracking.tracking import Tracker
+from cloud_tracking.out_of_core import ChunkedField, slab_label_pairs, slab_label_tables, read_rows
+from cloud_tracking.utils import label_pairs, grow_shifts, label_centroids, label_clds_3d
+from cloud_tracking.vertical_structure import vertical_structure_from_labels
+
+
+class MockCube(object):
+    def __init__(self, data):
+        self.ndim = data.ndim
+        self.data = data
+
+
+def data_iterator(data):
+    for i in range(data.shape[0]):
+        yield MockCube(data[i])
+
+
+class RecordingField(object):
+    """Array-like field that records the number of levels/rows read at once."""
+    def __init__(self, data):
+        self.data = data
+        self.shape = data.shape
+        self.ndim = data.ndim
+        self.max_read = 0
+
+    def __getitem__(self, key):
+        values = np.asarray(self.data[key])
+        self.max_read = max(self.max_read, values.shape[0] if values.ndim == self.ndim else 1)
+        return values
+
+
+class LazyCube(object):
+    """Like an iris cube with lazy data - reading .data reads the whole field."""
+    def __init__(self, field):
+        self.field = field
+        self.ndim = field.ndim
+
+    @property
+    def data(self):
+        raise AssertionError('Whole field read')
+
+    def lazy_data(self):
+        return self.field
+
+
+def drifting_clouds(shape, ntimes=5, seed=0):
+    """Blocks of labels drifting across a periodic domain, some growing into each other."""
+    rng = np.random.RandomState(seed)
+    cld_field = np.zeros((ntimes,) + shape, dtype=np.int32)
+    num_clds = 8
+    starts = [rng.randint(0, n, num_clds) for n in shape]
+    for t in range(ntimes):
+        for label in range(1, num_clds + 1):
+            slices = []
+            for axis, n in enumerate(shape):
+                start = starts[axis][label - 1] + (t if axis == len(shape) - 1 else 0)
+                slices.append(np.arange(start, start + 2 + (label + t) % 3) % n)
+            cld_field[(t,) + np.ix_(*slices)] = label
+    return cld_field
+
+
+def graph(tracker):
+    return [(c.time_index, c.label, c.size, list(np.nan_to_num(c.pos, nan=-1)),
+             [(n.time_index, n.label, n.overlap(c)) for n in c.next_clds])
+            for c in tracker.all_clds]
+
+
+class TestSlabs(TestCase):
+    def test_label_pairs(self):
+        rng = np.random.RandomState(1)
+        for shape in [(10, 12), (5, 8, 9)]:
+            ndim = len(shape)
+            prev = rng.randint(0, 5, size=shape) * (rng.rand(*shape) > 0.7)
+            curr = rng.randint(0, 5, size=shape) * (rng.rand(*shape) > 0.7)
+            shift = (0, -3, 5)[-ndim:] if ndim == 3 else (4, -3)
+            proj = np.roll(prev, shift, axis=tuple(range(ndim)))
+            for shifts in [None, [(0,) * ndim] + grow_shifts(ndim, True)]:
+                expected = label_pairs(proj, curr, shifts)
+                for slab_size in [1, 2, 3, 20]:
+                    pairs = slab_label_pairs(prev, curr, shift, slab_size, shifts=shifts)
+                    for a, b in zip(pairs, expected):
+                        assert np.all(a == b)
+
+    def test_label_tables(self):
+        rng = np.random.RandomState(2)
+        labels = rng.randint(0, 6, size=(5, 8, 9)) * (rng.rand(5, 8, 9) > 0.6)
+        w = rng.rand(5, 8, 9)
+        tables = slab_label_tables(labels, 2, track_level=3, value_fields={'w': w},
+                                   profile_fields={'w_profile': (w,)})
+        assert tables['max_label'] == 5
+        assert np.all(tables['size'] == np.bincount(labels.ravel())[1:])
+        assert np.all(tables['mask'] == (labels > 0).any(axis=0))
+        assert np.all(tables['track_level'] == labels[3])
+        expected = vertical_structure_from_labels(labels, w=w, rho=np.ones_like(w))
+        assert np.all(tables['area_profile'] == expected['area_profile'])
+        assert np.allclose(tables['w_profile'], expected['mass_flux_profile'])
+        cld_labels, values = tables['values']['w']
+        assert np.allclose(np.sort(values), np.sort(w[labels > 0]))
+
+        tables = slab_label_tables(labels[0], 3)
+        assert np.allclose(tables['pos'], label_centroids(labels[0], 5), equal_nan=True)
+
+    def test_read_rows(self):
+        field = np.arange(24).reshape(6, 4)
+        rows = np.array([4, 5, 0, 1])
+        assert np.all(read_rows(field, rows) == field[rows])
+        chunked = ChunkedField(field[None], 0)
+        assert np.all(read_rows(chunked, rows) == field[rows])
+
+
+class TestOutOfCoreTracking(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _memmap(self, name, data):
+        path = os.path.join(self.tmpdir, name + '.npy')
+        np.save(path, data)
+        return np.load(path, mmap_mode='r')
+
+    def test_same_as_in_memory_2d(self):
+        cld_field = drifting_clouds((30, 40))
+        in_memory = Tracker(data_iterator(cld_field), dx=1, dy=1, include_touching=True)
+        in_memory.track()
+        for slab_size in [1, 7]:
+            tracker = Tracker(data_iterator(self._memmap('cld_field', cld_field)), dx=1, dy=1, include_touching=True)
+            tracker.add_out_of_core(slab_size)
+            tracker.track()
+            assert graph(tracker) == graph(in_memory)
+
+    def test_same_as_in_memory_3d(self):
+        cld_field = drifting_clouds((6, 20, 24))
+        rng = np.random.RandomState(3)
+        w = rng.rand(*cld_field.shape)
+        trackers = []
+        for slab_size in [None, 2]:
+            cld_fields = self._memmap('cld_field', cld_field) if slab_size else cld_field
+            ws = self._memmap('w', w) if slab_size else w
+            tracker = Tracker(data_iterator(cld_fields), dx=1, dy=1, include_touching=True,
+                              track_3d=True, track_level=2)
+            tracker.add_field('w', data_iterator(ws))
+            tracker.add_field('rho', data_iterator(np.ones_like(w)))
+            tracker.add_field('w_track_level', data_iterator(w), track_level_only=True)
+            tracker.add_reducer('w_max', 'max', 'w')
+            tracker.add_reducer('w_track_level_mean', 'mean', 'w_track_level')
+            tracker.add_vertical_structure(dz=2, w='w', rho='rho')
+            if slab_size:
+                tracker.add_out_of_core(slab_size)
+            tracker.track()
+            trackers.append(tracker)
+        in_memory, out_of_core = trackers
+        assert graph(out_of_core) == graph(in_memory)
+        for cld_table, slab_cld_table in zip(in_memory.cld_tables, out_of_core.cld_tables):
+            assert list(cld_table) == list(slab_cld_table)
+            for column in cld_table:
+                assert np.allclose(cld_table[column], slab_cld_table[column], equal_nan=True)
+
+    def test_empty_levels(self):
+        # label_clds_3d never labels the bottom level - and nothing is cloudy on the top level.
+        rng = np.random.RandomState(5)
+        mask = rng.rand(6, 20, 24) > 0.7
+        mask[-1] = False
+        cld_field = np.array([label_clds_3d(np.roll(mask, t, axis=2), diagonal=True)[1] for t in range(4)])
+        assert not cld_field[:, 0].any() and not cld_field[:, -1].any()
+        trackers = []
+        for slab_size in [None, 2]:
+            tracker = Tracker(data_iterator(cld_field), dx=1, dy=1, include_touching=True, track_3d=True,
+                              track_level=2)
+            if slab_size:
+                tracker.add_out_of_core(slab_size)
+            tracker.track()
+            trackers.append(tracker)
+        in_memory, out_of_core = trackers
+        assert graph(out_of_core) == graph(in_memory)
+        for cld_table, slab_cld_table in zip(in_memory.cld_tables, out_of_core.cld_tables):
+            assert np.all(cld_table['area_profile'] == slab_cld_table['area_profile'])
+
+    def test_reads_slabs_of_lazy_cubes(self):
+        cld_field = drifting_clouds((6, 20, 24))
+        w = np.random.RandomState(4).rand(*cld_field.shape)
+        in_memory = Tracker(data_iterator(cld_field), dx=1, dy=1, include_touching=True, track_3d=True,
+                            track_level=2)
+        in_memory.add_field('w', data_iterator(w))
+        in_memory.add_reducer('w_max', 'max', 'w')
+        in_memory.track()
+
+        cld_fields = [RecordingField(f) for f in cld_field]
+        ws = [RecordingField(f) for f in w]
+        tracker = Tracker([LazyCube(f) for f in cld_fields], dx=1, dy=1, include_touching=True, track_3d=True,
+                          track_level=2)
+        tracker.add_field('w', [LazyCube(f) for f in ws])
+        tracker.add_reducer('w_max', 'max', 'w')
+        tracker.add_out_of_core(2)
+        tracker.track()
+        assert graph(tracker) == graph(in_memory)
+        for cld_table, slab_cld_table in zip(in_memory.cld_tables, tracker.cld_tables):
+            assert np.allclose(cld_table['w_max'], slab_cld_table['w_max'])
+        # Slabs of 2 levels, plus a halo of one level either side for touching clouds - never all 6 levels.
+        assert max(f.max_read for f in cld_fields) <= 4
+        assert max(f.max_read for f in ws) <= 2
+
+    def test_resume(self):
+        cld_field = drifting_clouds((6, 20, 24))
+        kwargs = {'include_touching': True, 'track_3d': True, 'track_level': 2}
+        in_memory = Tracker(data_iterator(cld_field), dx=1, dy=1, **kwargs)
+        in_memory.track()
+        cld_fields = self._memmap('cld_field', cld_field)
+        tracker = Tracker(data_iterator(cld_fields[:3]), dx=1, dy=1, **kwargs)
+        tracker.add_out_of_core(2)
+        tracker.track()
+        path = os.path.join(self.tmpdir, 'checkpoint.npz')
+        tracker.save_checkpoint(path)
+        resumed = Tracker.resume(path, data_iterator(cld_fields[3:]), skip_done=False)
+        assert resumed.slab_size == 2
+        resumed.track()
+        assert graph(resumed) == graph(in_memory)
@@ -0,0 +1,86 @@
+import time
+from unittest import TestCase
+
+import numpy as np
+
+from cloud_tracking.tracking import Tracker
+from cloud_tracking.prefetch import PrefetchIterator, load_data
+
+
+class MockCube(object):
+    def __init__(self, data):
+        self.ndim = data.ndim
+        self.data = data
+
+
+class LevelCube(object):
+    """Records which levels have been read."""
+    def __init__(self, data, levels_read):
+        self._data = data
+        self.levels_read = levels_read
+
+    def __getitem__(self, index):
+        self.levels_read.append(index)
+        return MockCube(self._data[index])
+
+    @property
+    def data(self):
+        self.levels_read.append('all')
+        return self._data
+
+
+def slow_iter(items, delay):
+    for item in items:
+        time.sleep(delay)
+        yield item
+
+
+def failing_iter():
+    yield 1
+    raise IOError('read failed')
+
+
+class TestPrefetch(TestCase):
+    def test_prefetch_iterator(self):
+        items = list(PrefetchIterator(range(10), num_ahead=3))
+        assert items == list(range(10))
+
+        prefetcher = PrefetchIterator(failing_iter())
+        assert next(prefetcher) == 1
+        self.assertRaises(IOError, next, prefetcher)
+
+    def test_load_data(self):
+        data = np.arange(12).reshape(3, 4)
+        for item in [data, MockCube(data)]:
+            loaded = load_data(item)
+            assert loaded.data is data
+            assert loaded.ndim == 2
+        assert load_data(5) == 5
+
+    def test_overlaps_io(self):
+        prefetcher = PrefetchIterator(slow_iter(range(5), 0.02), num_ahead=5)
+        time.sleep(0.2)
+        assert list(prefetcher) == list(range(5))
+        assert sum(prefetcher.wait_times) < 0.05
+
+    def test_tracker(self):
+        cld_field = np.zeros((4, 3, 8, 8), dtype=int)
+        cld_field[:, 1, 1:3, 1:3] = 1
+        cld_field[:, 1:3, 5, 5:7] = 2
+        w = np.arange(4 * 3 * 64, dtype=float).reshape(4, 3, 8, 8)
+        rho = np.full((4, 3, 8, 8), 2.)
+
+        trackers = []
+        levels_read = []
+        for prefetch in [False, True]:
+            tracker = Tracker([MockCube(f) for f in cld_field], 10, 10, track_3d=True, track_level=1)
+            tracker.add_mass_flux_info(iter([LevelCube(f, levels_read) for f in w]),
+                                       iter([LevelCube(f, levels_read) for f in rho]))
+            if prefetch:
+                tracker.add_prefetch(num_ahead=2)
+            tracker.track()
+            trackers.append(tracker)
+        assert [c.mass_flux for c in trackers[0].all_clds] == [c.mass_flux for c in trackers[1].all_clds]
+        # Prefetching still only reads the tracking level.
+        assert set(levels_read) == {1}
+        assert len(trackers[1].io_wait_times()) == 4
@@ -0,0 +1,29 @@
+from unittest import TestCase
+
+import numpy as np
+
+from cloud_tracking.preprocessing import CloudLabeller
+from cloud_tracking.utils import label_clds_3d
+
+
+class TestCloudLabeller(TestCase):
+    def test_same_as_loops(self):
+        rng = np.random.RandomState(0)
+        # Stored as (x, y, z), like the model output.
+        ql_xyz = rng.rand(12, 10, 8) * 2e-5 * (rng.rand(12, 10, 8) > 0.5)
+        ql = np.transpose(ql_xyz, (2, 1, 0))
+        nz = ql.shape[0] - 1
+
+        expected_ql = np.zeros_like(ql)
+        for kk in range(0, nz):
+            expected_ql[kk] = 0.5 * (ql[kk] + ql[kk + 1])
+        expected_mask = expected_ql > 1e-5
+
+        labeller = CloudLabeller(ql.shape, threshold=1e-5, diagonal=True, min_cells=5)
+        assert np.all(labeller.mask(ql) == expected_mask)
+        labels = labeller.labels(ql)
+        assert labels.dtype == np.int32
+        assert np.all(labels == label_clds_3d(expected_mask, diagonal=True, min_cells=5)[1])
+
+        # Buffers are reused.
+        assert labeller.labels(ql[:, ::-1]) is labels
@@ -0,0 +1,94 @@
+from unittest import TestCase
+
+import numpy as np
+
+from cloud_tracking.reducers import REDUCERS, register_reducer
+from cloud_tracking.tracking import Tracker
+from cloud_tracking.utils import cloudy_cells
+
+
+class MockCube(object):
+    def __init__(self, data):
+        self.ndim = data.ndim
+        self.data = data
+
+
+class TestReducers(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.RandomState(2)
+        cls.labels = rng.randint(0, 6, (10, 10))
+        cls.labels[cls.labels == 4] = 0
+        cls.values = rng.rand(10, 10)
+        cls.weights = rng.rand(10, 10)
+        cls.max_label = 6
+
+    def _check(self, reducer, func, **kwargs):
+        cloudy, cld_labels = cloudy_cells(self.labels)
+        result = REDUCERS[reducer](cld_labels, self.values.ravel()[cloudy], self.max_label, **kwargs)
+        assert result.shape == (self.max_label,)
+        for label in range(1, self.max_label + 1):
+            mask = self.labels == label
+            if mask.any():
+                assert np.isclose(result[label - 1], func(mask))
+            else:
+                assert np.isnan(result[label - 1]) or result[label - 1] == 0
+
+    def test_simple_reducers(self):
+        self._check('sum', lambda m: self.values[m].sum())
+        self._check('mean', lambda m: self.values[m].mean())
+        self._check('max', lambda m: self.values[m].max())
+        self._check('min', lambda m: self.values[m].min())
+
+    def test_percentile(self):
+        for q in [0, 10, 50, 90, 100]:
+            self._check('percentile', lambda m: np.percentile(self.values[m], q), q=q)
+
+    def test_weighted(self):
+        cloudy, _ = cloudy_cells(self.labels)
+        weights = self.weights.ravel()[cloudy]
+        self._check('weighted_sum', lambda m: (self.values[m] * self.weights[m]).sum(), weights=weights)
+        self._check('weighted_mean', lambda m: np.average(self.values[m], weights=self.weights[m]),
+                    weights=weights)
+
+    def test_register(self):
+        @register_reducer('count_positive')
+        def reduce_count_positive(cld_labels, values, max_label):
+            return np.bincount(cld_labels[values > 0.5], minlength=max_label + 1)[1:]
+        self._check('count_positive', lambda m: (self.values[m] > 0.5).sum())
+        del REDUCERS['count_positive']
+
+
+class TestTrackerReducers(TestCase):
+    def test_3d_reducers(self):
+        cld_field = np.zeros((2, 4, 8, 8), dtype=int)
+        cld_field[:, 1:3, 1:3, 1:3] = 1
+        cld_field[:, 2:4, 5:7, 5] = 2
+        w = np.random.rand(2, 4, 8, 8)
+        qcl = np.random.rand(2, 4, 8, 8)
+        tracker = Tracker([MockCube(f) for f in cld_field], 1, 1, track_3d=True, track_level=2)
+        tracker.add_field('w', [MockCube(f) for f in w])
+        tracker.add_field('qcl', [MockCube(f) for f in qcl])
+        tracker.add_field('w_lev', [MockCube(f) for f in w], track_level_only=True)
+        tracker.add_reducer('max_w', 'max', 'w')
+        tracker.add_reducer('mean_qcl', 'mean', 'qcl')
+        tracker.add_reducer('qcl_weighted_w', 'weighted_mean', 'w', weights='qcl')
+        tracker.add_reducer('w_p90_lev', 'percentile', 'w_lev', q=90)
+        tracker.track()
+
+        for cld in tracker.all_clds:
+            mask = cld_field[cld.time_index] == cld.label
+            assert np.isclose(cld.max_w, w[cld.time_index][mask].max())
+            assert np.isclose(cld.mean_qcl, qcl[cld.time_index][mask].mean())
+            assert np.isclose(cld.qcl_weighted_w, np.average(w[cld.time_index][mask],
+                                                             weights=qcl[cld.time_index][mask]))
+            lev_mask = mask[2]
+            assert np.isclose(cld.w_p90_lev, np.percentile(w[cld.time_index, 2][lev_mask], 90))
+            cld_table = tracker.cld_tables[cld.time_index]
+            assert cld_table['max_w'][cld.label - 1] == cld.max_w
+
+    def test_reserved_name(self):
+        tracker = Tracker([], 1, 1)
+        tracker.add_field('w', [])
+        with self.assertRaises(AssertionError):
+            tracker.add_reducer('size', 'max', 'w')
@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from cloud_tracking.tracking import Tracker
+from cloud_tracking.prefetch import LoadedCube
+from cloud_tracking.shared import SharedRing, shared_iter
+from cloud_tracking.utils import label_clds
+
+
+def masks(ntimes):
+    mask = np.zeros((ntimes, 16, 16), dtype=bool)
+    for i in range(ntimes):
+        mask[i, 2:5, i:i + 3] = True
+        mask[i, 9:12, (i + 5) % 16] = True
+    return mask
+
+
+def label_masks(ntimes):
+    for mask in masks(ntimes):
+        labels = label_clds(mask, diagonal=True)[1]
+        yield {'labels': labels, 'sizes': np.bincount(labels.ravel())[1:]}
+
+
+def fail_at(ntimes, fail_index):
+    for i, arrays in enumerate(label_masks(ntimes)):
+        if i == fail_index:
+            raise IOError('Could not read timestep {}'.format(i))
+        yield arrays
+
+
+class TestShared(TestCase):
+    def test_ring(self):
+        ring = SharedRing(2, 1000)
+        try:
+            slot = ring.acquire(num_readers=2)
+            arrays = {'a': np.arange(10), 'b': np.ones((3, 4), dtype=np.float32)}
+            views = ring.read(slot, ring.write(slot, arrays))
+            for name in arrays:
+                assert np.all(views[name] == arrays[name])
+                assert views[name].dtype == arrays[name].dtype
+            # Views, not copies.
+            views['a'][0] = 5
+            assert ring.read(slot, [('a', arrays['a'].dtype.str, (10,), 0)])['a'][0] == 5
+            ring.acquire()
+            ring.release(slot)
+            self.assertRaises(RuntimeError, ring.acquire, 1, 0.01)
+            ring.release(slot)
+            assert ring.acquire() == slot
+            self.assertRaises(ValueError, ring.write, slot, {'big': np.zeros(1000)})
+        finally:
+            ring.close()
+
+    def test_track_from_other_process(self):
+        tracker = Tracker((LoadedCube(f) for f in (label_clds(m, diagonal=True)[1] for m in masks(6))), 1, 1)
+        tracker.track()
+
+        label_iter = shared_iter(label_masks, (6,), num_slots=3)
+        shared_tracker = Tracker((LoadedCube(arrays['labels']) for arrays in label_iter), 1, 1)
+        shared_tracker.track()
+        assert [(c.label, c.size, [n.label for n in c.next_clds]) for c in tracker.all_clds] == \
+            [(c.label, c.size, [n.label for n in c.next_clds]) for c in shared_tracker.all_clds]
+
+    def test_use_after_iteration(self):
+        # The tracker's last field is a view of shared memory that has been released when iteration ends.
+        label_iter = shared_iter(label_masks, (6,), num_slots=3)
+        tracker = Tracker((LoadedCube(arrays['labels']) for arrays in label_iter), 1, 1)
+        tracker.track()
+        tracker.group()
+        assert np.all(tracker.prev_cld_field == label_clds(masks(6)[-1], diagonal=True)[1])
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'checkpoint.npz')
+            tracker.save_checkpoint(path)
+            resumed = Tracker.resume(path, iter([]))
+            assert np.all(resumed.prev_cld_field == tracker.prev_cld_field)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_producer_error(self):
+        label_iter = shared_iter(fail_at, (6, 3), num_slots=3)
+        labels = []
+        with self.assertRaises(IOError):
+            for arrays in label_iter:
+                labels.append(arrays['labels'])
+        assert len(labels) == 3
+        assert np.all(labels[-1] == label_clds(masks(6)[2], diagonal=True)[1])
@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from cloud_tracking.tracking import Tracker
+from cloud_tracking.sparse import SparseLabels, sparse_label_pairs
+from cloud_tracking.utils import label_pairs, grow_shifts, label_adjacency
+
+
+class MockCube(object):
+    def __init__(self, data):
+        self.ndim = data.ndim
+        self.data = data
+
+
+def data_iterator(data):
+    for i in range(data.shape[0]):
+        yield MockCube(data[i])
+
+
+def drifting_clouds(shape, ntimes=5, seed=0):
+    """Blocks of labels drifting across a periodic domain, some growing into each other."""
+    rng = np.random.RandomState(seed)
+    cld_field = np.zeros((ntimes,) + shape, dtype=np.int32)
+    num_clds = 8
+    starts = [rng.randint(0, n, num_clds) for n in shape]
+    for t in range(ntimes):
+        for label in range(1, num_clds + 1):
+            slices = []
+            for axis, n in enumerate(shape):
+                start = starts[axis][label - 1] + (t if axis == len(shape) - 1 else 0)
+                slices.append(np.arange(start, start + 2 + (label + t) % 3) % n)
+            cld_field[(t,) + np.ix_(*slices)] = label
+    return cld_field
+
+
+def graph(tracker):
+    return [(c.time_index, c.label, c.size, list(np.nan_to_num(c.pos, nan=-1)),
+             [(n.time_index, n.label, n.overlap(c)) for n in c.next_clds])
+            for c in tracker.all_clds]
+
+
+class TestSparseLabels(TestCase):
+    def test_roll_and_pairs(self):
+        rng = np.random.RandomState(1)
+        for shape in [(10, 12), (3, 8, 9)]:
+            proj = rng.randint(0, 5, size=shape) * (rng.rand(*shape) > 0.7)
+            curr = rng.randint(0, 5, size=shape) * (rng.rand(*shape) > 0.7)
+            sparse_proj, sparse_curr = SparseLabels.from_dense(proj), SparseLabels.from_dense(curr)
+            shift = (2, -3, 5)[-len(shape):]
+            assert np.all(sparse_proj.roll(shift).to_dense() == np.roll(proj, shift, axis=tuple(range(len(shape)))))
+            for shifts in [None, [(0,) * len(shape)] + grow_shifts(len(shape), True)]:
+                expected = label_pairs(proj, curr, shifts)
+                for a, b in zip(sparse_label_pairs(sparse_proj, sparse_curr, shifts), expected):
+                    assert np.all(a == b)
+            for a, b in zip(label_adjacency(sparse_curr, True, sparse_curr.cells()), label_adjacency(curr, True)):
+                assert np.all(a == b)
+
+
+class TestSparseTracking(TestCase):
+    def _track(self, cld_field, sparse, **kwargs):
+        tracker = Tracker(data_iterator(cld_field), dx=1, dy=1, include_touching=True, sparse=sparse, **kwargs)
+        tracker.track()
+        return tracker
+
+    def test_same_as_dense_2d(self):
+        cld_field = drifting_clouds((30, 40))
+        dense = self._track(cld_field, False)
+        for sparse in [True, 'auto']:
+            assert graph(self._track(cld_field, sparse)) == graph(dense)
+        # Too cloudy for 'auto' to use sparse for some timesteps.
+        assert graph(self._track(cld_field, 'auto', sparse_max_fraction=0.05)) == graph(dense)
+
+    def test_same_as_dense_3d(self):
+        cld_field = drifting_clouds((6, 20, 24))
+        kwargs = {'track_3d': True, 'track_level': 2}
+        dense = self._track(cld_field, False, **kwargs)
+        sparse = self._track(cld_field, True, **kwargs)
+        assert graph(sparse) == graph(dense)
+        for cld_table, sparse_cld_table in zip(dense.cld_tables, sparse.cld_tables):
+            for column in cld_table:
+                assert np.allclose(cld_table[column], sparse_cld_table[column], equal_nan=True)
+
+    def test_sparse_input_and_resume(self):
+        cld_field = drifting_clouds((30, 40))
+        dense = self._track(cld_field, False)
+        tracker = Tracker((SparseLabels.from_dense(f) for f in cld_field[:3]), dx=1, dy=1,
+                          include_touching=True, sparse=True)
+        tracker.track()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'checkpoint.npz')
+            tracker.save_checkpoint(path)
+            resumed = Tracker.resume(path, data_iterator(cld_field[3:]), skip_done=False)
+        finally:
+            shutil.rmtree(tmpdir)
+        assert isinstance(resumed.prev_cld_field, SparseLabels)
+        resumed.track()
+        assert graph(resumed) == graph(dense)
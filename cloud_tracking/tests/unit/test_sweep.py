@@ -0,0 +1,61 @@
+from unittest import TestCase
+
+import numpy as np
+
+from cloud_tracking.tracking import Tracker
+from cloud_tracking.sweep import ParameterSweep
+from cloud_tracking.utils import label_clds
+
+
+class MockCube(object):
+    def __init__(self, data):
+        self.ndim = data.ndim
+        self.data = data
+
+
+def random_cld_field(ntimes=6, shape=(30, 30), seed=1):
+    rng = np.random.RandomState(seed)
+    mask = rng.rand(*shape) > 0.8
+    cld_field = []
+    for i in range(ntimes):
+        mask = np.roll(mask, 1, axis=1) ^ (rng.rand(*shape) > 0.95)
+        cld_field.append(label_clds(mask, diagonal=True)[1])
+    return np.array(cld_field)
+
+
+def graph(tracker):
+    return [(c.time_index, c.label, c.size, [(n.time_index, n.label) for n in c.next_clds])
+            for c in tracker.all_clds]
+
+
+class TestParameterSweep(TestCase):
+    def test_same_as_tracker(self):
+        cld_field = random_cld_field()
+        sweep = ParameterSweep([MockCube(f) for f in cld_field], 1, 1)
+        param_grid = {
+            'include_touching': [False, True],
+            'touching_diagonal': [False, True],
+            'ignore_smaller_equal_than': [0, 2],
+            'frac_method': ['pc2009', 'simple'],
+        }
+        results = sweep.run('test', param_grid)
+        assert len(results) == 16
+
+        for params, sweep_tracker, stats in results:
+            tracker = Tracker([MockCube(f) for f in cld_field], 1, 1, **params)
+            tracker.track()
+            tracker.group()
+            assert graph(sweep_tracker) == graph(tracker)
+            assert sweep_tracker.ignored == tracker.ignored
+            assert len(sweep_tracker.groups) == len(tracker.groups)
+            assert stats['all']['num_clouds'] == sum(len(g) for g in tracker.groups)
+
+    def test_cluster(self):
+        cld_field = random_cld_field()
+        sweep = ParameterSweep([MockCube(f) for f in cld_field], 1, 1)
+        sweep.compute()
+        tracker = Tracker([MockCube(f) for f in cld_field], 1, 1)
+        tracker.track()
+        clusters = [[[c.label for c in cluster] for cluster in clusters] for clusters in tracker.cluster(5.)]
+        assert clusters == [[[c.label for c in cluster] for cluster in sweep_clusters]
+                            for sweep_clusters in sweep.tracker().cluster(5.)]
@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from cloud_tracking.tracking import Tracker
+from cloud_tracking.thresholds import NestedLabeller, ThresholdSweep
+from cloud_tracking.utils import label_clds
+
+
+class MockCube(object):
+    def __init__(self, data):
+        self.ndim = data.ndim
+        self.data = data
+
+
+def data_iterator(data):
+    for i in range(data.shape[0]):
+        yield MockCube(data[i])
+
+
+def smooth_field(shape, seed=0):
+    """Random field smoothed over a periodic domain, so that thresholds give clouds of many sizes."""
+    rng = np.random.RandomState(seed)
+    field = rng.rand(*shape)
+    for axis in range(len(shape)):
+        field = sum(np.roll(field, s, axis=axis) for s in range(-2, 3)) / 5
+    return field
+
+
+def graph(tracker):
+    return [(c.time_index, c.label, c.size, [(n.time_index, n.label, n.overlap(c)) for n in c.next_clds])
+            for c in tracker.all_clds]
+
+
+class TestNestedLabeller(TestCase):
+    def test_same_as_label_clds(self):
+        field = smooth_field((30, 40))
+        thresholds = list(np.percentile(field, [60, 50, 90, 75]))
+        for diagonal in [False, True]:
+            for wrap in [False, True]:
+                for min_cells in [0, 3]:
+                    labeller = NestedLabeller(thresholds, diagonal, wrap, min_cells)
+                    for threshold, (max_label, labels) in zip(thresholds, labeller.labels(field)):
+                        expected_max_label, expected_labels = label_clds(field > threshold, diagonal, wrap, min_cells)
+                        assert max_label == expected_max_label
+                        assert np.all(labels == expected_labels)
+
+    def test_reuses_whole_clouds(self):
+        field = np.zeros((10, 12))
+        field[1:3, 1:3] = 2
+        field[5:8, 5:9] = 1
+        field[6, 6] = 2
+        labeller = NestedLabeller([0.5, 1.5])
+        (_, low), (max_label, high) = labeller.labels(field)
+        assert labeller.num_reused == 1
+        assert labeller.num_relabelled == 1
+        assert max_label == 2
+        assert np.all(high == label_clds(field > 1.5)[1])
+
+
+class TestThresholdSweep(TestCase):
+    def test_same_as_separate_trackers(self):
+        fields = np.array([np.roll(smooth_field((30, 40), seed=1), t, axis=1) for t in range(4)])
+        thresholds = [0.5, 0.55, 0.6]
+        sweep = ThresholdSweep(data_iterator(fields), thresholds, dx=1, dy=1, diagonal=True,
+                               include_touching=True)
+        sweep.track()
+        sweep.group()
+        for threshold in thresholds:
+            labels = [MockCube(label_clds(field > threshold, diagonal=True)[1]) for field in fields]
+            tracker = Tracker(labels, dx=1, dy=1, include_touching=True)
+            tracker.track()
+            assert graph(sweep.trackers[threshold]) == graph(tracker)
+
+        # Plain arrays rather than cubes.
+        array_sweep = ThresholdSweep(iter(fields), thresholds, dx=1, dy=1, diagonal=True, include_touching=True)
+        array_sweep.track()
+        for threshold in thresholds:
+            assert graph(array_sweep.trackers[threshold]) == graph(sweep.trackers[threshold])
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            all_stats = sweep.output_stats('test', tmpdir, 'ct_')
+            assert list(all_stats) == thresholds
+            with open(os.path.join(tmpdir, 'ct_thresholds.csv')) as f:
+                lines = f.readlines()
+            assert len(lines) == 1 + 7 * len(thresholds)
+            header = lines[0].strip().split(',')
+            for line in lines[1:]:
+                row = dict(zip(header, line.strip().split(',')))
+                assert len(row) == len(header) and ' ' not in line
+                assert float(row['threshold']) in thresholds
+                assert row['mean_lifetime'] == '' or float(row['mean_lifetime']) > 0
+            assert os.path.exists(os.path.join(tmpdir, 'ct_threshold_0.5.txt'))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_tracker_error(self):
+        fields = np.array([smooth_field((20, 24), seed=t) for t in range(5)])
+        sweep = ThresholdSweep(data_iterator(fields), [0.5, 0.6], dx=1, dy=1, num_ahead=1)
+        # Expects 3D fields - the error is raised from track without blocking the other tracker.
+        sweep.trackers[0.6].track_3d = True
+        with self.assertRaises(AssertionError):
+            sweep.track()
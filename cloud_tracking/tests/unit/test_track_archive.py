@@ -0,0 +1,197 @@
+import os
+import shutil
+import tempfile
+import itertools
+from unittest import TestCase
+
+import numpy as np
+
+from cloud_tracking.tracking import Tracker
+from cloud_tracking.track_archive import read_archive, segment_path
+from cloud_tracking.export import group_tables
+
+
+class MockCube(object):
+    def __init__(self, data):
+        self.ndim = data.ndim
+        self.data = data
+
+
+def data_iterator(data):
+    for i in range(data.shape[0]):
+        yield MockCube(data[i])
+
+
+def moving_clouds(ntimes=8):
+    """Two clouds moving with a constant wind, which merge at the end."""
+    cld_field = np.zeros((ntimes, 20, 20), dtype=np.int32)
+    for i in range(ntimes):
+        cld_field[i, 2:5, i:i + 3] = 1
+        cld_field[i, 8:11 - (i == ntimes - 1) * 4, i + 1:i + 3] = 2 - (i == ntimes - 1)
+    return cld_field
+
+
+def graph(tracker):
+    return [(c.time_index, c.label, c.size, [(n.time_index, n.label) for n in c.next_clds])
+            for c in tracker.all_clds]
+
+
+class TestTrackArchive(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'checkpoint.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_resume_same_as_uninterrupted(self):
+        cld_field = moving_clouds()
+        tracker = Tracker(data_iterator(cld_field), 1, 1)
+        tracker.track()
+
+        # Simulate a job that gets killed after 5 timesteps.
+        part_tracker = Tracker(itertools.islice(data_iterator(cld_field), 5), 1, 1)
+        part_tracker.add_checkpointing(self.path, checkpoint_every=2)
+        part_tracker.track()
+        assert os.path.exists(self.path)
+
+        resumed_tracker = Tracker.resume(self.path, data_iterator(cld_field))
+        assert len(resumed_tracker.clds_at_time) == 4
+        resumed_tracker.track()
+        assert graph(resumed_tracker) == graph(tracker)
+
+    def test_resume_no_skip(self):
+        cld_field = moving_clouds()
+        tracker = Tracker(data_iterator(cld_field), 1, 1, ignore_smaller_equal_than=0)
+        tracker.track()
+        tracker.group()
+
+        part_tracker = Tracker(data_iterator(cld_field[:3]), 1, 1, ignore_smaller_equal_than=0)
+        part_tracker.track()
+        part_tracker.save_checkpoint(self.path)
+
+        resumed_tracker = Tracker.resume(self.path, data_iterator(cld_field[3:]), skip_done=False)
+        resumed_tracker.track()
+        resumed_tracker.group()
+        assert graph(resumed_tracker) == graph(tracker)
+        assert len(resumed_tracker.groups) == len(tracker.groups)
+
+    def test_append(self):
+        cld_field = moving_clouds(12)
+        tracker = Tracker(data_iterator(cld_field), 1, 1, ignore_smaller_equal_than=0)
+        tracker.track()
+        tracker.group()
+
+        # Archive built up from three batches of newly arrived timesteps.
+        for start, end in [(0, 4), (4, 9), (9, 12)]:
+            if start:
+                append_tracker = Tracker.resume(self.path, data_iterator(cld_field[start:end]), skip_done=False)
+            else:
+                append_tracker = Tracker(data_iterator(cld_field[start:end]), 1, 1, ignore_smaller_equal_than=0)
+            append_tracker.track()
+            append_tracker.group()
+            append_tracker.save_checkpoint(self.path)
+
+        appended_tracker = Tracker.resume(self.path, [])
+        assert graph(appended_tracker) == graph(tracker)
+        assert len(appended_tracker.groups) == len(tracker.groups)
+        for group, appended_group in zip(tracker.groups, appended_tracker.groups):
+            assert [c.lifetime for c in group.clds] == [c.lifetime for c in appended_group.clds]
+            assert group.num_merges == appended_group.num_merges
+
+    def test_regroup_keeps_closed_groups(self):
+        cld_field = moving_clouds(6)
+        cld_field[3:] = 0
+        tracker = Tracker(data_iterator(cld_field[:4]), 1, 1, ignore_smaller_equal_than=0)
+        tracker.track()
+        closed_groups = list(tracker.group())
+
+        tracker.cld_field_iter = data_iterator(cld_field[4:])
+        tracker.track()
+        tracker.group()
+        assert all(g in tracker.groups for g in closed_groups)
+
+    def test_resume_adaptive_correlation(self):
+        cld_field = moving_clouds()
+        tracker = Tracker(data_iterator(cld_field), 1, 1)
+        tracker.add_adaptive_correlation()
+        tracker.track()
+        assert tracker.adaptive_correlator.stats()['skipped'] > 0
+
+        part_tracker = Tracker(data_iterator(cld_field[:4]), 1, 1)
+        part_tracker.add_adaptive_correlation()
+        part_tracker.track()
+        part_tracker.save_checkpoint(self.path)
+        resumed_tracker = Tracker.resume(self.path, data_iterator(cld_field[4:]), skip_done=False)
+        assert resumed_tracker.adaptive_correlator.last == part_tracker.adaptive_correlator.last
+        resumed_tracker.track()
+        assert graph(resumed_tracker) == graph(tracker)
+
+    def test_append_segments(self):
+        cld_field = moving_clouds(12)
+        # Cloudless timesteps, so that groups complete along the way.
+        cld_field[[3, 7]] = 0
+        tracker = Tracker(data_iterator(cld_field), 1, 1, ignore_smaller_equal_than=0)
+        tracker.track()
+        tracker.group()
+
+        num_clds = 0
+        for start, end in [(0, 4), (4, 9), (9, 12)]:
+            if start:
+                append_tracker = Tracker.resume(self.path, [], skip_done=False)
+                # Only the timesteps of the open groups are restored.
+                assert len(append_tracker.all_clds) < num_clds
+                assert len(append_tracker.clds_at_time) == start
+            else:
+                append_tracker = Tracker([], 1, 1, ignore_smaller_equal_than=0)
+                append_tracker.add_online(keep_history=False)
+            completed = []
+            for field in cld_field[start:end]:
+                step = append_tracker.push(field)
+                completed.extend(step.completed_groups)
+                num_clds += len(step.clds)
+            append_tracker.write_segment(self.path, completed, {'num_clds': num_clds})
+            append_tracker.save_checkpoint(self.path)
+            if not start:
+                first_segment = read_archive(segment_path(self.path, 0))
+        assert append_tracker.num_segments == 3
+
+        # Segments are not rewritten.
+        arrays, meta = read_archive(segment_path(self.path, 0))
+        assert meta == first_segment[1]
+        assert all(np.array_equal(arrays[name], first_segment[0][name]) for name in arrays)
+
+        cld_tables = []
+        edge_tables = []
+        num_groups = 0
+        for index in range(append_tracker.num_segments):
+            arrays, meta = read_archive(segment_path(self.path, index))
+            assert meta['first_group'] == num_groups
+            num_groups += meta['num_groups']
+            cld_tables.append({name[4:]: values for name, values in arrays.items() if name.startswith('cld_')})
+            edge_tables.append({name[5:]: values for name, values in arrays.items() if name.startswith('edge_')})
+        assert meta['num_clds'] == len(tracker.all_clds)
+        open_groups = append_tracker.open_groups()
+        cld_table, edge_table = group_tables(open_groups, meta['columns'], num_groups)
+        cld_tables.append(cld_table)
+        edge_tables.append(edge_table)
+        assert num_groups + len(open_groups) == len(tracker.groups)
+
+        expected_cld_table, expected_edge_table = group_tables(tracker.groups, meta['columns'])
+        for expected, tables, key in [(expected_cld_table, cld_tables, ['id']),
+                                      (expected_edge_table, edge_tables, ['prev_id', 'next_id'])]:
+            table = {name: np.concatenate([t[name] for t in tables]) for name in expected}
+            expected_order = np.lexsort([expected[name] for name in key])
+            order = np.lexsort([table[name] for name in key])
+            for name in expected:
+                if name == 'group':
+                    continue
+                assert np.allclose(table[name][order], expected[name][expected_order], equal_nan=True), name
+        # Same clouds in each group.
+        assert (sorted(sorted(ids) for ids in _group_ids(np.concatenate([t['group'] for t in cld_tables]),
+                                                          np.concatenate([t['id'] for t in cld_tables]))) ==
+                sorted(sorted(ids) for ids in _group_ids(expected_cld_table['group'], expected_cld_table['id'])))
+
+
+def _group_ids(group, ids):
+    return [list(ids[group == g]) for g in np.unique(group)]
@@ -0,0 +1,47 @@
+from unittest import TestCase
+
+import numpy as np
+
+from cloud_tracking.tracking import Cloud, CloudGroup
+from cloud_tracking.tracks import extract_tracks, split_tracks
+
+
+class TestExtractTracks(TestCase):
+    def _tracks(self, group, criterion):
+        indices, offsets = extract_tracks(group, criterion)
+        return sorted([[(group.clds[i].time_index, group.clds[i].label) for i in track]
+                       for track in split_tracks(indices, offsets)])
+
+    def test_split_merge(self):
+        # 1 -> (1, 2) -> 1, with 2 at time 1 larger but overlapping less.
+        c0_1 = Cloud(1, 0, [0, 0], 10)
+        c1_1 = Cloud(1, 1, [0, 0], 4)
+        c1_2 = Cloud(2, 1, [0, 0], 9)
+        c2_1 = Cloud(1, 2, [0, 0], 8)
+        c0_1.add_next(c1_1, overlap=4)
+        c0_1.add_next(c1_2, overlap=3)
+        c1_1.add_next(c2_1, overlap=2)
+        c1_2.add_next(c2_1, overlap=6)
+        group = CloudGroup([c0_1, c1_1, c1_2, c2_1])
+        next_clds = [list(c.next_clds) for c in group.clds]
+
+        assert self._tracks(group, 'max_overlap') == [[(0, 1), (1, 1)], [(1, 2), (2, 1)]]
+        assert self._tracks(group, 'closest_size') == [[(0, 1), (1, 2), (2, 1)], [(1, 1)]]
+        # Graph is not modified.
+        assert next_clds == [list(c.next_clds) for c in group.clds]
+
+    def test_every_cloud_in_one_track(self):
+        rng = np.random.RandomState(0)
+        clds = [[Cloud(label, t, [0, 0], rng.randint(1, 10)) for label in range(1, 5)] for t in range(5)]
+        for t in range(4):
+            for c in clds[t]:
+                for n in clds[t + 1]:
+                    if rng.rand() > 0.6:
+                        c.add_next(n, overlap=rng.randint(1, 5))
+        group = CloudGroup([c for cs in clds for c in cs], frac_method='simple')
+        for criterion in ['max_overlap', 'max_frac', 'closest_size']:
+            indices, offsets = extract_tracks(group, criterion)
+            assert sorted(indices) == list(range(len(group.clds)))
+            for track in split_tracks(indices, offsets):
+                for i, j in zip(track[:-1], track[1:]):
+                    assert group.clds[j] in group.clds[i].next_clds
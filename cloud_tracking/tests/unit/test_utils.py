@@ -48,3 +48,75 @@ class TestCountBlobMask(TestCase):
         assert max_index == 1
         max_index, blobs = utils.label_clds(TestCountBlobMask.spiral, wrap=True)
         assert max_index == 1
+
+
+class TestLabelPairs(TestCase):
+    def test_grow_shifts(self):
+        rng = np.random.RandomState(0)
+        for diagonal in [False, True]:
+            a = rng.rand(9, 10) > 0.9
+            grown = a.copy()
+            for shift in utils.grow_shifts(2, diagonal):
+                grown |= np.roll(a, shift, axis=(0, 1))
+            assert (grown == utils.grow(a, diagonal)).all()
+
+            a = rng.rand(5, 9, 10) > 0.9
+            grown = a.copy()
+            for shift in utils.grow_shifts(3, diagonal):
+                grown |= np.roll(a, shift, axis=(0, 1, 2))
+            assert (grown == utils.grow_3d(a, diagonal)).all()
+
+    def test_label_pairs(self):
+        proj_field = np.zeros((6, 6), dtype=int)
+        curr_field = np.zeros((6, 6), dtype=int)
+        proj_field[1:3, 1:3] = 1
+        proj_field[4, 4] = 2
+        curr_field[2, 1:4] = 1
+        curr_field[4, 5] = 2
+        prev_labels, curr_labels, counts = utils.label_pairs(proj_field, curr_field)
+        assert list(zip(prev_labels, curr_labels, counts)) == [(1, 1, 2)]
+        shifts = [(0, 0)] + utils.grow_shifts(2)
+        prev_labels, curr_labels, counts = utils.label_pairs(proj_field, curr_field, shifts)
+        assert list(zip(prev_labels, curr_labels)) == [(1, 1), (2, 2)]
+
+    def test_label_centroids(self):
+        labels = np.zeros((6, 6), dtype=int)
+        labels[1:3, 1:4] = 1
+        labels[5, 0] = 2
+        pos = utils.label_centroids(labels, 3)
+        assert (pos[0] == [1.5, 2]).all()
+        assert (pos[1] == [5, 0]).all()
+        assert np.isnan(pos[2]).all()
+
+
+class TestLabelAdjacency(TestCase):
+    def _all_pairs(self, labels, shifts, periodic_axes):
+        """Count touching grid-cell pairs by looking at every grid-cell and every neighbour."""
+        counts = {}
+        for idx in np.ndindex(*labels.shape):
+            for shift in shifts:
+                neighbour = [i + s for i, s in zip(idx, shift)]
+                if any(not (0 <= n < size) for axis, (n, size) in enumerate(zip(neighbour, labels.shape))
+                       if axis not in periodic_axes):
+                    continue
+                neighbour = tuple(n % size for n, size in zip(neighbour, labels.shape))
+                a, b = labels[idx], labels[neighbour]
+                if a and b and a != b:
+                    key = (min(a, b), max(a, b))
+                    counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def test_adjacency_shifts(self):
+        assert len(utils.adjacency_shifts(2)) == 2
+        assert len(utils.adjacency_shifts(2, True)) == 4
+        assert len(utils.adjacency_shifts(3)) == 3
+        assert len(utils.adjacency_shifts(3, True)) == 9
+
+    def test_label_adjacency(self):
+        rng = np.random.RandomState(1)
+        for shape, periodic_axes in [((9, 11), (0, 1)), ((4, 7, 6), (1, 2))]:
+            labels = rng.randint(0, 6, size=shape)
+            for diagonal in [False, True]:
+                a, b, counts = utils.label_adjacency(labels, diagonal)
+                expected = self._all_pairs(labels, utils.adjacency_shifts(labels.ndim, diagonal), periodic_axes)
+                assert dict(((i, j), c) for i, j, c in zip(a, b, counts)) == expected
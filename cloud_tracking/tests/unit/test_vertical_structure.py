@@ -0,0 +1,51 @@
+from unittest import TestCase
+
+import numpy as np
+
+from cloud_tracking.tracking import Tracker
+from cloud_tracking.vertical_structure import vertical_structure_from_labels, group_by_bins
+
+
+class MockCube(object):
+    def __init__(self, data):
+        self.ndim = data.ndim
+        self.data = data
+
+
+class TestVerticalStructure(TestCase):
+    def test_vertical_structure(self):
+        rng = np.random.RandomState(3)
+        labels = rng.randint(0, 5, (6, 7, 8))
+        w = rng.rand(6, 7, 8)
+        rho = rng.rand(6, 7, 8)
+        dz = np.arange(1, 7)
+        columns = vertical_structure_from_labels(labels, 5, dx=2, dy=2, dz=dz, w=w, rho=rho)
+        for label in range(1, 5):
+            z = np.where(labels == label)[0]
+            assert columns['top'][label - 1] == z.max()
+            assert columns['base'][label - 1] == z.min()
+            assert columns['depth'][label - 1] == z.max() - z.min()
+            assert columns['volume'][label - 1] == dz[z].sum() * 4
+            for k in range(6):
+                mask = labels[k] == label
+                assert columns['area_profile'][label - 1, k] == mask.sum()
+                assert np.isclose(columns['mass_flux_profile'][label - 1, k], (w[k] * rho[k])[mask].sum() * 4)
+        assert columns['top'][4] == -1
+
+    def test_group_by_bins(self):
+        lifetimes = np.array([1, 7, 5, 12, 3, 60])
+        groups = group_by_bins(np.arange(6), lifetimes, [0, 5, 10, 50])
+        assert [list(g) for g in groups] == [[0, 2, 4], [1], [3]]
+
+    def test_tracker_mass_flux_profile(self):
+        cld_field = np.zeros((2, 4, 6, 6), dtype=int)
+        cld_field[:, 1:3, 1:3, 1:3] = 1
+        w = np.random.rand(2, 4, 6, 6)
+        tracker = Tracker([MockCube(f) for f in cld_field], 10, 10, track_3d=True, track_level=1)
+        tracker.add_field('w3d', [MockCube(f) for f in w])
+        tracker.add_field('rho3d', [MockCube(np.ones_like(f)) for f in w])
+        tracker.add_vertical_structure(dz=5, w='w3d', rho='rho3d')
+        tracker.track()
+        cld = tracker.all_clds[0]
+        assert cld.volume == 8 * 100 * 5
+        assert np.isclose(cld.mass_flux_profile[1], w[0, 1, 1:3, 1:3].sum() * 100)
@@ -0,0 +1,216 @@
+"""Tracking of clouds defined by several thresholds of one raw field, reading each timestep once.
+
+Each raw timestep (e.g. w at one level) is read once and labelled at every threshold. Labelling is done
+from the lowest threshold up: a cloud at a higher threshold always lies within one cloud at the lower
+threshold, so lower threshold clouds that are entirely above the higher threshold are reused as they
+are, those with no grid-cells above it are dropped, and only the grid-cells of the rest are labelled
+again. Labels are numbered exactly as `utils.label_clds` would number them.
+
+The label fields are passed to one Tracker per threshold, each running on its own thread, and stats for
+all thresholds can be output together.
+"""
+import os
+import queue
+import threading
+from logging import getLogger
+from collections import OrderedDict
+
+import numpy as np
+
+from cloud_tracking.decomposition import label_clds_tiled
+from cloud_tracking.preprocessing import LabelCube
+from cloud_tracking.tracking import Tracker
+from cloud_tracking.cloud_tracking_analysis import generate_stats, output_stats_to_file
+
+logger = getLogger('ct.thresholds')
+
+_END = object()
+
+
+def _first_keys(labels, max_label):
+    """Position of the first grid-cell of each label (index 0 unused) in `label_clds` scan order."""
+    cells = np.flatnonzero(labels)
+    rows, cols = np.unravel_index(cells, labels.shape)
+    first_key = np.full(max_label + 1, np.iinfo(np.int64).max)
+    # label_clds scans columns outer, rows inner.
+    np.minimum.at(first_key, labels.flat[cells], cols.astype(np.int64) * labels.shape[0] + rows)
+    return first_key
+
+
+def _apply_min_cells(labels, max_label, min_cells):
+    """Same output as `utils.label_clds` with min_cells, from the labels found without it."""
+    if min_cells <= 0:
+        return max_label, labels
+    keep = np.bincount(labels.ravel(), minlength=max_label + 1) >= min_cells
+    keep[0] = False
+    new_label = np.zeros(max_label + 1, dtype=np.int32)
+    new_label[keep] = np.arange(1, keep.sum() + 1)
+    return int(keep.sum()) + 1, new_label[labels]
+
+
+class NestedLabeller(object):
+    """Labels a 2D field at several thresholds, reusing the labelling of each lower threshold."""
+    def __init__(self, thresholds, diagonal=False, wrap=True, min_cells=0):
+        """
+        :param list thresholds: thresholds - grid-cells with values above a threshold are cloudy.
+        :param bool diagonal: Whether to treat diagonal cells as contiguous.
+        :param bool wrap: Whether to wrap on edge.
+        :param int min_cells: Minimum number of grid-cells to include in a cloud.
+        """
+        self.thresholds = list(thresholds)
+        self.diagonal = diagonal
+        self.wrap = wrap
+        self.min_cells = min_cells
+        # Number of clouds reused from a lower threshold, and number labelled again.
+        self.num_reused = 0
+        self.num_relabelled = 0
+
+    def labels(self, field):
+        """Label field > threshold for each threshold.
+
+        :param np.ndarray field: 2D field.
+        :return list: (max_label, labels) for each threshold, as returned by `utils.label_clds`.
+        """
+        field = np.asarray(field)
+        results = [None] * len(self.thresholds)
+        prev = None
+        for index in np.argsort(self.thresholds, kind='stable'):
+            mask = field > self.thresholds[index]
+            if prev is None:
+                max_label, labels = label_clds_tiled(mask, (1, 1), self.diagonal, self.wrap)
+                first_key = _first_keys(labels, max_label)
+            else:
+                max_label, labels, first_key = self._relabel(mask, *prev)
+            results[index] = _apply_min_cells(labels, max_label, self.min_cells)
+            prev = (max_label, labels, first_key)
+        return results
+
+    def _relabel(self, mask, prev_max_label, prev_labels, prev_first_key):
+        """Label mask, a subset of the mask labelled by prev_labels."""
+        prev_sizes = np.bincount(prev_labels.ravel(), minlength=prev_max_label + 1)
+        sizes_in_mask = np.bincount(prev_labels[mask], minlength=prev_max_label + 1)
+        whole = sizes_in_mask == prev_sizes
+        partial = (sizes_in_mask > 0) & ~whole
+        whole[0] = partial[0] = False
+        # Only the grid-cells of clouds that are partly in mask need labelling again.
+        num_sub, sub_labels = label_clds_tiled(mask & partial[prev_labels], (1, 1), self.diagonal, self.wrap)
+        reused = np.flatnonzero(whole)
+        self.num_reused += len(reused)
+        self.num_relabelled += int(partial.sum())
+
+        # Number reused and new clouds together by their first grid-cell, as label_clds would.
+        keys = np.concatenate([prev_first_key[reused], _first_keys(sub_labels, num_sub)[1:]])
+        order = np.argsort(keys)
+        new_label = np.empty(len(keys), dtype=np.int32)
+        new_label[order] = np.arange(1, len(keys) + 1)
+        reused_label = np.zeros(prev_max_label + 1, dtype=np.int32)
+        reused_label[reused] = new_label[:len(reused)]
+        labels = reused_label[prev_labels]
+        sub_cells = np.flatnonzero(sub_labels)
+        labels.flat[sub_cells] = new_label[len(reused) + sub_labels.flat[sub_cells] - 1]
+        return len(keys), labels, np.concatenate([[np.iinfo(np.int64).max], keys[order]])
+
+
+def _queue_iter(label_queue):
+    while True:
+        item = label_queue.get()
+        if item is _END:
+            return
+        yield item
+
+
+class ThresholdSweep(object):
+    """Tracks clouds at several thresholds of a raw field, with one Tracker per threshold."""
+    def __init__(self, field_iter, thresholds, dx, dy, diagonal=True, min_cells=0, num_ahead=2, **kwargs):
+        """
+        :param field_iter: iterable raw 2D field - arrays, or cubes with data.
+        :param list thresholds: thresholds - grid-cells with values above a threshold are cloudy.
+        :param float dx: resolution in x-dir.
+        :param float dy: resolution in y-dir.
+        :param bool diagonal: Whether to treat diagonal cells as contiguous when labelling.
+        :param int min_cells: Minimum number of grid-cells to include in a cloud.
+        :param int num_ahead: max number of timesteps a tracker can fall behind the reader.
+        :param kwargs: passed to each Tracker.
+        """
+        assert len(set(thresholds)) == len(thresholds), 'Thresholds must be unique'
+        self.field_iter = iter(field_iter)
+        self.thresholds = list(thresholds)
+        self.labeller = NestedLabeller(thresholds, diagonal, True, min_cells)
+        self._queues = [queue.Queue(num_ahead) for _ in self.thresholds]
+        # Threshold -> Tracker, add_* methods can be called on these before track.
+        self.trackers = OrderedDict((threshold, Tracker(_queue_iter(label_queue), dx, dy, **kwargs))
+                                    for threshold, label_queue in zip(self.thresholds, self._queues))
+        self._errors = {}
+
+    def _track(self, threshold, label_queue):
+        try:
+            self.trackers[threshold].track()
+        except Exception as e:
+            logger.error('Tracking failed for threshold {}: {}'.format(threshold, e))
+            self._errors[threshold] = e
+            # Keep taking fields so that the reader is never blocked.
+            for _ in _queue_iter(label_queue):
+                pass
+
+    def track(self):
+        """Read and label each timestep once, and track the clouds at every threshold concurrently."""
+        threads = [threading.Thread(target=self._track, args=(threshold, label_queue),
+                                    name='track_{}'.format(threshold))
+                   for threshold, label_queue in zip(self.thresholds, self._queues)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            for item in self.field_iter:
+                if self._errors:
+                    break
+                field = item if isinstance(item, np.ndarray) else item.data
+                for label_queue, (_, labels) in zip(self._queues, self.labeller.labels(field)):
+                    label_queue.put(LabelCube(labels))
+        finally:
+            for label_queue in self._queues:
+                label_queue.put(_END)
+            for thread in threads:
+                thread.join()
+        logger.debug('Reused {} clouds, relabelled {}'.format(self.labeller.num_reused,
+                                                               self.labeller.num_relabelled))
+        if self._errors:
+            raise next(iter(self._errors.values()))
+        return self.trackers
+
+    def group(self):
+        for tracker in self.trackers.values():
+            tracker.group()
+
+    def stats(self, expt_name):
+        """
+        :param str expt_name: name passed on to generate_stats.
+        :return OrderedDict: threshold -> stats, see cloud_tracking_analysis.generate_stats.
+        """
+        return OrderedDict((threshold, generate_stats(expt_name, tracker))
+                           for threshold, tracker in self.trackers.items())
+
+    def output_stats(self, expt_name, output_dir, prefix):
+        """Write stats for each threshold, and a table of stats for all thresholds.
+
+        :param str expt_name: name of experiment.
+        :param str output_dir: directory to write to.
+        :param str prefix: prefix of filenames.
+        :return OrderedDict: threshold -> stats.
+        """
+        all_stats = self.stats(expt_name)
+        with open(os.path.join(output_dir, prefix + 'thresholds.csv'), 'w') as f:
+            f.write('threshold,group_type,count,num_clouds,mean_lifetime\n')
+            for threshold, stats in all_stats.items():
+                output_stats_to_file(expt_name, output_dir, '{}threshold_{}.txt'.format(prefix, threshold),
+                                     self.trackers[threshold], stats)
+                for key, stat in stats.items():
+                    if not isinstance(stat, dict):
+                        continue
+                    if stat['num_cycles']:
+                        mean_lifetime = 1. * stat['total_lifetimes'] / stat['num_cycles']
+                    else:
+                        mean_lifetime = ''
+                    f.write('{},{},{},{},{}\n'.format(threshold, key, stat['count'], stat['num_clouds'],
+                                                      mean_lifetime))
+        return all_stats
@@ -0,0 +1,69 @@
+"""Reading and writing of tracker state as a compact, compressed numpy archive.
+
+Each archive is a `.npz` file holding flat arrays (cloud properties, the edges of the cloud graph,
+last cloud field...) plus a JSON encoded dict of scalar metadata. Writes are atomic so that a job
+killed mid-write always leaves the previous archive intact.
+
+Groups that can no longer change can be moved out of an archive into segments (see `segment_path`),
+each written once, so that appending timesteps does not rewrite the groups tracked before.
+"""
+import os
+import json
+from logging import getLogger
+
+import numpy as np
+
+logger = getLogger('ct.track_archive')
+
+ARCHIVE_VERSION = 1
+
+
+def write_archive(path, arrays, meta):
+    """Write arrays and metadata to a compressed archive.
+
+    :param str path: file to write to, written to a temporary file first then moved into place.
+    :param dict arrays: name -> np.ndarray.
+    :param dict meta: JSON serializable metadata.
+    :return: None
+    """
+    meta = dict(meta, archive_version=ARCHIVE_VERSION)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, _meta=np.array(json.dumps(meta)), **arrays)
+    os.replace(tmp_path, path)
+    logger.debug('Written archive {}'.format(path))
+
+
+def read_archive(path):
+    """Read arrays and metadata written by `write_archive`.
+
+    :param str path: file to read.
+    :return tuple(dict, dict): arrays and metadata.
+    """
+    with np.load(path, allow_pickle=False) as data:
+        arrays = {name: data[name] for name in data.files if name != '_meta'}
+        meta = json.loads(str(data['_meta']))
+    if meta['archive_version'] != ARCHIVE_VERSION:
+        raise ValueError('Unsupported archive version: {}'.format(meta['archive_version']))
+    return arrays, meta
+
+
+def read_archive_meta(path):
+    """Read only the metadata written by `write_archive`, without loading any arrays.
+
+    :param str path: file to read.
+    :return dict: metadata.
+    """
+    with np.load(path, allow_pickle=False) as data:
+        return json.loads(str(data['_meta']))
+
+
+def segment_path(path, index):
+    """File of segment index of the archive at path, e.g. tracks.00003.npz for tracks.npz.
+
+    :param str path: archive file.
+    :param int index: segment index, counting from 0.
+    :return str: segment file.
+    """
+    root, ext = os.path.splitext(path)
+    return '{}.{:05d}{}'.format(root, index, ext)
@@ -5,58 +5,168 @@ This allows it to be run with far lower temporal resolution - 5 mins as opposed
 the 2D domain - this means that the approach here is only valid if there is little spatial variation in the wind field
 over the domain. This is the case for e.g. a CRM or LES with a mean wind profile.
 """
-import itertools
 from logging import getLogger
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 import numpy as np
 
-from cloud_tracking.correlated_distance import correlate
-from cloud_tracking.utils import dist, grow, grow_3d
+from cloud_tracking.correlated_distance import CORRELATORS, AdaptiveCorrelator
+from cloud_tracking.reducers import REDUCERS
+from cloud_tracking.geometry import LabelIndex
+from cloud_tracking.vertical_structure import vertical_structure, profile_structure
+from cloud_tracking.lineage import Lineage, group_lineage
+from cloud_tracking.levels import LevelView
+from cloud_tracking.prefetch import PrefetchIterator, LoadedCube, load_data
+from cloud_tracking.decomposition import tiled_label_pairs
+from cloud_tracking.out_of_core import slab_label_tables, slab_label_pairs, column_mask, sparse_from_slabs
+from cloud_tracking.sparse import SparseLabels, sparse_label_pairs
+from cloud_tracking.clustering import periodic_pairs, connected_components
+from cloud_tracking.export import export_cloud_table, export_edge_table, group_tables, DEFAULT_CHUNK_SIZE
+from cloud_tracking.track_archive import write_archive, read_archive, segment_path
+from cloud_tracking.utils import (grow_shifts, label_pairs, cloudy_cells, label_centroids, label_adjacency,
+                                  cloud_id)
 
 logger = getLogger('ct.tracking')
 
 FRAC_METHODS = ['pc2009', 'simple']
+# Reducers cannot use these names.
+CLOUD_ATTRS = ['id', 'label', 'time_index', 'lifetime', 'pos', 'pos_3d', 'size', 'prev_clds', 'next_clds',
+               'is_complex_rel', 'add_next', 'overlap', 'set_reduced_frac', 'set_frac', 'normalize_frac',
+               'reduced_frac', 'frac', 'set_label_index', 'top', 'base', 'depth', 'volume', 'area_profile',
+               'mass_flux_profile', 'level_size', 'level_pos']
+
+
+def cloud_table(cld_field, max_label, dx, track_level=None):
+    """Size and position of every label in cld_field, found from its cloudy grid-cells.
+
+    :param cld_field: field of labels - np.ndarray or SparseLabels.
+    :param int max_label: number of labels.
+    :param float dx: resolution (positions are in the same units).
+    :param int track_level: for 3D fields, level to find positions at.
+    :return tuple: OrderedDict of 'size' and 'pos' (indexed by label - 1), cloudy cells of cld_field and cloudy
+        cells of the field at track_level (see utils.cloudy_cells).
+    """
+    sparse = isinstance(cld_field, SparseLabels)
+    cells = cld_field.cells() if sparse else cloudy_cells(cld_field)
+    if track_level is not None:
+        track_lev_field = cld_field[track_level]
+        track_lev_cells = track_lev_field.cells() if sparse else cloudy_cells(track_lev_field)
+    else:
+        track_lev_field = cld_field
+        track_lev_cells = cells
+    table = OrderedDict()
+    table['size'] = np.bincount(cells[1], minlength=max_label + 1)[1:]
+    table['pos'] = label_centroids(track_lev_field, max_label, track_lev_cells) * dx # x, y pos in m.
+    return table, cells, track_lev_cells
+
+
+def correlate_and_project(prev_cld_field, curr_cld_field, correlate):
+    """Displacement of the clouds between two timesteps, and the previous field moved by it.
+
+    :param prev_cld_field: field of labels - np.ndarray or SparseLabels, as curr_cld_field.
+    :param curr_cld_field: field of labels.
+    :param correlate: function of two 2D cloud masks returning dx, dy, amp (see correlated_distance.CORRELATORS).
+    :return tuple: (dx, dy, amp), projected prev_cld_field.
+    """
+    if isinstance(curr_cld_field, SparseLabels):
+        # Correlation is still done on the dense (2D) masks.
+        dx, dy, amp = correlate(prev_cld_field.horizontal_mask(), curr_cld_field.horizontal_mask())
+    elif curr_cld_field.ndim == 3:
+        # first project the 3D cloud objects onto x-y plane and use this 2D field to work out the translation speed
+        dx, dy, amp = correlate(np.sum(prev_cld_field, axis=0) > 0, np.sum(curr_cld_field, axis=0) > 0)
+    else:
+        dx, dy, amp = correlate(prev_cld_field > 0, curr_cld_field > 0)
+    # Apply projection - move prev cloud field to where I think it will be based on correlation.
+    # N.B. count backward from last dim -- handles 2d and 3d cases.
+    if isinstance(prev_cld_field, SparseLabels):
+        proj_cld_field_ss = prev_cld_field.roll((0,) * (prev_cld_field.ndim - 2) + (int(dy), int(dx)))
+    else:
+        proj_cld_field_ss = np.roll(np.roll(prev_cld_field, int(dx), axis=-1), int(dy), axis=-2)
+    return (dx, dy, amp), proj_cld_field_ss
+
+
+def find_label_pairs(proj_cld_field_ss, curr_cld_field, shifts=None, tiles=None, executor=None):
+    """Pairs of labels that overlap (or touch, with shifts) between the projected and current fields.
+
+    :param proj_cld_field_ss: projected previous field of labels - np.ndarray or SparseLabels, as curr_cld_field.
+    :param curr_cld_field: field of labels.
+    :param list shifts: see utils.label_pairs.
+    :param tuple tiles: if set, find pairs one horizontal tile at a time (dense fields only).
+    :param executor: see decomposition.tiled_label_pairs.
+    :return tuple(np.ndarray, np.ndarray, np.ndarray): prev labels, next labels and overlaps.
+    """
+    if isinstance(curr_cld_field, SparseLabels):
+        return sparse_label_pairs(proj_cld_field_ss, curr_cld_field, shifts)
+    if tiles:
+        return tiled_label_pairs(proj_cld_field_ss, curr_cld_field, shifts, tiles, executor)
+    return label_pairs(proj_cld_field_ss, curr_cld_field, shifts)
 
 
 class Cloud(object):
     """Simple representation of a cloud."""
-    newid = itertools.count()
 
     def __repr__(self):
         return 'Cloud({}, {}, {}) # id={}'.format(self.label, self.time_index, self.size, self.id)
 
-    def __init__(self, label, time_index, pos, size, pos_3d=None):
+    def __init__(self, label, time_index, pos, size, pos_3d=None, cld_id=None):
         """
         :param int label: label from cloud field.
         :param int time_index: time_index from cloud field.
         :param np.ndarray pos: pos as 2 element array.
         :param int size: size in grid-cells.
         :param np.ndarray pos_3d: pos of all cloudy points (for 3d clouds).
+        :param int cld_id: id, defaults to utils.cloud_id(time_index, label).
         """
         assert label != 0
-        # Auto-incrementing ID.
-        self.id = next(Cloud.newid)
+        # Same id in every process and run - clouds from separately tracked runs can be merged by id.
+        self.id = cloud_id(time_index, label) if cld_id is None else cld_id
         self.label = label
         self.time_index = time_index
         self.lifetime = None
         self.pos = pos
-        self.pos_3d = pos_3d
+        self._pos_3d = pos_3d
+        self._label_index = None
         self.size = size
         self.prev_clds = []
         self.next_clds = []
         self.is_complex_rel = False
         self._reduced_frac = {}
         self._frac = {}
+        self._overlap = {}
         self.mass_flux = None
 
-    def add_next(self, cld):
+    @property
+    def pos_3d(self):
+        """Positions of all cloudy points (for 3d clouds), loaded from the label index if needed."""
+        if self._pos_3d is None and self._label_index is not None:
+            return self._label_index.points(self.label)
+        return self._pos_3d
+
+    @pos_3d.setter
+    def pos_3d(self, pos_3d):
+        self._pos_3d = pos_3d
+
+    def set_label_index(self, label_index):
+        """Use a shared LabelIndex to get pos_3d on demand, instead of storing it."""
+        self._label_index = label_index
+
+    def add_next(self, cld, overlap=None):
+        """
+        :param Cloud cld: cloud at next time index.
+        :param int overlap: number of overlapping grid-cells, if known.
+        """
         assert cld is not self
         assert cld not in self.next_clds
         assert self not in cld.prev_clds
         assert cld.time_index == self.time_index + 1
         self.next_clds.append(cld)
         cld.prev_clds.append(self)
+        cld._overlap[self] = overlap
+
+    def overlap(self, cld):
+        """Number of grid-cells of this cloud overlapped by projected prev cloud cld."""
+        assert cld in self.prev_clds
+        return self._overlap[cld]
 
     def set_reduced_frac(self, cld, reduced_frac):
         self._reduced_frac[cld] = reduced_frac
@@ -109,6 +219,14 @@ class CloudGroup(object):
         self._arrange_by_time()
         self._calc_cld_fractions()
         self._calc_cld_lifetimes()
+        self._lineage = None
+
+    @property
+    def lineage(self):
+        """Ancestors of each cloud in the group (see lineage.group_lineage), built when first used."""
+        if self._lineage is None:
+            self._lineage = group_lineage(self)
+        return self._lineage
 
     def get_cld_lifetime_properties(self, property):
         """Get property at prev timesteps based on all clds that have contributed to each end cld.
@@ -134,9 +252,28 @@ class CloudGroup(object):
             all_timeseries.append(reverse_timeseries[::-1])
         return all_timeseries
 
+    def edge_arrays(self):
+        """Links between the clouds in the group, as arrays with one entry per link.
+
+        :return dict: 'prev' and 'next' (indices into clds), 'overlap' (nan if unknown) and 'frac'.
+        """
+        index = {cld.id: i for i, cld in enumerate(self.clds)}
+        edges = [(i, index[next_cld.id]) for i, cld in enumerate(self.clds) for next_cld in cld.next_clds]
+        edges = np.array(edges, dtype=np.int64).reshape(-1, 2)
+        overlap = [self.clds[j].overlap(self.clds[i]) for i, j in edges]
+        return {
+            'prev': edges[:, 0],
+            'next': edges[:, 1],
+            'overlap': np.array([np.nan if o is None else o for o in overlap], dtype=float),
+            'frac': np.array([self.clds[j].frac(self.clds[i]) for i, j in edges], dtype=float),
+        }
+
     def _find_splits_mergers_complex(self):
         """Calculate how many splits, mergers and complex relationships there are."""
         logger.debug('finding splits mergers complex rels')
+        # Clouds can be regrouped after more timesteps have been tracked.
+        for cld in self.clds:
+            cld.is_complex_rel = False
         for cld in self.clds:
             if len(cld.next_clds) >= 2:
                 self.has_splits = True
@@ -180,6 +317,8 @@ class CloudGroup(object):
 
         for time_index in range(first_time_index, last_time_index + 1):
             self.clds_at_time.append(clds_at_time[time_index])
+        self.first_time_index = first_time_index
+        self.last_time_index = last_time_index
 
     def _calc_cld_fractions(self):
         if self.frac_method == 'pc2009':
@@ -244,6 +383,28 @@ class CloudGroup(object):
             next_clds = set(new_next_clds)
 
 
+class TrackStep(object):
+    """What changed when one timestep was pushed to a Tracker."""
+    def __init__(self, time_index, time, clds, links, completed_groups):
+        """
+        :param int time_index: time index of the new timestep.
+        :param time: time of the new timestep, as passed to `Tracker.push`.
+        :param list clds: new clouds.
+        :param list links: (prev cloud, next cloud) links made to the new clouds.
+        :param list completed_groups: CloudGroups that cannot grow any more - no cloud at this timestep
+            is part of them.
+        """
+        self.time_index = time_index
+        self.time = time
+        self.clds = clds
+        self.links = links
+        self.completed_groups = completed_groups
+
+    def __repr__(self):
+        return 'TrackStep({}, {} clouds, {} links, {} completed groups)'.format(
+            self.time_index, len(self.clds), len(self.links), len(self.completed_groups))
+
+
 class Tracker(object):
     """Tracks clouds in a cloud field.
 
@@ -260,7 +421,7 @@ class Tracker(object):
     def __init__(self, cld_field_iter, dx, dy, include_touching=False, touching_diagonal=False,
                  ignore_smaller_equal_than=None, store_working=False, store_detailed_working=False,
                  track_3d=False, track_level=None,
-                 frac_method='pc2009'):
+                 frac_method='pc2009', sparse=False, sparse_max_fraction=0.1, correlator='full', id_time_offset=0):
         """
         :param cld_field_iter: iterable cloud field - like iris.cube.Cube.
         :param float dx: resolution in x-dir.
@@ -271,8 +432,18 @@ class Tracker(object):
         :param bool store_working: extra debug.
         :param bool store_detailed_working: extra extra debug.
         :param bool track_3d: enable 3d tracking.
-        :param bool track_level: index at which to perform 3d tracking.
+        :param track_level: index at which to perform 3d tracking, or a list of indices - per-level areas,
+            positions and displacements are then found at each level in the same pass over each field (see
+            `level_view`), and the first level is used for everything else.
         :param str frac_method: 'pc2009', 'simple' - fraction method to use.
+        :param sparse: True, False or 'auto' - track using only the cloudy grid-cells of each field
+            (see sparse.SparseLabels). If 'auto', fields with a cloud fraction above sparse_max_fraction
+            are tracked as dense fields. cld_field_iter can also yield SparseLabels directly.
+        :param float sparse_max_fraction: max cloud fraction for sparse tracking if sparse is 'auto'.
+        :param str correlator: 'full', 'pyramid' - method used to find the displacement between timesteps
+            (see correlated_distance.CORRELATORS).
+        :param int id_time_offset: added to the time index of clouds in their ids - e.g. the index of the
+            first timestep, when a run is split into chunks of timesteps that are tracked separately.
         """
         # assert iter(cld_field_iter).next().ndim == 2
         self.cld_field_iter = iter(cld_field_iter)
@@ -284,6 +455,21 @@ class Tracker(object):
         self.ignore_smaller_than = ignore_smaller_equal_than
         assert frac_method in FRAC_METHODS, 'Unrecognized frac_method'
         self.frac_method = frac_method
+        assert sparse in [True, False, 'auto'], 'Unrecognized sparse'
+        self.sparse = sparse
+        self.sparse_max_fraction = sparse_max_fraction
+        assert correlator in CORRELATORS, 'Unrecognized correlator'
+        self.correlator = correlator
+        self.id_time_offset = id_time_offset
+        self.adaptive_correlator = None
+        self.prefetchers = []
+        # Number of horizontal tiles to link clouds over, and executor to process them with.
+        self.tiles = None
+        self.executor = None
+        # If set, number of levels (3D) or rows (2D) of each field to read at once.
+        self.slab_size = None
+        # 2D mask of cloudy columns of prev_cld_field, when tracking out-of-core.
+        self.prev_cld_mask = None
         # self.proj_cld_field = np.zeros_like(self.cld_field)
         # List of dicts, each dict's key is the label of the cloud in cld_field.
         # Each dict's value is a cloud.
@@ -305,7 +491,48 @@ class Tracker(object):
         self.track_3d = track_3d
         if self.track_3d:
             assert track_level is not None
-        self.track_lev = track_level
+        if isinstance(track_level, (list, tuple)):
+            assert self.track_3d and len(track_level), 'Can only track at a list of levels in 3D'
+            self.track_levels = list(track_level)
+            self.track_lev = self.track_levels[0]
+        else:
+            self.track_levels = None
+            self.track_lev = track_level
+        # For each timestep after the first, (dx, dy, amp) at each of track_levels.
+        self.level_displacements = []
+        # Cloud masks at each of track_levels for the last timestep.
+        self.prev_level_masks = None
+        # Last cloud field - needed to link clouds at the next timestep.
+        self.prev_cld_field = None
+        # Shape of the tracked cloud fields, e.g. for the domain size.
+        self.cld_field_shape = None
+        self._num_grouped_timesteps = 0
+        self.checkpoint_path = None
+        self.checkpoint_every = None
+        self._num_to_skip = 0
+        # Field name -> (iterator, track_level_only).
+        self.fields = OrderedDict()
+        # Reducer column name -> (reducer name, field name, scale, kwargs), kwargs including any weights field name.
+        self.reducers = OrderedDict()
+        self.lineage = None
+        # List of dicts of per-cloud columns (size, pos and reducers), indexed by label - 1.
+        self.cld_tables = []
+        self.vertical_structure_settings = {'dz': 1, 'w': None, 'rho': None}
+        # If set, whether to count diagonal neighbours when finding which clouds touch.
+        self.adjacency_diagonal = None
+        # List of (labels a, labels b, boundary lengths) of touching clouds at each timestep.
+        self.adjacency_at_time = []
+        # Whether to keep clouds and tables for completed groups when pushing timesteps.
+        self.keep_history = True
+        # Groups still growing when pushing timesteps: root cloud id -> clouds, and cloud id -> root cloud
+        # id for the clouds at the last timestep.
+        self._open_groups = None
+        self._open_group_roots = None
+        # Number of leading timesteps whose clouds have been dropped, when not keeping history.
+        self._num_dropped_timesteps = 0
+        # Number of segments written by `write_segment`, and of the groups in them.
+        self.num_segments = 0
+        self.num_segment_groups = 0
 
     def add_mass_flux_info(self, w_iter, rho_iter):
         """Used to set field iterators for mass flux calcs.
@@ -317,118 +544,853 @@ class Tracker(object):
         self.can_calc_mass_flux = True
         self.w_iter = w_iter
         self.rho_iter = rho_iter
+        self.add_field('w', w_iter, track_level_only=True)
+        self.add_field('rho', rho_iter, track_level_only=True)
+        self.add_reducer('mass_flux', 'weighted_sum', 'w', weights='rho', scale=self.dx * self.dy)
+
+    def add_field(self, name, field_iter, track_level_only=False):
+        """Add a field that is read alongside the cloud field, for use by reducers.
+
+        :param str name: name of field.
+        :param field_iter: iterable field - aligned with the cloud field.
+        :param bool track_level_only: for 3d tracking, only read and reduce over the tracking level.
+        :return: None
+        """
+        assert name not in self.fields, 'Field {} already added'.format(name)
+        self.fields[name] = (iter(field_iter), track_level_only)
+
+    def add_reducer(self, name, reducer, field, weights=None, scale=1, **kwargs):
+        """Add a per-cloud property, calculated by reducing a field over each cloud's grid-cells.
+
+        All reducers are evaluated for all clouds at once as each timestep is tracked. Results are
+        stored in `cld_tables` and as an attribute of each cloud.
+
+        :param str name: name of property.
+        :param str reducer: name of reducer from reducers.REDUCERS, e.g. 'sum', 'mean', 'max', 'percentile'.
+        :param str field: name of field (see `add_field`) to reduce.
+        :param str weights: name of field to use as weights, for 'weighted_sum' and 'weighted_mean'.
+        :param float scale: multiply result by this.
+        :param kwargs: passed to reducer, e.g. q=90 for 'percentile'.
+        :return: None
+        """
+        assert reducer in REDUCERS, 'Unrecognized reducer: {}'.format(reducer)
+        assert field in self.fields, 'Unrecognized field: {}'.format(field)
+        if weights is not None:
+            assert weights in self.fields, 'Unrecognized field: {}'.format(weights)
+            assert self.fields[weights][1] == self.fields[field][1], 'weights must be on the same levels as field'
+            kwargs['weights'] = weights
+        assert name not in self.reducers, 'Reducer {} already added'.format(name)
+        assert name == 'mass_flux' or name not in CLOUD_ATTRS, 'Cloud already has a {}'.format(name)
+        self.reducers[name] = (reducer, field, scale, kwargs)
+
+    def add_adjacency(self, diagonal=None):
+        """Find which clouds touch at each timestep during `track`, stored in adjacency_at_time.
+
+        :param bool diagonal: count diagonal neighbours as touching, defaults to touching_diagonal.
+        :return: None
+        """
+        self.adjacency_diagonal = self.touching_diagonal if diagonal is None else diagonal
+
+    def add_adaptive_correlation(self, max_reuse=10, min_amp_fraction=0.9):
+        """Reuse the last displacement between timesteps while it still fits, instead of correlating each timestep.
+
+        See correlated_distance.AdaptiveCorrelator. Stats are logged at the end of `track`.
+        :param int max_reuse: max number of timesteps in a row to reuse a displacement for.
+        :param float min_amp_fraction: min correlation at the reused displacement, relative to the last full correlation.
+        :return: None
+        """
+        self.adaptive_correlator = AdaptiveCorrelator(CORRELATORS[self.correlator], max_reuse, min_amp_fraction)
+
+    def add_prefetch(self, num_ahead=2):
+        """Read the next num_ahead timesteps of all inputs on background threads while tracking.
+
+        Call after all fields have been added. Time spent waiting for input is given by `io_wait_times`.
+        :param int num_ahead: number of timesteps to read ahead.
+        :return: None
+        """
+        assert not self.slab_size, 'Prefetching reads whole fields, cannot be used out-of-core'
+        self.cld_field_iter = PrefetchIterator(self.cld_field_iter, num_ahead, name='cld_field')
+        self.prefetchers = [self.cld_field_iter]
+        for name, (field_iter, track_level_only) in self.fields.items():
+            # Only read the tracking level of these fields.
+            load = (lambda cube: LoadedCube(self._read_track_level(cube))) if track_level_only else load_data
+            field_iter = PrefetchIterator(field_iter, num_ahead, load, name=name)
+            self.fields[name] = (field_iter, track_level_only)
+            self.prefetchers.append(field_iter)
+
+    def io_wait_times(self):
+        """Time spent waiting for inputs at each timestep, if prefetching.
+
+        :return np.ndarray: wait time (s) for each timestep read.
+        """
+        wait_times = [prefetcher.wait_times for prefetcher in self.prefetchers]
+        num_timesteps = min(len(w) for w in wait_times) if wait_times else 0
+        return np.sum([w[:num_timesteps] for w in wait_times], axis=0) if wait_times else np.zeros(0)
+
+    def add_decomposition(self, tiles=(2, 2), executor=None):
+        """Find overlaps between timesteps one horizontal tile at a time (see decomposition.tiled_label_pairs).
+
+        :param tuple tiles: number of tiles along each horizontal axis.
+        :param executor: concurrent.futures executor to process tiles with, or None to process them in turn.
+        :return: None
+        """
+        self.tiles = tiles
+        self.executor = executor
+
+    def add_out_of_core(self, slab_size=8):
+        """Read each cloud field (and any fields for reducers) slab_size levels (3D) or rows (2D) at a time.
+
+        For fields too large to hold in memory: cld_field_iter should yield cubes whose data can be sliced
+        along the first axis without reading the rest of it, e.g. np.memmap or out_of_core.ChunkedField
+        (see preprocessing.label_field_iter). Per-cloud tables and overlaps are accumulated over slabs (see
+        out_of_core), and only a reference to the previous field is kept. Clouds do not have pos_3d.
+
+        :param int slab_size: number of levels or rows to read at once.
+        :return: None
+        """
+        assert slab_size >= 1
+        assert not self.sparse, 'Cannot track sparse fields out-of-core'
+        assert not self.prefetchers, 'Prefetching reads whole fields, cannot be used out-of-core'
+        assert self.adjacency_diagonal is None, 'Cannot find adjacency out-of-core'
+        assert not (self.store_working or self.store_detailed_working), 'Cannot store working out-of-core'
+        self.slab_size = slab_size
+
+    def add_online(self, keep_history=True):
+        """Settings for tracking one timestep at a time with `push`.
+
+        :param bool keep_history: if False, completed groups are only returned by `push`, and timesteps
+            before the first cloud of any open group are emptied, so memory use does not grow with the
+            number of timesteps. `group`, `export_tables` and checkpoints then only see the clouds of the
+            timesteps that are kept.
+        :return: None
+        """
+        self.keep_history = keep_history
+
+    def push(self, cld_field, time=None, fields=None):
+        """Track one more timestep, e.g. as it arrives from a running model.
+
+        Work done is proportional to the new timestep and the groups completed by it, not to the number
+        of timesteps already tracked. Groups are built as they complete - `group` adds any open groups.
+
+        :param cld_field: field of labels - np.ndarray, SparseLabels or cube.
+        :param time: time of field, passed back in the result.
+        :param dict fields: field name -> data (np.ndarray or cube) for each added field.
+        :return TrackStep: new clouds, links and completed groups.
+        """
+        if not isinstance(cld_field, (np.ndarray, SparseLabels)):
+            cld_field = self._read_field(cld_field)
+        field_data = {}
+        for name, (_, track_level_only) in self.fields.items():
+            value = fields[name]
+            if not isinstance(value, np.ndarray):
+                value = self._read_track_level(value) if track_level_only else self._read_field(value)
+            elif track_level_only and self.track_3d and value.ndim == 3:
+                value = value[self.track_lev]
+            field_data[name] = value
+        if self._open_groups is None:
+            self._start_open_groups()
+
+        time_index = len(self.clds_at_time)
+        links = self._track_step(time_index, cld_field, field_data)
+        completed_groups = self._update_open_groups(links)
+        if self.checkpoint_path and len(self.clds_at_time) % self.checkpoint_every == 0:
+            self.save_checkpoint(self.checkpoint_path)
+        return TrackStep(time_index, time, list(self.clds_at_time[-1].values()), links, completed_groups)
+
+    def _start_open_groups(self):
+        """Find the open groups from the timesteps tracked so far."""
+        self._open_groups = {}
+        self._open_group_roots = {}
+        if not self.clds_at_time:
+            return
+        last_time_index = len(self.clds_at_time) - 1
+        self.group()
+        for group in self.groups:
+            if group.last_time_index == last_time_index:
+                root = group.clds[0].id
+                self._open_groups[root] = list(group.clds)
+                for cld in group.clds_at_time[-1]:
+                    self._open_group_roots[cld.id] = root
+        self.groups = [group for group in self.groups if group.last_time_index != last_time_index]
+        for cld in self.clds_at_time[-1].values():
+            if cld.id not in self._open_group_roots:
+                self._open_groups[cld.id] = [cld]
+                self._open_group_roots[cld.id] = cld.id
+
+    def _is_ignored(self, clds):
+        return len(clds) == 1 and self.ignore_smaller_than and clds[0].size <= self.ignore_smaller_than
+
+    def _update_open_groups(self, links):
+        """Add the clouds and links of the last timestep to the open groups, and complete the groups
+        that have no clouds at it."""
+        # Union-find over the open groups, merging the smaller group into the larger.
+        parent = {}
+
+        def find(root):
+            while root in parent:
+                root = parent[root]
+            return root
+
+        curr_clds = self.clds_at_time[-1].values()
+        prev_roots = self._open_group_roots
+        for cld in curr_clds:
+            self._open_groups[cld.id] = [cld]
+        curr_roots = {cld.id: cld.id for cld in curr_clds}
+        for prev_cld, next_cld in links:
+            root_a, root_b = find(prev_roots[prev_cld.id]), find(curr_roots[next_cld.id])
+            if root_a == root_b:
+                continue
+            if len(self._open_groups[root_a]) < len(self._open_groups[root_b]):
+                root_a, root_b = root_b, root_a
+            self._open_groups[root_a].extend(self._open_groups.pop(root_b))
+            parent[root_b] = root_a
+        self._open_group_roots = {cld_id: find(root) for cld_id, root in curr_roots.items()}
+
+        open_roots = set(self._open_group_roots.values())
+        completed_groups = []
+        for root in [root for root in self._open_groups if root not in open_roots]:
+            clds = self._open_groups.pop(root)
+            if not self._is_ignored(clds):
+                completed_groups.append(CloudGroup(clds, self.frac_method))
+        self._num_grouped_timesteps = len(self.clds_at_time)
+        if self.keep_history:
+            self.groups.extend(completed_groups)
+        else:
+            self._drop_completed_timesteps()
+        return completed_groups
+
+    def _drop_completed_timesteps(self):
+        """Empty the timesteps before the first cloud of any open group. Whole timesteps are kept or
+        emptied (keeping their columns), so that clouds and tables stay consistent, e.g. for checkpoints."""
+        first_kept = min([cld.time_index for clds in self._open_groups.values() for cld in clds] or
+                         [len(self.clds_at_time)])
+        for time_index in range(self._num_dropped_timesteps, first_kept):
+            self.clds_at_time[time_index] = {}
+            self.cld_tables[time_index] = OrderedDict((column, np.empty((0,) + values.shape[1:], values.dtype))
+                                                      for column, values in self.cld_tables[time_index].items())
+        if first_kept > self._num_dropped_timesteps:
+            self._num_dropped_timesteps = first_kept
+            self.all_clds = [cld for clds in self.clds_at_time[first_kept:] for cld in clds.values()]
+
+    def open_groups(self):
+        """Groups still growing when pushing timesteps, as CloudGroups - unlike `group`, they stay open.
+
+        :return list: CloudGroups.
+        """
+        return [CloudGroup(list(clds), self.frac_method) for clds in (self._open_groups or {}).values()
+                if not self._is_ignored(clds)]
+
+    def write_segment(self, path, groups, meta=None):
+        """Write groups (e.g. those completed by `push`) as the next segment of the archive at path.
+
+        Segments hold the cloud and edge tables of their groups (see export.group_tables), with the fractions
+        and lifetimes that are final once groups are complete, and are never rewritten. When not keeping
+        history (see `add_online`), `save_checkpoint` then only writes the open groups and last timestep, so
+        appending timesteps to an archive costs in proportion to the new timesteps, not the run length.
+        Writing the segment again before the next `save_checkpoint` (e.g. after a killed job is rerun from the
+        archive) overwrites it.
+
+        :param str path: archive file (see `save_checkpoint`).
+        :param list groups: complete CloudGroups.
+        :param dict meta: JSON serializable metadata to store with the segment.
+        :return str: segment file written.
+        """
+        columns = list(self.cld_tables[-1].keys()) if self.cld_tables else ['size', 'pos']
+        cld_table, edge_table = group_tables(groups, columns, self.num_segment_groups)
+        arrays = OrderedDict()
+        for prefix, table in [('cld_', cld_table), ('edge_', edge_table)]:
+            for name, values in table.items():
+                arrays[prefix + name] = values
+        segment_meta = dict(meta or {}, first_group=self.num_segment_groups, num_groups=len(groups),
+                            num_timesteps=len(self.clds_at_time), columns=columns)
+        segment = segment_path(path, self.num_segments)
+        write_archive(segment, arrays, segment_meta)
+        self.num_segments += 1
+        self.num_segment_groups += len(groups)
+        return segment
+
+    def add_checkpointing(self, checkpoint_path, checkpoint_every=10):
+        """Periodically write the tracker state to disk during `track`.
+
+        :param str checkpoint_path: file to (over)write checkpoints to.
+        :param int checkpoint_every: number of timesteps between checkpoints.
+        :return: None
+        """
+        assert checkpoint_every >= 1
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
 
     def track(self):
         """Track clouds from one timestep to the next, building a cloud graph."""
-        if self.store_working:
+        if self.store_working and not hasattr(self, 'all_working'):
             self.all_working = {'working': [], 'detailed_working': []}
 
-        for time_index, curr_cld_field_cube in enumerate(self.cld_field_iter):
-            curr_cld_field = curr_cld_field_cube.data
-            if self.track_3d:
-                assert curr_cld_field.ndim == 3
-            else:
-                assert curr_cld_field.ndim == 2
-            if self.can_calc_mass_flux:
-                w_cube = next(self.w_iter)
-                rho_cube = next(self.rho_iter)
-                mass_flux = w_cube.data * rho_cube.data * self.dx * self.dy
-                # mass_flux = w_cube * rho_cube * self.dx * self.dy
-
-            logger.debug('Time index: {}'.format(time_index))
-            max_label = int(curr_cld_field.max())
-            curr_sizes = np.histogram(curr_cld_field, range(1, max_label + 2))[0]
-            curr_clds = {}
-            # Make cloud objects.
-            for label in range(1, max_label + 1):
-                if self.track_3d:
-                    pos = np.array(list(map(np.mean, np.where(curr_cld_field[self.track_lev,:,:] == label)))) * self.dx # x, y pos in m.
-                    pos_3d = np.array(list(np.where(curr_cld_field == label)))  # x, y, z pos in grid points.
-                    curr_clds[label] = Cloud(label, time_index, pos, curr_sizes[label - 1], pos_3d)
-                    if self.can_calc_mass_flux:
-                        curr_clds[label].mass_flux = mass_flux[curr_cld_field[self.track_lev,:,:] == label].sum()
+        for curr_cld_field_cube in self.cld_field_iter:
+            field_cubes = {name: next(field_iter) for name, (field_iter, _) in self.fields.items()}
+            if self._num_to_skip:
+                # Resumed from a checkpoint - these timesteps have already been tracked.
+                self._num_to_skip -= 1
+                continue
+
+            fields = {}
+            for name, (_, track_level_only) in self.fields.items():
+                if track_level_only:
+                    fields[name] = self._read_track_level(field_cubes[name])
                 else:
-                    pos = np.array(list(map(np.mean, np.where(curr_cld_field == label)))) * self.dx # x, y pos in m.
-                    curr_clds[label] = Cloud(label, time_index, pos, curr_sizes[label - 1])
-                    if self.can_calc_mass_flux:
-                        curr_clds[label].mass_flux = mass_flux[curr_cld_field == label].sum()
+                    fields[name] = self._read_field(field_cubes[name])
+            if isinstance(curr_cld_field_cube, SparseLabels):
+                curr_cld_field = curr_cld_field_cube
+            else:
+                curr_cld_field = self._read_field(curr_cld_field_cube)
+            self._track_step(len(self.clds_at_time), curr_cld_field, fields)
 
-            logger.debug('Found {} clouds'.format(max_label))
-            self.clds_at_time.append(curr_clds)
-            self.all_clds.extend(curr_clds.values())
+            if self.checkpoint_path and len(self.clds_at_time) % self.checkpoint_every == 0:
+                self.save_checkpoint(self.checkpoint_path)
 
-            # On first loop - done.
-            if time_index == 0:
-                prev_cld_field = curr_cld_field
-                prev_clds = curr_clds
-                continue
+        if self.prefetchers:
+            logger.info('Waited {:.2f} s for input'.format(self.io_wait_times().sum()))
+        if self.adaptive_correlator:
+            stats = self.adaptive_correlator.stats()
+            logger.info('Skipped {} of {} correlations, est. speed-up: {}'.format(stats['skipped'], stats['calls'],
+                                                                                 stats.get('speedup')))
+        return self.clds_at_time
+
+    def _read_field(self, cube):
+        """Data of cube - left lazy when tracking out-of-core, so that only the slabs used are read."""
+        if self.slab_size and hasattr(cube, 'lazy_data'):
+            # e.g. iris cubes - slices of lazy data are only read when they are converted to arrays.
+            return cube.lazy_data()
+        return cube.data
+
+    def _read_track_level(self, cube):
+        """Read the data at the tracking level, if the cube allows it without reading all levels."""
+        if not self.track_3d or getattr(cube, 'ndim', None) == 2:
+            return cube.data
+        try:
+            # e.g. iris cubes with lazy data only read the level that is indexed.
+            return cube[self.track_lev].data
+        except TypeError:
+            data = cube.data
+            return data[self.track_lev] if data.ndim == 3 else data
 
-            # Work out the highest correlation between the prev and curr cld field.
-            if self.track_3d:
-                # first project the 3D cloud objects onto x-y plane and use this 2D field to work out the translation speed
-                dx, dy, amp = correlate(np.sum(prev_cld_field, axis=0) > 0, np.sum(curr_cld_field, axis=0) > 0)
+    def add_vertical_structure(self, dz=1, w=None, rho=None):
+        """Settings for the vertical structure of 3D clouds (see vertical_structure.vertical_structure).
+
+        Top, base, depth, volume and area profile are always calculated for 3D tracking.
+
+        :param dz: resolution in z-dir - float or array with one value per level.
+        :param str w: name of 3D w field (see `add_field`), for mass flux profiles.
+        :param str rho: name of 3D rho field.
+        :return: None
+        """
+        assert self.track_3d
+        for field in [w, rho]:
+            if field is not None:
+                assert field in self.fields and not self.fields[field][1], 'Needs a 3D field: {}'.format(field)
+        self.vertical_structure_settings = {'dz': dz, 'w': w, 'rho': rho}
+
+    def _vertical_structure(self, label_index, fields):
+        settings = self.vertical_structure_settings
+        kwargs = {'dx': self.dx, 'dy': self.dy, 'dz': settings['dz']}
+        if settings['w'] is not None and settings['rho'] is not None:
+            kwargs['w'] = fields[settings['w']]
+            kwargs['rho'] = fields[settings['rho']]
+        return vertical_structure(label_index, **kwargs)
+
+    def _use_sparse(self, cld_field):
+        """Whether to track cld_field as a sparse field."""
+        if self.sparse == 'auto':
+            if isinstance(cld_field, SparseLabels):
+                cloud_fraction = cld_field.cloud_fraction
             else:
-                dx, dy, amp = correlate(prev_cld_field > 0, curr_cld_field > 0)
+                cloud_fraction = np.count_nonzero(cld_field) / cld_field.size
+            return cloud_fraction <= self.sparse_max_fraction
+        return self.sparse
+
+    def _correlate(self, prev_mask, curr_mask):
+        """Displacement dx, dy (and amplitude) between two 2D cloud masks."""
+        if self.adaptive_correlator:
+            return self.adaptive_correlator(prev_mask, curr_mask)
+        return CORRELATORS[self.correlator](prev_mask, curr_mask)
+
+    def _track_step(self, time_index, curr_cld_field, fields=None):
+        """Make clouds for one timestep and link them to the clouds from the previous timestep.
+
+        :param int time_index: time index of curr_cld_field.
+        :param curr_cld_field: field of labels - np.ndarray or SparseLabels.
+        :param dict fields: field name -> data, for reducers.
+        :return list: (prev cloud, next cloud) links made.
+        """
+        if self.track_3d:
+            assert curr_cld_field.ndim == 3
+        else:
+            assert curr_cld_field.ndim == 2
+        self.cld_field_shape = tuple(curr_cld_field.shape)
+
+        logger.debug('Time index: {}'.format(time_index))
+        if self.slab_size:
+            return self._track_step_slabs(time_index, curr_cld_field, fields)
+        sparse = self._use_sparse(curr_cld_field)
+        if sparse and not isinstance(curr_cld_field, SparseLabels):
+            curr_cld_field = SparseLabels.from_dense(curr_cld_field)
+        elif not sparse and isinstance(curr_cld_field, SparseLabels):
+            curr_cld_field = curr_cld_field.to_dense()
+        max_label = int(curr_cld_field.max())
+        # Per-cloud properties are all reduced over only the cloudy grid-cells, for all labels at once.
+        cld_table, cells, track_lev_cells = cloud_table(curr_cld_field, max_label, self.dx,
+                                                        self.track_lev if self.track_3d else None)
+        if self.track_3d:
+            # Grid-cells of all clouds, shared between the clouds at this time.
+            label_index = LabelIndex.from_labels(curr_cld_field, max_label, cells)
+            cld_table.update(self._vertical_structure(label_index, fields))
+        if self.track_levels:
+            cld_table.update(self._level_columns([curr_cld_field[level] for level in self.track_levels], max_label))
+        for name, (reducer, field, scale, kwargs) in self.reducers.items():
+            cloudy, cld_labels = track_lev_cells if self.fields[field][1] else cells
+            kwargs = dict(kwargs)
+            if 'weights' in kwargs:
+                kwargs['weights'] = fields[kwargs['weights']].ravel()[cloudy]
+            values = fields[field].ravel()[cloudy]
+            cld_table[name] = REDUCERS[reducer](cld_labels, values, max_label, **kwargs) * scale
+        self.cld_tables.append(cld_table)
+        if self.adjacency_diagonal is not None:
+            self.adjacency_at_time.append(label_adjacency(curr_cld_field, self.adjacency_diagonal, cells))
+
+        self._make_clouds(time_index, cld_table, label_index if self.track_3d else None)
+
+        # On first loop - done.
+        if self.prev_cld_field is None:
+            self.prev_cld_field = curr_cld_field
+            return []
+        prev_cld_field = self.prev_cld_field
+        # Previous field can have been tracked in the other mode.
+        if sparse and not isinstance(prev_cld_field, SparseLabels):
+            prev_cld_field = SparseLabels.from_dense(prev_cld_field)
+        elif not sparse and isinstance(prev_cld_field, SparseLabels):
+            prev_cld_field = prev_cld_field.to_dense()
+
+        # Work out the highest correlation between the prev and curr cld field.
+        (dx, dy, amp), proj_cld_field_ss = correlate_and_project(prev_cld_field, curr_cld_field, self._correlate)
+        logger.debug('dx, dy, amp: {}, {}, {}'.format(dx, dy, amp))
+
+        if (self.store_working or self.store_detailed_working) and sparse:
+            # Working is stored as dense fields.
+            curr_cld_field = curr_cld_field.to_dense()
+            proj_cld_field_ss = proj_cld_field_ss.to_dense()
+            sparse = False
+
+        if self.store_working:
+            working = (curr_cld_field >= 1).astype(int)
+            working += (proj_cld_field_ss >= 1).astype(int) * 2
+            self.all_working['working'].append(working)
+
+        # Work out overlaps between projected forward previous cloud field and the current field.
+        # N.B. prev labels work for proj_cld_field as it's just a translation of prev_cld_field.
+        if self.include_touching:
+            shifts = [(0,) * curr_cld_field.ndim] + grow_shifts(curr_cld_field.ndim, self.touching_diagonal)
+        else:
+            shifts = None
+        prev_labels, next_labels, overlaps = find_label_pairs(proj_cld_field_ss, curr_cld_field, shifts,
+                                                              self.tiles, self.executor)
+        links = self._link_clouds(prev_labels, next_labels, overlaps, curr_cld_field, proj_cld_field_ss)
+        self.prev_cld_field = curr_cld_field
+        return links
+
+    def _level_columns(self, level_fields, max_label):
+        """Area and position of every cloud at each of track_levels, and the displacement at each level.
+
+        :param list level_fields: 2D field of labels at each of track_levels - np.ndarray or SparseLabels.
+        :param int max_label: number of labels.
+        :return OrderedDict: 'level_size' (max_label, num_levels) and 'level_pos' (max_label, num_levels, 2).
+        """
+        level_size = np.zeros((max_label, len(level_fields)), dtype=np.int64)
+        level_pos = np.empty((max_label, len(level_fields), 2))
+        level_masks = []
+        for i, level_field in enumerate(level_fields):
+            if isinstance(level_field, SparseLabels):
+                cells = level_field.cells()
+                level_masks.append(level_field.horizontal_mask())
+            else:
+                cells = cloudy_cells(level_field)
+                level_masks.append(level_field > 0)
+            level_size[:, i] = np.bincount(cells[1], minlength=max_label + 1)[1:max_label + 1]
+            level_pos[:, i] = label_centroids(level_field, max_label, cells) * self.dx
+        if self.prev_level_masks is not None:
+            correlate = CORRELATORS[self.correlator]
+            self.level_displacements.append(np.array([correlate(prev_mask, mask)
+                                                      for prev_mask, mask in zip(self.prev_level_masks, level_masks)]))
+        self.prev_level_masks = level_masks
+        return OrderedDict([('level_size', level_size), ('level_pos', level_pos)])
+
+    def level_view(self, level):
+        """The clouds present at one of track_levels, with their properties at that level.
+
+        :param int level: one of track_levels.
+        :return LevelView: view of the cloud graph at level.
+        """
+        assert self.track_levels and level in self.track_levels, 'Not a tracked level: {}'.format(level)
+        return LevelView(self, self.track_levels.index(level))
+
+    def level_views(self):
+        """
+        :return OrderedDict: level -> LevelView for each of track_levels.
+        """
+        return OrderedDict((level, self.level_view(level)) for level in self.track_levels or [])
+
+    def _make_clouds(self, time_index, cld_table, label_index=None):
+        """Make the clouds at time_index from the columns of cld_table."""
+        curr_clds = {}
+        for label in range(1, len(cld_table['size']) + 1):
+            curr_clds[label] = Cloud(label, time_index, cld_table['pos'][label - 1], cld_table['size'][label - 1],
+                                     cld_id=cloud_id(self.id_time_offset + time_index, label))
+            if label_index is not None:
+                curr_clds[label].set_label_index(label_index)
+            for name in cld_table:
+                if name not in ['size', 'pos']:
+                    setattr(curr_clds[label], name, cld_table[name][label - 1])
+
+        logger.debug('Found {} clouds'.format(len(curr_clds)))
+        self.clds_at_time.append(curr_clds)
+        self.all_clds.extend(curr_clds.values())
+        return curr_clds
+
+    def _link_clouds(self, prev_labels, next_labels, overlaps, curr_cld_field=None, proj_cld_field_ss=None):
+        """Link the clouds at the last two timesteps given the pairs of labels that overlap.
+
+        :return list: (prev cloud, next cloud) links made.
+        """
+        prev_clds, curr_clds = self.clds_at_time[-2], self.clds_at_time[-1]
+        links = []
+        if self.ignore_smaller_than:
+            self.ignored += sum(1 for cld in prev_clds.values() if cld.size <= self.ignore_smaller_than)
+
+        # Build cloud graph.
+        for prev_label, next_cld_label, overlap in zip(prev_labels, next_labels, overlaps):
+            prev_cld = prev_clds[prev_label]
+            if self.ignore_smaller_than:
+                if prev_cld.size <= self.ignore_smaller_than:
+                    continue
+            if self.store_detailed_working:
+                working = (curr_cld_field == next_cld_label).astype(int)
+                working += (proj_cld_field_ss == prev_label).astype(int) * 2
+                working += (curr_cld_field >= 1).astype(int)
+                self.all_working['detailed_working'].append(working)
+            next_cld = curr_clds[next_cld_label]
+            if self.ignore_smaller_than:
+                if next_cld.size <= self.ignore_smaller_than:
+                    self.ignored += 1
+                    continue
+            prev_cld.add_next(next_cld, int(overlap))
+            links.append((prev_cld, next_cld))
+        return links
+
+    def _track_step_slabs(self, time_index, curr_cld_field, fields=None):
+        """Same as `_track_step`, but only reads a slab of the cloud field (and any 3D fields) at a time."""
+        fields = fields or {}
+        # Fields reduced over all grid-cells are read with the cloud field.
+        value_fields = {}
+        for name, (reducer, field, scale, kwargs) in self.reducers.items():
+            if not (self.track_3d and self.fields[field][1]):
+                for value_field in [field, kwargs.get('weights')]:
+                    if value_field is not None:
+                        value_fields[value_field] = fields[value_field]
+        profile_fields = {}
+        settings = self.vertical_structure_settings
+        if self.track_3d and settings['w'] is not None and settings['rho'] is not None:
+            profile_fields['mass_flux_profile'] = (fields[settings['w']], fields[settings['rho']])
+        tables = slab_label_tables(curr_cld_field, self.slab_size, self.track_lev if self.track_3d else None,
+                                   value_fields, profile_fields, self.track_levels)
+        max_label = tables['max_label']
+
+        cld_table = OrderedDict()
+        cld_table['size'] = tables['size']
+        if self.track_3d:
+            track_lev_cells = cloudy_cells(tables['track_level'])
+            cld_table['pos'] = label_centroids(tables['track_level'], max_label, track_lev_cells) * self.dx
+            mass_flux_profile = tables.get('mass_flux_profile')
+            if mass_flux_profile is not None:
+                mass_flux_profile = mass_flux_profile * self.dx * self.dy
+            cld_table.update(profile_structure(tables['area_profile'], self.dx, self.dy, settings['dz'],
+                                               mass_flux_profile))
+        else:
+            cld_table['pos'] = tables['pos'] * self.dx
+        if self.track_levels:
+            cld_table.update(self._level_columns([tables['levels'][level] for level in self.track_levels], max_label))
+        for name, (reducer, field, scale, kwargs) in self.reducers.items():
+            kwargs = dict(kwargs)
+            if field in tables['values']:
+                cld_labels, values = tables['values'][field]
+                if 'weights' in kwargs:
+                    kwargs['weights'] = tables['values'][kwargs['weights']][1]
+            else:
+                cloudy, cld_labels = track_lev_cells
+                values = fields[field].ravel()[cloudy]
+                if 'weights' in kwargs:
+                    kwargs['weights'] = fields[kwargs['weights']].ravel()[cloudy]
+            cld_table[name] = REDUCERS[reducer](cld_labels, values, max_label, **kwargs) * scale
+        self.cld_tables.append(cld_table)
+        self._make_clouds(time_index, cld_table)
+
+        links = []
+        if self.prev_cld_field is not None:
+            if self.prev_cld_mask is None:
+                # e.g. resumed from a checkpoint.
+                self.prev_cld_mask = column_mask(self.prev_cld_field, self.slab_size)
+            dx, dy, amp = self._correlate(self.prev_cld_mask, tables['mask'])
             logger.debug('dx, dy, amp: {}, {}, {}'.format(dx, dy, amp))
-            # Apply projection - move prev cloud field to where I think it will be based on correlation.
-            # N.B. count backward from last dim -- handles 2d and 3d cases.
-            proj_cld_field_ss = np.roll(np.roll(prev_cld_field, int(dx), axis=-1), int(dy), axis=-2)
-
-            if self.store_working:
-                working = (curr_cld_field >= 1).astype(int)
-                working += (proj_cld_field_ss >= 1).astype(int) * 2
-                self.all_working['working'].append(working)
-
-            # Work out overlaps between projected forward previous cloud field and the current field.
-            prev_labels = range(1, int(prev_cld_field.max()) + 1)
-            for prev_label in prev_labels:
-                # N.B. prev_labels work for proj_cld_field as it's just a translation of prev_cld_field.
-                prev_cld = prev_clds[prev_label]
-                if self.ignore_smaller_than:
-                    if prev_cld.size <= self.ignore_smaller_than:
-                        self.ignored += 1
-                        continue
-                # These are labels for the current field.
-                if self.include_touching:
-                    if self.track_3d:
-                        overlapping_labels = set(curr_cld_field[grow_3d(proj_cld_field_ss == prev_label,
-                                                                        self.touching_diagonal)])
-                    else:
-                        overlapping_labels = set(curr_cld_field[grow(proj_cld_field_ss == prev_label,
-                                                                     self.touching_diagonal)])
+            ndim = len(curr_cld_field.shape)
+            if self.include_touching:
+                shifts = [(0,) * ndim] + grow_shifts(ndim, self.touching_diagonal)
+            else:
+                shifts = None
+            prev_labels, next_labels, overlaps = slab_label_pairs(self.prev_cld_field, curr_cld_field,
+                                                                  (0,) * (ndim - 2) + (int(dy), int(dx)),
+                                                                  self.slab_size, max_label, shifts)
+            links = self._link_clouds(prev_labels, next_labels, overlaps)
+        # Only a reference to the field is kept - it is read again one slab at a time at the next timestep.
+        self.prev_cld_field = curr_cld_field
+        self.prev_cld_mask = tables['mask']
+        return links
 
-                else:
-                    overlapping_labels = set(curr_cld_field[proj_cld_field_ss == prev_label])
-                if 0 in overlapping_labels:
-                    overlapping_labels.remove(0)
-
-                # Build cloud graph.
-                for next_cld_label in overlapping_labels:
-                    if self.store_detailed_working:
-                        working = (curr_cld_field == next_cld_label).astype(int)
-                        working += (proj_cld_field_ss == prev_label).astype(int) * 2
-                        working += (curr_cld_field >= 1).astype(int)
-                        self.all_working['detailed_working'].append(working)
-                    next_cld = curr_clds[next_cld_label]
-                    if self.ignore_smaller_than:
-                        if next_cld.size <= self.ignore_smaller_than:
-                            self.ignored += 1
-                            continue
-                    prev_cld.add_next(next_cld)
-
-            prev_cld_field = curr_cld_field
-            prev_clds = curr_clds
+    def save_checkpoint(self, path):
+        """Write the tracker state (clouds, graph and last cloud field) to a compressed archive.
 
-        return self.clds_at_time
+        The whole state is written each time. When not keeping history (see `add_online`), that is only the
+        timesteps of the open groups - complete groups are written once by `write_segment`.
+        :param str path: file to write to - overwritten atomically.
+        :return: None
+        """
+        logger.debug('Writing checkpoint after {} timesteps to {}'.format(len(self.clds_at_time), path))
+        arrays, meta = self._get_state()
+        write_archive(path, arrays, meta)
+
+    @classmethod
+    def resume(cls, path, cld_field_iter, skip_done=True):
+        """Create a tracker from a checkpoint written by `save_checkpoint`.
+
+        Calling `track` on the returned tracker continues from the timestep after the checkpoint
+        and gives the same cloud graph as an uninterrupted run.
+
+        :param str path: checkpoint file.
+        :param cld_field_iter: iterable cloud field.
+        :param bool skip_done: if True, `cld_field_iter` (and any mass flux iterators) start at the
+            first timestep and the already tracked timesteps are skipped, otherwise they start at the
+            next timestep to track - use this to append newly arrived timesteps to an archive.
+            Only the new timesteps are labelled, correlated and linked, and only the groups reaching the
+            last stored timestep are regrouped. To also restore and rewrite only the open groups, push the
+            new timesteps without keeping history, and write completed groups with `write_segment`.
+        :return Tracker: restored tracker.
+        """
+        arrays, meta = read_archive(path)
+        tracker = cls(cld_field_iter, meta['dx'], meta['dy'],
+                      include_touching=meta['include_touching'],
+                      touching_diagonal=meta['touching_diagonal'],
+                      ignore_smaller_equal_than=meta['ignore_smaller_equal_than'],
+                      track_3d=meta['track_3d'],
+                      track_level=meta['track_level'],
+                      frac_method=meta['frac_method'],
+                      sparse=meta.get('sparse', False),
+                      sparse_max_fraction=meta.get('sparse_max_fraction', 0.1),
+                      correlator=meta.get('correlator', 'full'),
+                      id_time_offset=meta.get('id_time_offset', 0))
+        tracker._set_state(arrays, meta)
+        if meta.get('adaptive_correlation'):
+            state = meta['adaptive_correlation']
+            tracker.add_adaptive_correlation(state['max_reuse'], state['min_amp_fraction'])
+            tracker.adaptive_correlator.set_state(state)
+        if meta.get('slab_size'):
+            tracker.add_out_of_core(meta['slab_size'])
+        if skip_done:
+            tracker._num_to_skip = len(tracker.clds_at_time)
+        logger.debug('Resumed from {} after {} timesteps'.format(path, len(tracker.clds_at_time)))
+        return tracker
+
+    def _get_state(self):
+        """Flatten clouds and their links into arrays, the inverse of `_set_state`."""
+        index = {cld.id: i for i, cld in enumerate(self.all_clds)}
+        # Unknown overlaps are stored as -1.
+        edges = [(index[cld.id], index[next_cld.id], -1 if next_cld.overlap(cld) is None else next_cld.overlap(cld))
+                 for cld in self.all_clds for next_cld in cld.next_clds]
+        # Timesteps emptied when not keeping history are not stored.
+        first_kept = self._num_dropped_timesteps
+        arrays = {
+            'num_clds_at_time': np.array([len(clds) for clds in self.clds_at_time[first_kept:]], dtype=np.int64),
+            'edges': np.array(edges, dtype=np.int64).reshape(-1, 3),
+        }
+        # Cloud tables are stored one column at a time for all timesteps.
+        columns = list(self.cld_tables[-1].keys()) if self.cld_tables else []
+        for column in columns:
+            arrays['cld_' + column] = np.concatenate([self.cld_tables[-1][column][:0]] +
+                                                     [cld_table[column] for cld_table in self.cld_tables[first_kept:]])
+        label_indices = [clds[1]._label_index for clds in self.clds_at_time if clds]
+        if self.track_3d and label_indices and all(label_indices):
+            # Label indices are stored as one buffer of flat indices, with offsets for each cloud.
+            arrays['cld_cells'] = np.concatenate([label_index.indices for label_index in label_indices])
+            arrays['cld_cells_offsets'] = np.cumsum(np.concatenate([[0]] + [np.diff(label_index.offsets)
+                                                                             for label_index in label_indices]))
+            field_shape = list(label_indices[0].shape)
+        else:
+            field_shape = None
+        if self.slab_size and self.prev_cld_field is not None:
+            prev_cld_field = sparse_from_slabs(self.prev_cld_field, self.slab_size)
+            arrays['prev_cld_indices'] = prev_cld_field.indices
+            arrays['prev_cld_labels'] = prev_cld_field.labels
+        elif isinstance(self.prev_cld_field, SparseLabels):
+            arrays['prev_cld_indices'] = self.prev_cld_field.indices
+            arrays['prev_cld_labels'] = self.prev_cld_field.labels
+        elif self.prev_cld_field is not None:
+            arrays['prev_cld_field'] = np.asarray(self.prev_cld_field)
+        # Groups are stored as indices of their clouds (in group order) plus offsets.
+        arrays['group_clds'] = np.array([index[cld.id] for group in self.groups for cld in group.clds],
+                                        dtype=np.int64)
+        arrays['group_offsets'] = np.cumsum([0] + [len(group) for group in self.groups])
+        if self._open_groups:
+            # Groups still growing when pushing timesteps.
+            open_groups = list(self._open_groups.values())
+            arrays['open_group_clds'] = np.array([index[cld.id] for clds in open_groups for cld in clds],
+                                                 dtype=np.int64)
+            arrays['open_group_offsets'] = np.cumsum([0] + [len(clds) for clds in open_groups])
+        if self.lineage is not None:
+            arrays.update(self.lineage.to_arrays())
+        if self.track_levels:
+            arrays['level_displacements'] = np.array(self.level_displacements).reshape(-1, len(self.track_levels), 3)
+            if self.prev_level_masks is not None:
+                arrays['prev_level_masks'] = np.array(self.prev_level_masks)
+        if self.adjacency_diagonal is not None:
+            arrays['adjacency'] = np.concatenate([np.zeros((0, 3), dtype=np.int64)] +
+                                                 [np.array(adjacency, dtype=np.int64).T
+                                                  for adjacency in self.adjacency_at_time])
+            arrays['adjacency_offsets'] = np.cumsum([0] + [len(adjacency[0]) for adjacency in self.adjacency_at_time])
+
+        meta = {
+            'dx': self.dx,
+            'dy': self.dy,
+            'include_touching': self.include_touching,
+            'touching_diagonal': self.touching_diagonal,
+            'ignore_smaller_equal_than': self.ignore_smaller_than,
+            'track_3d': self.track_3d,
+            'track_level': self.track_levels or self.track_lev,
+            'frac_method': self.frac_method,
+            'num_timesteps': len(self.clds_at_time),
+            'ignored': self.ignored,
+            'num_grouped_timesteps': self._num_grouped_timesteps,
+            'columns': columns,
+            'field_shape': field_shape,
+            'adjacency_diagonal': self.adjacency_diagonal,
+            'sparse': self.sparse,
+            'sparse_max_fraction': self.sparse_max_fraction,
+            'correlator': self.correlator,
+            'id_time_offset': self.id_time_offset,
+            'adaptive_correlation': self.adaptive_correlator.get_state() if self.adaptive_correlator else None,
+            'prev_cld_shape': list(self.prev_cld_field.shape) if self.prev_cld_field is not None else None,
+            'cld_field_shape': list(self.cld_field_shape) if self.cld_field_shape is not None else None,
+            'slab_size': self.slab_size,
+            'keep_history': self.keep_history,
+            'num_dropped_timesteps': first_kept,
+            'num_segments': self.num_segments,
+            'num_segment_groups': self.num_segment_groups,
+        }
+        return arrays, meta
+
+    def _set_state(self, arrays, meta):
+        """Rebuild clouds and their links from the output of `_get_state`."""
+        # Timesteps emptied when not keeping history were not stored.
+        first_kept = meta.get('num_dropped_timesteps', 0)
+        self.clds_at_time = [{} for _ in range(first_kept)]
+        self.all_clds = []
+        self.cld_tables = [OrderedDict((column, arrays['cld_' + column][:0]) for column in meta['columns'])
+                           for _ in range(first_kept)]
+        self._num_dropped_timesteps = first_kept
+        self.num_segments = meta.get('num_segments', 0)
+        self.num_segment_groups = meta.get('num_segment_groups', 0)
+        self.ignored = meta['ignored']
+        offsets = np.cumsum(np.concatenate([[0], arrays['num_clds_at_time']]))
+        for time_index, (start, end) in enumerate(zip(offsets[:-1], offsets[1:]), first_kept):
+            cld_table = OrderedDict((column, arrays['cld_' + column][start:end]) for column in meta['columns'])
+            curr_clds = {}
+            if meta['field_shape'] and end > start:
+                cells_offsets = arrays['cld_cells_offsets'][start:end + 1]
+                label_index = LabelIndex(meta['field_shape'],
+                                         arrays['cld_cells'][cells_offsets[0]:cells_offsets[-1]],
+                                         cells_offsets - cells_offsets[0])
+            for label in range(1, end - start + 1):
+                curr_clds[label] = Cloud(label, time_index, cld_table['pos'][label - 1],
+                                         cld_table['size'][label - 1],
+                                         cld_id=cloud_id(self.id_time_offset + time_index, label))
+                if meta['field_shape']:
+                    curr_clds[label].set_label_index(label_index)
+                for column in meta['columns']:
+                    if column not in ['size', 'pos']:
+                        setattr(curr_clds[label], column, cld_table[column][label - 1])
+            self.cld_tables.append(cld_table)
+            self.clds_at_time.append(curr_clds)
+            self.all_clds.extend(curr_clds.values())
+
+        # Edges were stored in the order they were made, which preserves prev/next_clds order.
+        for prev_index, next_index, overlap in arrays['edges']:
+            self.all_clds[prev_index].add_next(self.all_clds[next_index], int(overlap) if overlap >= 0 else None)
+        if 'prev_cld_indices' in arrays:
+            self.prev_cld_field = SparseLabels(meta['prev_cld_shape'], arrays['prev_cld_indices'],
+                                               arrays['prev_cld_labels'])
+        else:
+            self.prev_cld_field = arrays.get('prev_cld_field')
+        cld_field_shape = meta.get('cld_field_shape') or meta.get('prev_cld_shape')
+        self.cld_field_shape = tuple(cld_field_shape) if cld_field_shape else None
+
+        offsets = arrays['group_offsets']
+        self.groups = [CloudGroup([self.all_clds[i] for i in arrays['group_clds'][start:end]], self.frac_method)
+                       for start, end in zip(offsets[:-1], offsets[1:])]
+        self._num_grouped_timesteps = meta['num_grouped_timesteps']
+        self.keep_history = meta.get('keep_history', True)
+        if 'open_group_clds' in arrays:
+            self._open_groups = {}
+            self._open_group_roots = {}
+            last_time_index = len(self.clds_at_time) - 1
+            offsets = arrays['open_group_offsets']
+            for start, end in zip(offsets[:-1], offsets[1:]):
+                clds = [self.all_clds[i] for i in arrays['open_group_clds'][start:end]]
+                self._open_groups[clds[0].id] = clds
+                for cld in clds:
+                    if cld.time_index == last_time_index:
+                        self._open_group_roots[cld.id] = clds[0].id
+        if 'lineage_bits' in arrays:
+            self.lineage = Lineage.from_arrays(self.groups, arrays)
+        if 'level_displacements' in arrays:
+            self.level_displacements = list(arrays['level_displacements'])
+            if 'prev_level_masks' in arrays:
+                self.prev_level_masks = list(arrays['prev_level_masks'])
+        self.adjacency_diagonal = meta.get('adjacency_diagonal')
+        if self.adjacency_diagonal is not None:
+            offsets = arrays['adjacency_offsets']
+            self.adjacency_at_time = [tuple(arrays['adjacency'][start:end].T)
+                                      for start, end in zip(offsets[:-1], offsets[1:])]
 
     def group(self):
         """Group clouds into all clouds that are connected throught the next/prev relationships.
+
+        Can be called again after more timesteps have been tracked, in which case only the groups
+        that reached the last previously grouped timestep (the only ones that can have grown) are rebuilt.
         :return list: groups of clouds
         """
+        if self._open_groups:
+            # Open groups from `push`.
+            self.groups.extend(CloudGroup(clds, self.frac_method) for clds in self._open_groups.values()
+                               if not self._is_ignored(clds))
+            self._open_groups = None
+            self._open_group_roots = None
+        # Groups that ended before the last grouped timestep are complete - keep them as they are.
+        last_grouped_time_index = self._num_grouped_timesteps - 1
+        open_groups = [g for g in self.groups if g.last_time_index == last_grouped_time_index]
+        self.groups = [g for g in self.groups if g.last_time_index != last_grouped_time_index]
+        logger.debug('Regrouping {} open groups'.format(len(open_groups)))
+
+        search_clds = [cld for group in open_groups for cld in group.clds]
+        for curr_clds in self.clds_at_time[self._num_grouped_timesteps:]:
+            search_clds.extend(curr_clds.values())
 
         found_clds = {}
-        for cld in self.all_clds:
-            if cld.size <= self.ignore_smaller_than:
+        for cld in search_clds:
+            if self.ignore_smaller_than and cld.size <= self.ignore_smaller_than:
                 continue
             if cld.id not in found_clds:
                 group = self._find_connected_clouds(cld, self.frac_method)
@@ -437,8 +1399,73 @@ class Tracker(object):
                     if found_cld.id in found_clds:
                         logger.error('Found multiple cloud ids: {}'.format(found_cld.id))
                     found_clds[found_cld.id] = found_cld
+        # Same order as grouping everything in one go.
+        self.groups.sort(key=lambda g: (g.first_time_index, min(c.label for c in g.clds_at_time[0])))
+        self._num_grouped_timesteps = len(self.clds_at_time)
+        self.lineage = None
         return self.groups
 
+    def build_lineage(self):
+        """Build lineage index for all groups, for fast ancestor/descendant queries.
+
+        The lineage is saved with checkpoints.
+        :return Lineage: lineage index
+        """
+        self.lineage = Lineage(self.groups)
+        return self.lineage
+
+    def cluster(self, max_dist=None, touching=False):
+        """Cluster clouds at each timestep that are linked by neighbours within max_dist of each other,
+        and/or that touch.
+
+        Distances are between cloud centroids, and wrap around the (periodic) domain.
+        Clouds without a centroid at the tracking level are only clustered if they touch.
+        :param float max_dist: max distance between neighbouring clouds (same units as dx).
+        :param bool touching: cluster clouds that touch - needs `add_adjacency` before tracking.
+        :return list: clusters_at_time - list of clusters at each timestep, each a list of clouds.
+        """
+        if max_dist is None and not touching:
+            raise ValueError('One of max_dist or touching must be set')
+        if touching and self.adjacency_diagonal is None:
+            raise ValueError('Clustering touching clouds needs add_adjacency to be called before tracking')
+        if self.cld_field_shape is None:
+            raise ValueError('Domain size is not known until a cloud field has been tracked')
+        domain_size = np.array(self.cld_field_shape[-2:]) * self.dx
+        self.clusters_at_time = []
+        for time_index, (clds, cld_table) in enumerate(zip(self.clds_at_time, self.cld_tables)):
+            # Pairs of clouds (as label - 1) that are neighbours.
+            pairs_i, pairs_j = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+            if max_dist is not None:
+                pos = cld_table['pos']
+                has_pos = np.flatnonzero(~np.isnan(pos).any(axis=1))
+                i, j = periodic_pairs(pos[has_pos], max_dist, domain_size)
+                pairs_i.append(has_pos[i])
+                pairs_j.append(has_pos[j])
+            if touching:
+                labels_a, labels_b, _ = self.adjacency_at_time[time_index]
+                pairs_i.append(labels_a - 1)
+                pairs_j.append(labels_b - 1)
+            cluster_index = connected_components(len(clds), np.concatenate(pairs_i), np.concatenate(pairs_j))
+
+            clusters = [[] for _ in range(cluster_index.max() + 1 if len(clds) else 0)]
+            for label in sorted(clds):
+                clusters[cluster_index[label - 1]].append(clds[label])
+            self.clusters_at_time.append(clusters)
+        return self.clusters_at_time
+
+    def export_tables(self, cld_path, edge_path=None, fmt=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Export clouds, and optionally links between them, as columnar tables (see export module).
+
+        :param str cld_path: file to write cloud table to.
+        :param str edge_path: file to write edge table to.
+        :param str fmt: 'csv', 'npz' or 'nc', taken from file extensions if None.
+        :param int chunk_size: number of rows to build and write at a time.
+        :return: None
+        """
+        export_cloud_table(self, cld_path, fmt, chunk_size)
+        if edge_path:
+            export_edge_table(self, edge_path, fmt, chunk_size)
+
     @staticmethod
     def _find_connected_clouds(cld, frac_method):
         """Builds the cloud group by iterating through the linkages between clouds."""
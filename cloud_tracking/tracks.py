@@ -0,0 +1,97 @@
+"""Decomposition of cloud groups into non-overlapping linear tracks.
+
+Where a cloud splits or merges, a selection criterion decides which branch continues the track: each
+cloud picks its best next cloud, and each next cloud keeps the best of the clouds that picked it. The
+other branches start or end their own tracks. The cloud graph is not modified.
+"""
+from logging import getLogger
+
+import numpy as np
+
+logger = getLogger('ct.tracks')
+
+# Criterion name -> function(group, edges) -> score for each edge (higher is better).
+SELECTION_CRITERIA = {}
+
+
+def register_criterion(name):
+    """Decorator to add a selection criterion to SELECTION_CRITERIA."""
+    def register(func):
+        SELECTION_CRITERIA[name] = func
+        return func
+    return register
+
+
+def _closest(group, edges, attr):
+    values = np.array([getattr(cld, attr) for cld in group.clds], dtype=float)
+    return -np.abs(values[edges['next']] - values[edges['prev']])
+
+
+@register_criterion('max_overlap')
+def max_overlap(group, edges):
+    return edges['overlap']
+
+
+@register_criterion('max_frac')
+def max_frac(group, edges):
+    return edges['frac']
+
+
+@register_criterion('closest_size')
+def closest_size(group, edges):
+    return _closest(group, edges, 'size')
+
+
+@register_criterion('closest_depth')
+def closest_depth(group, edges):
+    return _closest(group, edges, 'depth')
+
+
+def _best_edge(keys, score, candidates):
+    """Of candidates (edge indices), the one with the highest score for each key - first on ties."""
+    order = candidates[np.lexsort((-score[candidates], keys[candidates]))]
+    _, first = np.unique(keys[order], return_index=True)
+    return order[first]
+
+
+def extract_tracks(group, criterion='max_overlap'):
+    """Decompose a group into linear tracks, so that each cloud is in exactly one track.
+
+    :param CloudGroup group: group to decompose.
+    :param str criterion: name of criterion from SELECTION_CRITERIA.
+    :return tuple(np.ndarray, np.ndarray): ragged array of tracks - indices into group.clds,
+        track i is indices[offsets[i]:offsets[i + 1]] and is in time order.
+    """
+    assert criterion in SELECTION_CRITERIA, 'Unrecognized criterion: {}'.format(criterion)
+    num_clds = len(group.clds)
+    edges = group.edge_arrays()
+    score = np.nan_to_num(np.asarray(SELECTION_CRITERIA[criterion](group, edges), dtype=float), nan=-np.inf)
+
+    all_edges = np.arange(len(score))
+    chosen = _best_edge(edges['prev'], score, all_edges)
+    chosen = _best_edge(edges['next'], score, chosen)
+    successor = np.full(num_clds, -1)
+    successor[edges['prev'][chosen]] = edges['next'][chosen]
+    has_predecessor = np.zeros(num_clds, dtype=bool)
+    has_predecessor[edges['next'][chosen]] = True
+
+    # Sweep forward in time, passing each track id on to the successor.
+    time_index = np.array([cld.time_index for cld in group.clds])
+    track_id = np.full(num_clds, -1)
+    starts = np.where(~has_predecessor)[0]
+    track_id[starts] = np.arange(len(starts))
+    time_order = np.argsort(time_index, kind='stable')
+    level_bounds = np.searchsorted(time_index[time_order], np.arange(time_index.min(), time_index.max() + 2))
+    for start, end in zip(level_bounds[:-1], level_bounds[1:]):
+        curr = time_order[start:end]
+        curr = curr[successor[curr] >= 0]
+        track_id[successor[curr]] = track_id[curr]
+
+    indices = np.lexsort((time_index, track_id))
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(track_id, minlength=len(starts)))])
+    return indices, offsets
+
+
+def split_tracks(indices, offsets):
+    """Split ragged array of tracks into a list of arrays."""
+    return np.split(indices, offsets[1:-1])
@@ -1,8 +1,50 @@
+import itertools
+
 import numpy as np
 
 
-def dist(pos1, pos2):
-    return np.sqrt((pos2[0] - pos1[0])**2 + (pos2[1] - pos1[1])**2)
+# Cloud ids are (time_index << CLOUD_ID_LABEL_BITS) | label.
+CLOUD_ID_LABEL_BITS = 32
+
+
+def cloud_id(time_index, label):
+    """
+    Id of the cloud with label at time_index - depends only on these, not on the order clouds were made in.
+
+    :param int time_index: time index.
+    :param int label: label, 1 to 2**32 - 1.
+    :return int: id, fits in an int64 for time indices below 2**31.
+    """
+    assert 0 < label < 2**CLOUD_ID_LABEL_BITS and time_index >= 0
+    return (int(time_index) << CLOUD_ID_LABEL_BITS) | int(label)
+
+
+def cloud_ids(time_indices, labels):
+    """Same as `cloud_id` for arrays of time indices and labels.
+
+    :return np.ndarray: int64 ids.
+    """
+    return (np.asarray(time_indices, dtype=np.int64) << CLOUD_ID_LABEL_BITS) | np.asarray(labels, dtype=np.int64)
+
+
+def split_cloud_ids(ids):
+    """Inverse of `cloud_ids`.
+
+    :param np.ndarray ids: cloud ids.
+    :return tuple(np.ndarray, np.ndarray): time indices, labels.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    return ids >> CLOUD_ID_LABEL_BITS, ids & (2**CLOUD_ID_LABEL_BITS - 1)
+
+
+def dist(pos1, pos2, domain_size=None):
+    """Distance between pos1 and pos2, wrapped around a periodic domain if domain_size given."""
+    d0 = np.abs(pos2[0] - pos1[0])
+    d1 = np.abs(pos2[1] - pos1[1])
+    if domain_size is not None:
+        d0 = np.minimum(d0, domain_size[0] - d0)
+        d1 = np.minimum(d1, domain_size[1] - d1)
+    return np.sqrt(d0**2 + d1**2)
 
 
 def _test_indices(i, j, diagonal=False, extended=False):
@@ -91,6 +133,151 @@ def grow(a, diagonal=False):
     return anew
 
 
+def grow_shifts(ndim, diagonal=False):
+    """
+    Shifts that `grow` (2D) or `grow_3d` (3D) roll an array by.
+
+    :param int ndim: 2 or 3.
+    :param diagonal: whether to grow in diagonal direction.
+    :return list: tuples of shifts, one per axis.
+    """
+    if ndim == 2:
+        return _test_indices(0, 0, diagonal)
+    elif ndim == 3:
+        # N.B. grow_3d rolls its (k, i, j) indices along axes (2, 0, 1).
+        return [(i, j, k) for k, i, j in _test_indices_3d(0, 0, 0, 0, 1, diagonal)]
+    else:
+        raise ValueError('ndim must be 2 or 3')
+
+
+def label_pairs(proj_field, curr_field, shifts=None):
+    """
+    Find all pairs of labels that overlap between two label fields.
+
+    Equivalent to looking at curr_field under each (optionally grown) label of proj_field in turn,
+    but does all labels in one pass.
+
+    :param np.ndarray proj_field: labels - e.g. the previous field projected forward.
+    :param np.ndarray curr_field: labels, same shape as proj_field.
+    :param list shifts: if set, shifts to apply to proj_field (see `grow_shifts`) - include a
+        zero shift to count overlaps as well as touching cells.
+    :return tuple(np.ndarray): proj labels, curr labels, number of overlapping grid-cells with the
+        first shift (i.e. the overlap if the first shift is zero); sorted by proj label then curr label.
+    """
+    axes = tuple(range(proj_field.ndim))
+    if shifts is None:
+        shifts = [(0,) * proj_field.ndim]
+    num_curr = int(curr_field.max()) + 1
+    curr_mask = curr_field > 0
+    keys = []
+    for shift in shifts:
+        shifted_field = np.roll(proj_field, shift, axis=axes) if any(shift) else proj_field
+        mask = curr_mask & (shifted_field > 0)
+        keys.append(shifted_field[mask].astype(np.int64) * num_curr + curr_field[mask].astype(np.int64))
+    first_keys, first_counts = np.unique(keys[0], return_counts=True)
+    keys = np.unique(np.concatenate(keys))
+    counts = np.zeros(len(keys), dtype=np.int64)
+    counts[np.searchsorted(keys, first_keys)] = first_counts
+    return keys // num_curr, keys % num_curr, counts
+
+
+def cloudy_cells(labels):
+    """
+    Flat indices and labels of all labelled grid-cells.
+
+    Per-label reductions over these cells cost in proportion to the cloudy area, not the domain.
+
+    :param np.ndarray labels: field of labels.
+    :return tuple(np.ndarray, np.ndarray): flat indices into labels, labels at these indices.
+    """
+    flat_labels = labels.ravel()
+    cloudy = np.flatnonzero(flat_labels)
+    return cloudy, flat_labels[cloudy].astype(np.int64)
+
+
+def label_sums(cld_labels, values, max_label):
+    """
+    Sum values over each label in one grouped reduction.
+
+    :param np.ndarray cld_labels: labels of cloudy grid-cells (see `cloudy_cells`).
+    :param np.ndarray values: values at the same grid-cells.
+    :param int max_label: number of labels.
+    :return np.ndarray: sum for each of labels 1 to max_label.
+    """
+    return np.bincount(cld_labels, weights=values, minlength=max_label + 1)[1:max_label + 1]
+
+
+def label_centroids(labels, max_label, cells=None):
+    """
+    Mean grid-cell position of each label.
+
+    :param np.ndarray labels: field of labels.
+    :param int max_label: number of labels.
+    :param tuple cells: if already known, output of `cloudy_cells(labels)`.
+    :return np.ndarray: (max_label, labels.ndim) array of positions in grid-cells.
+    """
+    cloudy, cld_labels = cells if cells is not None else cloudy_cells(labels)
+    sizes = np.bincount(cld_labels, minlength=max_label + 1)[1:max_label + 1]
+    pos = np.empty((max_label, labels.ndim))
+    for axis, indices in enumerate(np.unravel_index(cloudy, labels.shape)):
+        pos[:, axis] = label_sums(cld_labels, indices, max_label)
+    with np.errstate(invalid='ignore'):
+        return pos / sizes[:, None]
+
+
+def adjacency_shifts(ndim, diagonal=False):
+    """
+    Offsets to one of each pair of neighbouring grid-cells, so that each neighbouring pair is seen once.
+
+    :param int ndim: 2 or 3 (z, y, x).
+    :param bool diagonal: include diagonal neighbours (8 connectivity in 2D, 18 in 3D).
+    :return list: offsets as tuples.
+    """
+    if ndim not in (2, 3):
+        raise ValueError('ndim must be 2 or 3')
+    shifts = []
+    for shift in itertools.product((-1, 0, 1), repeat=ndim):
+        num_nonzero = sum(1 for s in shift if s)
+        # Only keep shifts whose first nonzero element is positive - the others are their opposites.
+        if num_nonzero and [s for s in shift if s][0] > 0 and (num_nonzero == 1 or (diagonal and num_nonzero == 2)):
+            shifts.append(shift)
+    return shifts
+
+
+def label_adjacency(labels, diagonal=False, cells=None):
+    """
+    Find all pairs of different labels that touch, and the length of the boundary between them.
+
+    Only the neighbours of cloudy grid-cells are looked at, so the cost scales with the cloudy area.
+    Horizontal axes (the last two) are periodic, the vertical axis of 3D fields is not.
+
+    :param np.ndarray labels: 2D or 3D field of labels.
+    :param bool diagonal: count diagonal neighbours as touching (8 or 18 connectivity, else 4 or 6).
+    :param tuple cells: if already known, output of `cloudy_cells(labels)`.
+    :return tuple(np.ndarray): sparse (COO) adjacency - labels a, labels b (a < b) and number of pairs of
+        neighbouring grid-cells between them; sorted by a then b.
+    """
+    cloudy, cld_labels = cells if cells is not None else cloudy_cells(labels)
+    coords = np.unravel_index(cloudy, labels.shape)
+    num_labels = int(cld_labels.max()) + 1 if len(cld_labels) else 1
+    keys = []
+    for shift in adjacency_shifts(labels.ndim, diagonal):
+        neighbour = [c + s for c, s in zip(coords, shift)]
+        neighbour[-1] %= labels.shape[-1]
+        neighbour[-2] %= labels.shape[-2]
+        valid = np.ones(len(cloudy), dtype=bool)
+        if labels.ndim == 3:
+            valid = (neighbour[0] >= 0) & (neighbour[0] < labels.shape[0])
+        neighbour_labels = labels[tuple(n[valid] for n in neighbour)].astype(np.int64)
+        these_labels = cld_labels[valid]
+        touching = (neighbour_labels != 0) & (neighbour_labels != these_labels)
+        a = np.minimum(these_labels[touching], neighbour_labels[touching])
+        b = np.maximum(these_labels[touching], neighbour_labels[touching])
+        keys.append(a * num_labels + b)
+    keys, counts = np.unique(np.concatenate(keys), return_counts=True)
+    return keys // num_labels, keys % num_labels, counts
+
+
 def _test_indices_3d(k, i, j, k_limit, k_start, diagonal=False, extended=False):
     if extended:
         # Count any cells in a 5x5 area centred on the current i, j cell as being adjacent.
@@ -159,7 +346,7 @@ def label_clds_3d(mask, diagonal=False, wrap=True, min_cells=0, k_start=1):
                                     jt %= mask.shape[2]
 
                                 if kt >= mask.shape[0] or kt < 0:
-                                   print kt, 'out of range of vertical domain'
+                                   print(kt, 'out of range of vertical domain')
 
                                 if not labels[kt, it, jt] and mask[kt, it, jt]:
                                     blob_count += 1
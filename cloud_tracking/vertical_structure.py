@@ -0,0 +1,80 @@
+"""Vertical structure of 3D clouds, for all clouds at a timestep at once.
+
+Everything is calculated from one pass over the cloudy grid-cells of a 3D (z, y, x) label field, and
+returned as columns indexed by label - 1.
+"""
+import numpy as np
+
+from cloud_tracking.geometry import LabelIndex, profile_extents
+
+
+def vertical_structure(label_index, dx=1, dy=1, dz=1, w=None, rho=None):
+    """Vertical structure of every label in a 3D field.
+
+    :param LabelIndex label_index: grid-cells of each label of a 3D field.
+    :param float dx: resolution in x-dir.
+    :param float dy: resolution in y-dir.
+    :param dz: resolution in z-dir - float or array with one value per level.
+    :param np.ndarray w: if set (along with rho), 3D w field used for mass flux profile.
+    :param np.ndarray rho: 3D rho field.
+    :return dict: columns - 'top', 'base', 'depth' (in levels, -1 if label has no grid-cells),
+        'volume', 'area_profile' (grid-cells at each level, (max_label, nz)) and, if w and rho are
+        given, 'mass_flux_profile' ((max_label, nz)).
+    """
+    nz = label_index.shape[0]
+    mass_flux_profile = None
+    if w is not None:
+        level = label_index.indices // (label_index.shape[1] * label_index.shape[2])
+        cell_labels = label_index.cell_labels()
+        mass_flux = w.ravel()[label_index.indices] * rho.ravel()[label_index.indices] * dx * dy
+        mass_flux_profile = np.bincount((cell_labels - 1) * nz + level, weights=mass_flux,
+                                        minlength=label_index.max_label * nz).reshape(label_index.max_label, nz)
+    return profile_structure(label_index.extents()['area_profile'], dx, dy, dz, mass_flux_profile)
+
+
+def profile_structure(area_profile, dx=1, dy=1, dz=1, mass_flux_profile=None):
+    """Vertical structure of every label from its area (and mass flux) profile - see `vertical_structure`.
+
+    :param np.ndarray area_profile: grid-cells of each label at each level, shape (max_label, nz).
+    :param float dx: resolution in x-dir.
+    :param float dy: resolution in y-dir.
+    :param dz: resolution in z-dir - float or array with one value per level.
+    :param np.ndarray mass_flux_profile: if set, mass flux of each label at each level, shape (max_label, nz).
+    :return dict: columns.
+    """
+    nz = area_profile.shape[1]
+    columns = profile_extents(area_profile)
+    columns['volume'] = (area_profile * (np.ones(nz) * dz)).sum(axis=1) * dx * dy
+    if mass_flux_profile is not None:
+        columns['mass_flux_profile'] = mass_flux_profile
+    return columns
+
+
+def vertical_structure_from_labels(labels, max_label=None, **kwargs):
+    """Vertical structure of every label in a 3D field of labels - see `vertical_structure`.
+
+    :param np.ndarray labels: 3D (z, y, x) field of labels.
+    :param int max_label: number of labels, if known.
+    :return dict: columns.
+    """
+    if max_label is None:
+        max_label = int(labels.max())
+    return vertical_structure(LabelIndex.from_labels(labels, max_label), **kwargs)
+
+
+def group_by_bins(values, bin_values, bins):
+    """Group values by which bin the corresponding bin_values fall in.
+
+    Bins are half open, (bins[i], bins[i + 1]], as used for grouping tracks by lifetime.
+
+    :param np.ndarray values: values to group, grouped along first axis.
+    :param np.ndarray bin_values: value to bin for each of values, e.g. lifetime.
+    :param list bins: bin edges.
+    :return list: one array of values for each bin.
+    """
+    values = np.asarray(values)
+    bin_index = np.digitize(bin_values, bins, right=True) - 1
+    in_bins = (bin_index >= 0) & (bin_index < len(bins) - 1)
+    order = np.argsort(bin_index[in_bins], kind='stable')
+    counts = np.bincount(bin_index[in_bins], minlength=len(bins) - 1)
+    return np.split(values[in_bins][order], np.cumsum(counts)[:-1])
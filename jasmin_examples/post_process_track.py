@@ -5,6 +5,8 @@
 import numpy as np
 import pickle
 import netCDF4
+from cloud_tracking.vertical_structure import group_by_bins
+from cloud_tracking.tracks import extract_tracks, split_tracks
 
 ### Path for storing the output file ###
 resultpath = '/gws/nopw/j04/paracon_rdg/users/jfgu/result/'
@@ -22,36 +24,18 @@ all_clds                   = pickle.load(open(resultpath+'/ud_cc_field_tracker_a
 #######################################################
 ## Because some cloud objects may be linked with  #####
 ##    more than one objects at the next time      #####
-## So here I just simply keep the object whose    #####
-## depth is closet to that of the previous object #####
+## each group is split into linear tracks, keeping #####
+## the object whose depth is closest to that of   #####
+## the previous object. The groups are unchanged. #####
 #######################################################
 
-for cld_num in range(1, len(clds_at_time[0])):
-    cld       = clds_at_time[0][cld_num]
-    cld_depth = np.max(cld.pos[0])-np.min(cld.pos[0])
-    while len(cld.next_clds)>0:
-        index      = []
-        depth_diff = []
-        for next_cld_num in range(0, len(cld.next_clds)):
-            next_cld       = cld.next_clds[next_cld_num]
-            next_cld_depth = np.max(next_cld.pos[0])-np.min(next_cld.pos[0])
-            depth_diff.append(np.abs(next_cld_depth - cld_depth))
-     
-        min_depth = 999
-        min_ind   = 999
-        for next_cld_num in range(0, len(depth_diff)):
-            if depth_diff[next_cld_num] < min_depth:
-                min_ind   = next_cld_num
-                min_depth = depth_diff[next_cld_num]
-        for next_cld_num in range(0, len(cld.next_clds)):
-            if not next_cld_num == min_ind:
-                index.append(next_cld_num)
-
-        cld_list = [cld.next_clds[min_ind]]
-        cld.next_clds = cld_list
-
-        cld = cld.next_clds[0]
-        cld_depth = np.max(cld.pos[0])-np.min(cld.pos[0])
+## next cloud in the track of each cloud (None at the end of a track)
+next_in_track = {}
+for group in groups:
+    indices, offsets = extract_tracks(group, 'closest_depth')
+    for track in split_tracks(indices, offsets):
+        for i, j in zip(track[:-1], track[1:]):
+            next_in_track[group.clds[i].id] = group.clds[j]
 
 ########## Using dictionaries to store the results
 cloud_list          = {}     ## for all tracked cloud objects
@@ -71,73 +55,43 @@ cloud_depth_life    = {}
 life_time = [0, 5, 10, 15, 20, 25, 30, 35, 50]  # unit in minutes
 
 ### now begins
+## Cloud top, base and depth (in levels) were calculated by the tracker for all clouds from the 3D label field.
 for ntime in range(0, len(clds_at_time)):
-    cloud_list[ntime]        = {}
-    cloud_top[ntime]         = {}
-    cloud_base[ntime]        = {}
-    cloud_volume[ntime]      = {}
-    cloud_depth[ntime]       = {}
-    cloud_stage[ntime]       = {}
-    track_num[ntime]         = []
-    cloud_list_life[ntime]   = {}
-    cloud_top_life[ntime]    = {}
-    cloud_base_life[ntime]   = {}
-    cloud_volume_life[ntime] = {}
-    cloud_depth_life[ntime]  = {}
+    cloud_list[ntime]   = {}
+    cloud_top[ntime]    = {}
+    cloud_base[ntime]   = {}
+    cloud_volume[ntime] = {}
+    cloud_depth[ntime]  = {}
     for num_cld in range(1, len(clds_at_time[ntime])+1):
-        ## get the first cloud for each tracking
-        cloud_list[ntime][num_cld] = []
-        cloud_list[ntime][num_cld].append(clds_at_time[ntime][num_cld])
-
-        cld = clds_at_time[ntime][num_cld]
-
-        ## get the cloud properties of the first cloud for each tracking
-        cloud_top[ntime][num_cld] = []
-        cloud_top[ntime][num_cld].append(np.max(cld.pos[0]))
-
-        cloud_base[ntime][num_cld] = []
-        cloud_base[ntime][num_cld].append(np.min(cld.pos[0]))
-
-        cloud_volume[ntime][num_cld] = []
-        cloud_volume[ntime][num_cld].append(cld.size)
-
-        cloud_depth[ntime][num_cld] = []
-        cloud_depth[ntime][num_cld].append(np.max(cld.pos[0])-np.min(cld.pos[0]))
-
-        ## Iterating through next_clds to get all the clouds in sequence for each tracking and their associated cloud properties
-        while len(cld.next_clds)>0:
+        ## get all the clouds in sequence for each tracking, starting from each cloud
+        cld   = clds_at_time[ntime][num_cld]
+        track = [cld]
+        while next_in_track.get(cld.id) is not None:
+            cld = next_in_track[cld.id]
+            track.append(cld)
+        cloud_list[ntime][num_cld]   = track
+        cloud_top[ntime][num_cld]    = np.array([c.top for c in track])
+        cloud_base[ntime][num_cld]   = np.array([c.base for c in track])
+        cloud_volume[ntime][num_cld] = np.array([c.size for c in track])
+        cloud_depth[ntime][num_cld]  = np.array([c.depth for c in track])
 
-              cloud_list[ntime][num_cld].append(cld.next_clds[0])
-
-              cld = cld.next_clds[0]
-
-              cloud_top[ntime][num_cld].append(np.max(cld.pos[0]))
-
-              cloud_base[ntime][num_cld].append(np.min(cld.pos[0]))
-
-              cloud_volume[ntime][num_cld].append(cld.size)
-
-              cloud_depth[ntime][num_cld].append(np.max(cld.pos[0])-np.min(cld.pos[0]))
-           
     ## life time of each track
-    for num_cld in range(1, len(cloud_list[ntime])+1):
-        track_num[ntime].append(len(cloud_list[ntime][num_cld]))
+    num_clds       = np.arange(1, len(cloud_list[ntime])+1)
+    track_num[ntime] = np.array([len(cloud_list[ntime][num_cld]) for num_cld in num_clds])
 
     ## now group the tracks based on their life time
+    num_clds_life = group_by_bins(num_clds, track_num[ntime], life_time)
+    cloud_list_life[ntime]   = {}
+    cloud_top_life[ntime]    = {}
+    cloud_base_life[ntime]   = {}
+    cloud_volume_life[ntime] = {}
+    cloud_depth_life[ntime]  = {}
     for life_num in range(0, len(life_time)-1):
-        cloud_list_life[ntime][life_num]   = []
-        cloud_top_life[ntime][life_num]    = []
-        cloud_base_life[ntime][life_num]   = []
-        cloud_volume_life[ntime][life_num] = []
-        cloud_depth_life[ntime][life_num]  = []
-        for num_cld in range(1, len(cloud_list[ntime])+1):
-            length = len(cloud_list[ntime][num_cld])
-            if length > life_time[life_num] and length <= life_time[life_num+1]:
-                cloud_list_life[ntime][life_num].append(cloud_list[ntime][num_cld])
-                cloud_top_life[ntime][life_num].append(cloud_top[ntime][num_cld])
-                cloud_base_life[ntime][life_num].append(cloud_base[ntime][num_cld])
-                cloud_volume_life[ntime][life_num].append(cloud_volume[ntime][num_cld])
-                cloud_depth_life[ntime][life_num].append(cloud_depth[ntime][num_cld])
+        cloud_list_life[ntime][life_num]   = [cloud_list[ntime][n] for n in num_clds_life[life_num]]
+        cloud_top_life[ntime][life_num]    = [cloud_top[ntime][n] for n in num_clds_life[life_num]]
+        cloud_base_life[ntime][life_num]   = [cloud_base[ntime][n] for n in num_clds_life[life_num]]
+        cloud_volume_life[ntime][life_num] = [cloud_volume[ntime][n] for n in num_clds_life[life_num]]
+        cloud_depth_life[ntime][life_num]  = [cloud_depth[ntime][n] for n in num_clds_life[life_num]]
 
 ##### write out the cloud list #####
 ## cloud_list ##
@@ -166,7 +120,7 @@ pickle.dump(cloud_depth,f)
 f.close()
 
 ## cloud_list grouped by life time##
-f = open(resultpath+'/tracked_cc_clw_cloud_list.pkl','wb')
+f = open(resultpath+'/tracked_cc_clw_cloud_list_life.pkl','wb')
 pickle.dump(cloud_list_life,f)
 f.close()
 
@@ -48,8 +48,12 @@ if __name__ == '__main__':
                       dx, dx, include_touching=True, touching_diagonal=True,
                       track_3d=True, track_level=30)
 
+    ## read the next netCDF slices while the current one is tracked ##
+    tracker.add_prefetch(num_ahead=2)
     tracker.track()
     tracker.group()
+    ## clouds whose centroids are within 20 grid-cells of a neighbour are clustered ##
+    tracker.cluster(20 * dx)
 
     ###########################
     ###### write files ########
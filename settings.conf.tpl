@@ -4,3 +4,7 @@ expts = S0,S4
 filename_glob = atmos.288.pp1.nc
 results_dir = results
 level = 17
+cluster_dist = 5000
+dx = 1000
+# Uncomment to track at several thresholds of w (m/s) in one pass.
+# thresholds = 0.5,1,2
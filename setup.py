@@ -10,5 +10,5 @@ setup(
     author_email='mark.muetzelfeldt@reading.ac.uk',
     description='Simple cloud tracking',
     requires=['numpy', 'iris', 'matplotlib'],
-    scripts=['bin/track_clouds'],
+    scripts=['bin/track_clouds', 'bin/compare_runs'],
 )